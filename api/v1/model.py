@@ -1,65 +1,122 @@
 
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, status
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+import logging
 import os
-import shutil
+import re
 import uuid
-import imghdr
 from typing import List
-from PIL import Image as PILImage
-from database import SessionLocal
+from database import get_async_db, utcnow
 from models.PetImage import PetImage as PetImageModel
-from schemas.pet_image import PetImageResponseSchema, PetImageRequestSchema
-from utils.encode import encrypt_int, decrypt_string
-from openai import OpenAI
-import base64
-from utils.prompts import PROMPTS_DICT
-
-client = OpenAI()
+from models.GenerationJob import GenerationJob as GenerationJobModel, JOB_QUEUED, JOB_DONE, JOB_FAILED, PENDING_JOB_STATUSES
+from schemas.pet_image import PetImageMetadataSchema, PetImageResponseSchema, PetImageRequestSchema, PetImageBatchRequestSchema, TemplateSchema
+from schemas.generation_job import GenerationJobResponseSchema, GenerationBatchResponseSchema
+from utils.auth import CurrentUser, get_current_user
+from utils.derivatives import DERIVATIVE_MEDIA_TYPES, derivative_key, derivative_names, derivative_urls
+from utils.archive import archive_cache, folder_content_hash, iter_file_range, parse_range
+from utils.encode import encrypt_int, decode_id_or_400
+from utils.image_generation import GENERATED_IMAGES_DIR, generation_cache_key, result_filename
+from utils.job_queue import job_queue, worker_name
+from utils.image_processing import (
+    UPLOAD_DIR,
+    UPLOAD_TMP_DIR,
+    MAX_IMAGE_PIXELS,
+    ImageHashes,
+    ImageTooLargeError,
+    InvalidImageError,
+    UploadTooLargeError,
+    normalize_image,
+    run_in_image_executor,
+    save_upload_to_disk,
+    sniff_image_type,
+)
+from utils.retention import touch_cache_entry
+from utils.snapshot_cache import get_pet_image, pet_images
+from utils.storage import join_key, shard_key, storage
+from utils.templates import registry as template_registry
+from utils.timing import StageTimer
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Configuration
-UPLOAD_DIR = "uploaded_images"
-GENERATED_IMAGES_DIR = "generated_images"
-
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 # Define accepted image types
 ACCEPTED_IMAGE_TYPES = ["jpeg", "jpg", "png", "gif", "bmp", "webp"]
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10 MB
+# Derivatives are addressed by content hash and never change
+PREVIEW_CACHE_CONTROL = "public, max-age=31536000, immutable"
+RESULT_HASH_RE = re.compile(r"[0-9a-f]{64}")
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-def validate_image(file: UploadFile) -> bool:
+def validate_image(content_type: str, header: bytes) -> bool:
     """Validate if the uploaded file is a valid image and meets requirements."""
     # Check content type
-    content_type = file.content_type
     if not content_type or not content_type.startswith("image/"):
         return False
-    
-    # Read the first chunk to detect file type
-    contents = file.file.read(1024)
-    file.file.seek(0)  # Reset file pointer
-    
-    # Use imghdr to detect the image type
-    image_type = imghdr.what(None, contents)
+
+    # Detect the image type from the magic bytes of the first chunk
+    image_type = sniff_image_type(header)
     if not image_type or image_type not in ACCEPTED_IMAGE_TYPES:
         return False
-    
+
     return True
 
+def _find_duplicate(db: Session, hashes: ImageHashes, user_id: int):
+    """
+    Find a stored image with exactly the same pixels.
+
+    The perceptual hash ignores colour and small edits, so a match on it is a different
+    image; it is only logged when the same user uploads a near-duplicate.
+    """
+    duplicate = db.query(PetImageModel).filter(PetImageModel.content_hash == hashes.content_hash).first()
+    if not duplicate:
+        similar = db.query(PetImageModel.id).filter(
+            PetImageModel.perceptual_hash == hashes.perceptual_hash,
+            PetImageModel.user_id == user_id,
+        ).first()
+        if similar:
+            logger.info("Near-duplicate upload", extra={"user_id": user_id, "similar_image_id": similar.id})
+    return duplicate
+
+def _store_pet_image(db: Session, image_key: str, hashes: ImageHashes, user_id: int,
+                     duplicate: PetImageModel = None) -> PetImageModel:
+    # Re-uploads of an unpaid image resume the owner's existing record
+    if duplicate and not duplicate.is_payed and duplicate.user_id == user_id:
+        duplicate.updated_at = utcnow()
+        db.commit()
+        return duplicate
+
+    pet_image = PetImageModel(
+        image_url=image_key,
+        generated_images_folder_path=None,
+        content_hash=hashes.content_hash,
+        perceptual_hash=hashes.perceptual_hash,
+        user_id=user_id,
+    )
+    db.add(pet_image)
+    db.commit()
+    db.refresh(pet_image)
+    return pet_image
+
+def _remove_file(path):
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
 @router.post("/upload-pet-image/", 
              response_model=PetImageResponseSchema, 
              status_code=status.HTTP_201_CREATED)
 async def upload_pet_image(
+    response: Response,
     Image: UploadFile = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
     # Validate file size
     if Image.size and Image.size > MAX_IMAGE_SIZE:
@@ -68,156 +125,503 @@ async def upload_pet_image(
             detail=f"Image size exceeds the maximum allowed size of {MAX_IMAGE_SIZE // (1024 * 1024)} MB"
         )
 
-    # Check if it's actually an image
-    if not validate_image(Image):
-        raise HTTPException(
-            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            detail=f"Uploaded file is not a valid image. Only {', '.join(ACCEPTED_IMAGE_TYPES)} formats are supported."
-        )
+    # Ensure the scratch directory exists
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
 
-    # Ensure upload directory exists
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    timer = StageTimer()
+    upload_path = os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}.upload")
+    file_path = None
 
     try:
-        # Read upload into Pillow
-        Image.file.seek(0)
-        pil_img = PILImage.open(Image.file)
+        # Stream the multipart body to disk in chunks
+        with timer.stage("receive"):
+            try:
+                header = await save_upload_to_disk(Image, upload_path, MAX_IMAGE_SIZE)
+            except UploadTooLargeError:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Image size exceeds the maximum allowed size of {MAX_IMAGE_SIZE // (1024 * 1024)} MB"
+                )
 
-        # Convert to RGBA if it has transparency, else to RGB
-        if pil_img.mode in ("RGBA", "LA") or (pil_img.mode == "P" and "transparency" in pil_img.info):
-            pil_img = pil_img.convert("RGBA")
-        else:
-            pil_img = pil_img.convert("RGB")
+        # Check if it's actually an image
+        if not validate_image(Image.content_type, header):
+            raise HTTPException(
+                status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                detail=f"Uploaded file is not a valid image. Only {', '.join(ACCEPTED_IMAGE_TYPES)} formats are supported."
+            )
 
         # Generate a unique PNG filename
-        filename = f"{uuid.uuid4()}.png"
-        file_path = os.path.join(UPLOAD_DIR, filename)
+        filename = f"{uuid.uuid4().hex}.png"
+        file_path = os.path.join(UPLOAD_TMP_DIR, filename)
+
+        # Decode and save as PNG on the image executor; the pixel budget is checked before decoding
+        with timer.stage("encode"):
+            try:
+                hashes = await run_in_image_executor(normalize_image, upload_path, file_path)
+            except ImageTooLargeError:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Image dimensions exceed the maximum of {MAX_IMAGE_PIXELS // 1_000_000} megapixels"
+                )
+            except InvalidImageError:
+                raise HTTPException(
+                    status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                    detail=f"Uploaded file is not a valid image. Only {', '.join(ACCEPTED_IMAGE_TYPES)} formats are supported."
+                )
+
+        # Duplicate uploads reuse the stored object
+        with timer.stage("dedup"):
+            duplicate = await db.run_sync(_find_duplicate, hashes, current_user.id)
+            if duplicate and not await run_in_threadpool(storage.exists, duplicate.image_url):
+                duplicate = None
 
-        # Save as PNG
-        pil_img.save(file_path, format="PNG")
+        if duplicate:
+            image_key = duplicate.image_url
+        else:
+            image_key = shard_key(UPLOAD_DIR, filename)
+            with timer.stage("store"):
+                await run_in_threadpool(storage.put_file, image_key, file_path)
 
         # Persist record in DB
-        pet_image = PetImageModel(
-            image_url=file_path,
-            generated_images_folder_path=None
-        )
-        db.add(pet_image)
-        db.commit()
-        db.refresh(pet_image)
+        with timer.stage("db"):
+            pet_image = await db.run_sync(_store_pet_image, image_key, hashes, current_user.id, duplicate)
+
+        response.headers["Server-Timing"] = timer.server_timing_header()
 
         return PetImageResponseSchema(
-            image_url=file_path,
+            image_url=pet_image.image_url,
             encoded_image_id=encrypt_int(pet_image.id),
         )
 
+    except HTTPException:
+        raise
     except Exception as e:
-        # Cleanup on error
-        if 'file_path' in locals() and os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except OSError:
-                pass
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Image upload failed: {str(e)}"
-        )     
-              
-@router.post("/generate-image")
+        )
+    finally:
+        # Scratch files; the normalized image is already moved into storage unless it was a duplicate
+        _remove_file(upload_path)
+        _remove_file(file_path)
+
+@router.get("/templates", response_model=List[TemplateSchema])
+async def list_templates():
+    # Public: the catalogue is shown before sign-in
+    return [
+        TemplateSchema(name=name, species=list(template_registry.get(name).prompt_keys))
+        for name in template_registry.names()
+    ]
+
+def _job_response(job: GenerationJobModel) -> GenerationJobResponseSchema:
+    return GenerationJobResponseSchema(
+        job_id=encrypt_int(job.id),
+        encoded_image_id=encrypt_int(job.pet_image_id),
+        status=job.status,
+        template=job.template,
+        prompt_key=job.prompt_key,
+        variant=job.variant,
+        attempts=job.attempts,
+        generated_image_path=job.result_path,
+        preview_urls=derivative_urls(job.result_hash),
+        error=job.error,
+    )
+
+def _find_cached_result(db: Session, cache_key: str):
+    return db.query(GenerationJobModel).filter(
+        GenerationJobModel.cache_key == cache_key,
+        GenerationJobModel.status == JOB_DONE,
+        GenerationJobModel.result_path.isnot(None)
+    ).first()
+
+def _copy_cached_results(copies):
+    """Copy cached results into their new folders; jobs whose cached object is gone are queued instead."""
+    for job, source_path in copies:
+        try:
+            if source_path != job.result_path:
+                storage.copy(source_path, job.result_path)
+            touch_cache_entry(source_path)
+        except FileNotFoundError:
+            job.status = JOB_QUEUED
+            job.result_path = None
+            job.result_hash = None
+
+def _get_pet_image(db: Session, decrypted_id: int, user_id: int) -> PetImageModel:
+    # Other users' images are reported as missing
+    pet_image = db.query(PetImageModel).filter(
+        PetImageModel.id == decrypted_id,
+        PetImageModel.user_id == user_id
+    ).first()
+
+    if not pet_image:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
+
+    # All results for an image are written into one folder
+    if not pet_image.generated_images_folder_path:
+        pet_image.generated_images_folder_path = shard_key(GENERATED_IMAGES_DIR, uuid.uuid4().hex)
+
+    return pet_image
+
+def _prompt_key_or_400(template: str, species: str) -> str:
+    try:
+        return template_registry.prompt_key(template, species)
+    except KeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported template/species. Available templates: {', '.join(template_registry.names())}"
+        )
+
+def _create_job(db: Session, pet_image: PetImageModel, template: str, prompt_key: str, copies: list,
+                variant: int = 0, batch_id: str = None) -> GenerationJobModel:
+    """
+    Create a job for one output, completing it immediately from the result cache when possible.
+
+    Cache hits are appended to copies as (job, cached result path) for _copy_cached_results.
+    A job already waiting or running for the same output is returned instead of a new one;
+    in a batch it joins the batch unless it belongs to another batch.
+    """
+    # Reuse a job that is already waiting or running for this output, so the output is
+    # generated (and its result file written) once
+    job = db.query(GenerationJobModel).filter(
+        GenerationJobModel.pet_image_id == pet_image.id,
+        GenerationJobModel.template == template,
+        GenerationJobModel.prompt_key == prompt_key,
+        GenerationJobModel.variant == variant,
+        GenerationJobModel.status.in_(PENDING_JOB_STATUSES)
+    ).first()
+    if job:
+        if batch_id and not job.batch_id:
+            job.batch_id = batch_id
+        return job
+
+    job = GenerationJobModel(
+        pet_image_id=pet_image.id,
+        status=JOB_QUEUED,
+        template=template,
+        prompt_key=prompt_key,
+        variant=variant,
+        batch_id=batch_id,
+        # This worker's pool runs it
+        worker=worker_name(),
+    )
+    if pet_image.content_hash:
+        job.cache_key = generation_cache_key(pet_image.content_hash, template, prompt_key, variant)
+        cached = _find_cached_result(db, job.cache_key)
+        if cached:
+            # Same template, prompt and source pixels: the earlier result is copied into this image's folder
+            job.result_path = join_key(pet_image.generated_images_folder_path, result_filename(template, prompt_key, variant))
+            job.result_hash = cached.result_hash
+            job.status = JOB_DONE
+            copies.append((job, cached.result_path))
+
+    db.add(job)
+    return job
+
+def _submit_queued(jobs):
+    for job in jobs:
+        if job.status == JOB_QUEUED:
+            job_queue.submit(job.id)
+
+@router.post("/generate-image",
+             response_model=GenerationJobResponseSchema,
+             status_code=status.HTTP_202_ACCEPTED)
 async def generate_image(
     details: PetImageRequestSchema,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
+    prompt_key = _prompt_key_or_400(details.template, details.species)
+    # decrypt the image ID
+    decrypted_id = decode_id_or_400(details.image_id, "image_id")
+
+    def enqueue(session: Session):
+        pet_image = _get_pet_image(session, decrypted_id, current_user.id)
+        copies = []
+        job = _create_job(session, pet_image, details.template, prompt_key, copies)
+        return job, copies
+
     try:
-        # decrypt the image ID
-        decrypted_id = decrypt_string(details.image_id)
-        pet_image = db.query(PetImageModel).filter(PetImageModel.id == decrypted_id).first()
-        
-        if not pet_image:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Image not found"
-            )
-        
-        # Here you would call your image generation logic
-        result = client.images.edit(
-        model="gpt-image-1",
-        image=[
-                open("image_templates/magistrate_template.png", "rb"),
-                open(pet_image.image_url, "rb")
-            ],
-            prompt=PROMPTS_DICT['magistrate_prompt_cat']
-        )
-
-        image_base64 = result.data[0].b64_json
-        image_bytes = base64.b64decode(image_base64)
-        
-        # save the generated image to generated_images_folder_path
-        generated_folder_path = os.path.join(GENERATED_IMAGES_DIR, str(uuid.uuid4()))
-        os.makedirs(generated_folder_path, exist_ok=True)
-        generated_image_path = os.path.join(generated_folder_path, "generated_image.png")
-
-        with open(generated_image_path, "wb") as f:
-            f.write(image_bytes)
-
-        print(decrypted_id, pet_image.image_url)
-
-        return {
-                "message": "Image generated successfully",
-                "generated_image_path": generated_image_path,
-                "image_url": pet_image.image_url,
-                "encoded_image_id": decrypted_id
-            }
+        job, copies = await db.run_sync(enqueue)
+        # Storage calls stay off the event loop
+        await run_in_threadpool(_copy_cached_results, copies)
+        await db.commit()
+        await db.refresh(job)
+        _submit_queued([job])
+
+        return _job_response(job)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Image generation failed: {str(e)}"
+        )
+
+@router.get("/generate-image/{job_id}", response_model=GenerationJobResponseSchema)
+async def get_generation_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    decrypted_id = decode_id_or_400(job_id, "job_id")
+    result = await db.execute(
+        select(GenerationJobModel)
+        .join(PetImageModel, PetImageModel.id == GenerationJobModel.pet_image_id)
+        .filter(GenerationJobModel.id == decrypted_id, PetImageModel.user_id == current_user.id)
+    )
+    job = result.scalars().first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found"
+        )
+
+    return _job_response(job)
+
+def _batch_response(batch_id: str, jobs) -> GenerationBatchResponseSchema:
+    return GenerationBatchResponseSchema(
+        batch_id=batch_id,
+        encoded_image_id=encrypt_int(jobs[0].pet_image_id),
+        jobs=[_job_response(job) for job in jobs],
+    )
+
+async def _get_batch_jobs(db: AsyncSession, batch_id: str, user_id: int):
+    result = await db.execute(
+        select(GenerationJobModel)
+        .join(PetImageModel, PetImageModel.id == GenerationJobModel.pet_image_id)
+        .filter(GenerationJobModel.batch_id == batch_id, PetImageModel.user_id == user_id)
+        .order_by(GenerationJobModel.id)
+    )
+    jobs = result.scalars().all()
+    if not jobs:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Batch not found"
+        )
+    return jobs
+
+@router.post("/generate-batch",
+             response_model=GenerationBatchResponseSchema,
+             status_code=status.HTTP_202_ACCEPTED)
+async def generate_batch(
+    details: PetImageBatchRequestSchema,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    templates = details.templates or [
+        name for name in template_registry.names()
+        if details.species in template_registry.get(name).prompt_keys
+    ]
+    # Repeated templates would queue the same outputs twice
+    prompt_keys = [(template, _prompt_key_or_400(template, details.species)) for template in dict.fromkeys(templates)]
+    # decrypt the image ID
+    decrypted_id = decode_id_or_400(details.image_id, "image_id")
+
+    batch_id = str(uuid.uuid4())
+
+    def enqueue(session: Session):
+        pet_image = _get_pet_image(session, decrypted_id, current_user.id)
+        copies = []
+        jobs = [
+            _create_job(session, pet_image, template, prompt_key, copies, variant, batch_id)
+            for template, prompt_key in prompt_keys
+            for variant in range(details.variants)
+        ]
+        return jobs, copies
+
+    try:
+        jobs, copies = await db.run_sync(enqueue)
+        await run_in_threadpool(_copy_cached_results, copies)
+        await db.commit()
+        for job in jobs:
+            await db.refresh(job)
+
+        # Fan out; the worker pool and rate limiter bound the concurrent calls
+        _submit_queued(jobs)
 
+        return _batch_response(batch_id, jobs)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Image generation failed: {str(e)}"
         )
-        
+
+@router.get("/generate-batch/{batch_id}", response_model=GenerationBatchResponseSchema)
+async def get_generation_batch(
+    batch_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    return _batch_response(batch_id, await _get_batch_jobs(db, batch_id, current_user.id))
+
+@router.post("/generate-batch/{batch_id}/retry",
+             response_model=GenerationBatchResponseSchema,
+             status_code=status.HTTP_202_ACCEPTED)
+async def retry_generation_batch(
+    batch_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    jobs = await _get_batch_jobs(db, batch_id, current_user.id)
+
+    # Only failed variants are generated again
+    failed = [job for job in jobs if job.status == JOB_FAILED]
+    for job in failed:
+        job.status = JOB_QUEUED
+        job.attempts = 0
+        job.error = None
+        job.worker = worker_name()
+    await db.commit()
+    _submit_queued(failed)
+
+    return _batch_response(batch_id, jobs)
+
+def _read_object(key: str) -> bytes:
+    with storage.open(key) as source:
+        return source.read()
+
+# Public so <img> tags can load them: previews are watermarked and low resolution,
+# and their URLs (by content hash) are only handed out in the owner's job responses
+@router.get("/previews/{result_hash}/{name}")
+async def get_preview(result_hash: str, name: str, request: Request):
+    if not RESULT_HASH_RE.fullmatch(result_hash) or name not in derivative_names():
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Preview not found"
+        )
+
+    etag = f'"{result_hash}-{name}"'
+    headers = {"ETag": etag, "Cache-Control": PREVIEW_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    try:
+        data = await run_in_threadpool(_read_object, derivative_key(result_hash, name))
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Preview not found"
+        )
+
+    fmt = name.rsplit(".", 1)[1]
+    media_type = DERIVATIVE_MEDIA_TYPES.get(fmt, f"image/{fmt}")
+    return Response(content=data, media_type=media_type, headers=headers)
+
+@router.get("/pet-images/{image_id}", response_model=PetImageMetadataSchema)
+async def get_pet_image_metadata(
+    image_id: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    decrypted_id = decode_id_or_400(image_id, "image_id")
+    pet_image = await get_pet_image(db, decrypted_id)
+    if not pet_image or pet_image["user_id"] != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
+
+    # The folder is assigned when the first job is queued; only a finished result counts
+    result = await db.execute(
+        select(GenerationJobModel.id).where(
+            GenerationJobModel.pet_image_id == decrypted_id,
+            GenerationJobModel.status == JOB_DONE,
+            GenerationJobModel.result_path.isnot(None),
+        ).limit(1)
+    )
+
+    return PetImageMetadataSchema(
+        encoded_image_id=image_id,
+        image_url=pet_image["image_url"],
+        is_payed=pet_image["is_payed"],
+        payment_status=pet_image["payment_status"],
+        has_generated_images=result.first() is not None,
+        created_at=pet_image["created_at"],
+    )
+
 # Download the Images from the generated_images_folder_path only if the user has paid
 @router.get("/download-image/{image_id}")
 async def download_image(
     image_id: str,
-    db: Session = Depends(get_db),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
 ):
+    # decrypt the image ID
+    decrypted_id = decode_id_or_400(image_id, "image_id")
     try:
-        # decrypt the image ID
-        decrypted_id = decrypt_string(image_id)
-        pet_image = db.query(PetImageModel).filter(PetImageModel.id == decrypted_id).first()
+        pet_image = await get_pet_image(db, decrypted_id)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Image download failed: {str(e)}"
+        )
 
-        if not pet_image:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Image not found"
-            )
+    if not pet_image or pet_image["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Image not found"
+        )
 
-        if not pet_image.is_payed:
-            raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="Image not paid for"
-            )
-            
-        # zip the files in the generated_images_folder_path but check if generated_images_folder_path is not None
-        if pet_image.generated_images_folder_path:
-            folder_path = pet_image.generated_images_folder_path
-            zip_filename = f"{uuid.uuid4()}.zip"
-            zip_filepath = os.path.join(GENERATED_IMAGES_DIR, zip_filename)
-
-            shutil.make_archive(zip_filepath.replace('.zip', ''), 'zip', folder_path)
-            
-            return {
-                "message": "Image downloaded successfully",
-                "download_link": zip_filepath
-            }
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Generated images folder not found"
+    if not pet_image["is_payed"]:
+        # Another worker may have recorded the payment after this one cached the image
+        pet_images.invalidate(decrypted_id)
+        pet_image = await get_pet_image(db, decrypted_id)
+    if not pet_image or not pet_image["is_payed"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Image not paid for"
+        )
+
+    folder_path = pet_image["generated_images_folder_path"]
+    key = await run_in_threadpool(folder_content_hash, folder_path) if folder_path else None
+    if not key:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Generated images folder not found"
+        )
+    etag = f'"{key}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="fur-and-furble-{image_id}.zip"',
+    }
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    # Looking up the cache touches the disk, so it stays off the event loop
+    cached = await run_in_threadpool(archive_cache.stat, key)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # Ranges are served from a finished archive; without one the whole archive is streamed, as RFC 9110 allows
+    if cached and range_header and (not if_range or if_range == etag):
+        archive_path, size = cached
+        byte_range = parse_range(range_header, size)
+        if not byte_range:
+            return Response(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                headers={**headers, "Content-Range": f"bytes */{size}"},
             )
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file_range(archive_path, start, end),
+            status_code=status.HTTP_206_PARTIAL_CONTENT,
+            media_type="application/zip",
+            headers=headers,
+        )
 
+    if cached:
+        archive_path, size = cached
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(iter_file_range(archive_path, 0, size - 1), media_type="application/zip", headers=headers)
 
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Image download failed: {str(e)}"
-        )
\ No newline at end of file
+    # Build the zip on the fly while sending it
+    return StreamingResponse(archive_cache.stream(folder_path, key), media_type="application/zip", headers=headers)
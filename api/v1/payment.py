@@ -1,91 +1,147 @@
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from datetime import timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from utils.auth import send_verification_email, generate_verification_token
 from models.PetImage import PetImage as PetImageModel
+from models.StripeEvent import StripeEvent as StripeEventModel
 from schemas.payment import PaymentIntentImageSchema, PaymentResponseSchema, PaymentInputSchema, PaymentConfirmationSchema
-from utils.encode import decrypt_string
-from database import SessionLocal
+from utils.auth import CurrentUser, get_current_user
+from utils.encode import decode_id_or_400
+from database import get_db, get_async_db
+from utils.archive import prebuild_archive
+from utils.snapshot_cache import pet_images
+from utils.stripe_client import forget_payment_intent, get_or_create_payment_intent
+from utils.tracing import span
+import logging
 import os
 from dotenv import load_dotenv
-import stripe
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 load_dotenv()
 
-stripe.api_key = os.getenv("STRIPE_PRIVATE_KEY")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# PaymentIntent events applied by the webhook, mapped to the status they record
+PAYMENT_EVENT_STATUSES = {
+    "payment_intent.succeeded": "succeeded",
+    "payment_intent.payment_failed": "failed",
+    "payment_intent.canceled": "canceled",
+}
 
 @router.post("/create-payment-intent/", response_model=PaymentIntentImageSchema)
-def create_payment_intent(payment: PaymentInputSchema, db: Session = Depends(get_db)):
+async def create_payment_intent(
+    payment: PaymentInputSchema,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    # Reject malformed ids before calling Stripe
+    image_id = decode_id_or_400(payment.image_id, "image_id")
 
-    try:
-        intent = stripe.PaymentIntent.create(
-            amount=1900,                 # cents
-            currency="usd",
-            payment_method_types=["card"]
-        )
-        # get the pet image where id is image_id, then update the stripe_payment_id
-        pet_image = db.query(PetImageModel).filter_by(id=decrypt_string(payment.image_id)).first()
+    # get the caller's pet image where id is image_id
+    result = await db.execute(select(PetImageModel).where(PetImageModel.id == image_id, PetImageModel.user_id == current_user.id))
+    pet_image = result.scalars().first()
+    if not pet_image:
+        raise HTTPException(status_code=404, detail="Pet image not found")
+    if pet_image.is_payed:
+        raise HTTPException(status_code=409, detail="Pet image is already paid for")
 
-        if not pet_image:
-            raise HTTPException(status_code=404, detail="Pet image not found")
+    try:
+        # Retries and double clicks get the image's open intent back instead of a new one
+        intent = await get_or_create_payment_intent(image_id, pet_image.stripe_payment_id)
+    except Exception:
+        logger.exception("Error creating payment intent")
+        raise HTTPException(status_code=400, detail="Error creating payment intent")
 
+    if (pet_image.stripe_payment_id, pet_image.payment_status) != (intent.id, intent.status):
         pet_image.stripe_payment_id = intent.id
-        db.commit()
+        pet_image.payment_status = intent.status
+        await db.commit()
 
-        return PaymentIntentImageSchema(
-            image_id=payment.image_id,
-            stripe_payment_id=intent.id,
-            client_secret=intent.client_secret
-        )
-        
-    except Exception as e:
-        print(e)
-        raise HTTPException(status_code=400, detail="Error creating payment intent")
+    return PaymentIntentImageSchema(
+        image_id=payment.image_id,
+        stripe_payment_id=intent.id,
+        client_secret=intent.client_secret
+    )
 
 @router.post("/confirm-payment/", response_model=PaymentResponseSchema)
-def confirm_payment(req: PaymentConfirmationSchema, db: Session = Depends(get_db)):
-    # 1) Retrieve the PaymentIntent from Stripe to verify status
-    try:
-        intent = stripe.PaymentIntent.retrieve(req.stripe_payment_id)
-    except Exception as e:
-        raise HTTPException(status_code=400, detail="Invalid payment_intent_id")
-
-    # 2) Look up our Order
-    order = db.query(PetImageModel).filter_by(stripe_payment_id=intent.id).first()
+def confirm_payment(
+    req: PaymentConfirmationSchema,
+    db: Session = Depends(get_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    # Payment state is recorded by the Stripe webhook; answer from the local record
+    order = db.query(PetImageModel).filter_by(stripe_payment_id=req.stripe_payment_id, user_id=current_user.id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # 3) Check status
-    if intent.status == "succeeded" and not order.is_payed:
-        order.is_payed = True
-        db.commit()
-        
+    if order.is_payed:
         return PaymentResponseSchema(
             image_id=req.image_id,
-            payment_status=intent.status,
+            payment_status="succeeded",
             message="Payment was successful."
         )
 
-    if intent.status != "succeeded":
-        return PaymentResponseSchema(
-            image_id=req.image_id,
-            payment_status=intent.status,
-            message="Payment was not successful."
-        )
-
-    # Already paid
     return PaymentResponseSchema(
         image_id=req.image_id,
-        payment_status=intent.status,
-        message="Payment was already completed."
-    )
\ No newline at end of file
+        payment_status=order.payment_status or "processing",
+        message="Payment was not successful."
+    )
+
+@router.post("/webhook")
+async def stripe_webhook(request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    # The Stripe SDK is imported on first use to keep it out of process startup
+    import stripe
+
+    payload = await request.body()
+    signature = request.headers.get("stripe-signature")
+
+    try:
+        with span("stripe.webhook.construct_event"):
+            event = stripe.Webhook.construct_event(payload, signature, STRIPE_WEBHOOK_SECRET)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+
+    payment_status = PAYMENT_EVENT_STATUSES.get(event["type"])
+    if payment_status is None:
+        return {"received": True}
+
+    intent_id = event["data"]["object"]["id"]
+
+    # Recording the event id and the payment update in one transaction makes redelivery a no-op
+    db.add(StripeEventModel(id=event["id"], type=event["type"]))
+    values = {PetImageModel.payment_status: payment_status}
+    if payment_status == "succeeded":
+        values[PetImageModel.is_payed] = True
+    await db.execute(
+        update(PetImageModel)
+        .where(PetImageModel.stripe_payment_id == intent_id, PetImageModel.is_payed.isnot(True))
+        .values(values)
+    )
+
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return {"received": True, "duplicate": True}
+
+    if payment_status != "failed":
+        # Failed intents stay open for another attempt; paid or canceled ones are not handed out again
+        forget_payment_intent(intent_id)
+
+    result = await db.execute(
+        select(PetImageModel.id, PetImageModel.generated_images_folder_path).where(PetImageModel.stripe_payment_id == intent_id)
+    )
+    row = result.first()
+    if row is None:
+        return {"received": True}
+    # The bulk UPDATE bypasses the ORM events that invalidate cached snapshots
+    pet_images.invalidate(row.id)
+
+    if payment_status == "succeeded":
+        # Post-payment pipeline: have the download ready before it is requested
+        background_tasks.add_task(prebuild_archive, row.generated_images_folder_path)
+
+    return {"received": True}
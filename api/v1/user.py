@@ -1,110 +1,125 @@
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
+import logging
+import os
 
 from schemas.user import UserCreate, LoginSchema, UserResponseSchema
-from utils.auth import send_verification_email, generate_verification_token
-from database import SessionLocal
+from utils.auth import build_verification_email, generate_verification_token, VERIFICATION_PURPOSE
+from database import get_db, get_async_db
 from models.User import User as UserModel
-from utils.auth import get_password_hash, verify_password, create_access_token, verify_token
+from utils.auth import CurrentUser, create_access_token, get_current_user, verify_token
+from utils.password_hashing import hash_password, verify_password, needs_rehash
+from utils.rate_limit import KeyedConcurrencyLimiter
+from utils.mail_queue import mail_sender
+from utils.snapshot_cache import get_user_profile, user_profile_snapshot, user_profiles
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Concurrent login attempts allowed per client IP
+LOGIN_CONCURRENCY_PER_IP = int(os.getenv("LOGIN_CONCURRENCY_PER_IP", "2"))
+login_limiter = KeyedConcurrencyLimiter(LOGIN_CONCURRENCY_PER_IP)
 
 @router.post("/register", response_model=UserResponseSchema, status_code=status.HTTP_201_CREATED)
-def register(user_data: UserCreate, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
-    # Hash the password
-    hashed_password = get_password_hash(user_data.password)
+async def register(user_data: UserCreate, background_tasks: BackgroundTasks, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Hash the password on the hashing process pool
+    hashed_password = await hash_password(user_data.password)
 
     # Create a new user instance
     new_user = UserModel(
         name=user_data.name,
         email=user_data.email,
+        hashed_password=hashed_password,
+        country_id=user_data.country_id,
         is_verified=False  # Set the initial verification status
     )
 
+    # Generate a verification token
+    verification_token = generate_verification_token(
+        data={"sub": new_user.email, "purpose": VERIFICATION_PURPOSE}, expires_delta=timedelta(days=1)
+    )
+
     try:
-        # Add and commit the new user to the database
+        # Add the new user and queue the verification email in one transaction;
+        # the background sender delivers it
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-    except IntegrityError as e:
-        print(e)
-        db.rollback()
+        db.add(build_verification_email(new_user.email, verification_token, new_user.name))
+        await db.commit()
+        await db.refresh(new_user)
+    except IntegrityError:
+        logger.info("Registration rejected: email or name already in use")
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
 
-    # Generate a verification token
-    verification_token = create_access_token(data={"sub": new_user.email}, expires_delta=timedelta(days=1))
-
-    # Send the verification email
-    send_verification_email(new_user.email, verification_token, new_user.name)
+    mail_sender.notify()
 
     # Prepare user response data
-    user_response = UserResponseSchema(
-        id=new_user.id,
-        email=new_user.email,
-        name=new_user.name,
-        is_suspended=new_user.is_suspended,
-        image=new_user.user_image,
-        credits=new_user.credits,
-        country_id=new_user.country_id,
-        is_verified=new_user.is_verified,  # Include the verification status
-    )
+    profile = user_profile_snapshot(new_user)
+    await user_profiles.set(new_user.id, profile)
 
-    return user_response
+    return UserResponseSchema(**profile)
 
 @router.get("/verify", status_code=status.HTTP_200_OK)
-def verify_account(token: str, db: Session = Depends(get_db)):
+async def verify_account(token: str, db: AsyncSession = Depends(get_async_db)):
     email = verify_token(token)
     if not email:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token")
 
-    user = db.query(UserModel).filter(UserModel.email == email).first()
+    result = await db.execute(select(UserModel).filter(UserModel.email == email))
+    user = result.scalars().first()
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
 
-    # Verify the user
+    # Verify the user; the commit invalidates the cached profile and tokens
     user.is_verified = True
-    db.commit()
-    db.refresh(user)
+    await db.commit()
 
     return {"message": "Account verified successfully"}
 
 @router.post("/login", response_model=dict, status_code=status.HTTP_200_OK)
-def login(login_data: LoginSchema, db: Session = Depends(get_db)):
-    # Find the user by email
-    user = db.query(UserModel).filter(UserModel.email == login_data.email).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
-
-    # Verify the password
-    if not verify_password(login_data.password, user.hashed_password):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
+async def login(login_data: LoginSchema, request: Request, db: AsyncSession = Depends(get_async_db)):
+    client_ip = request.client.host if request.client else "unknown"
+    with login_limiter.slot(client_ip) as acquired:
+        if not acquired:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many concurrent login attempts")
+
+        # Find the user by email
+        result = await db.execute(select(UserModel).filter(UserModel.email == login_data.email))
+        user = result.scalars().first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
+
+        # Verify the password
+        if not await verify_password(login_data.password, user.hashed_password):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email or password")
+
+        # Upgrade hashes made with a different cost factor
+        if needs_rehash(user.hashed_password):
+            user.hashed_password = await hash_password(login_data.password)
+            await db.commit()
 
     # Create an access token
     access_token = create_access_token(data={"sub": user.email})
 
-    # Prepare user response data (excluding sensitive information)
-    user_response = UserResponseSchema(
-        id=user.id,
-        email=user.email,
-        name=user.name,
-        is_suspended=user.is_suspended,
-        image=user.user_image,
-        credits=user.credits,
-        country_id=user.country_id,
-        is_verified=user.is_verified,  # Include the verification status
-        role=user.role
-    )
+    # Prepare user response data (excluding sensitive information); later profile reads are served from it
+    profile = user_profile_snapshot(user)
+    await user_profiles.set(user.id, profile)
 
     return {
         "access_token": access_token,
-        "user": user_response
-    }
\ No newline at end of file
+        "user": UserResponseSchema(**profile)
+    }
+
+@router.get("/me", response_model=UserResponseSchema)
+async def read_profile(
+    db: AsyncSession = Depends(get_async_db),
+    current_user: CurrentUser = Depends(get_current_user),
+):
+    profile = await get_user_profile(db, current_user.id)
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return UserResponseSchema(**profile)
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+Measure the per-request cost of authenticating a bearer token.
+
+Run from the repository root against a scratch database:
+
+    DATABASE_URL=sqlite:///./bench_auth.db python -m benchmarks.bench_auth --requests 5000
+
+Compares decoding the token with the raw secret plus a user query on every
+request (what each endpoint would do on its own) with get_current_user on a
+cache miss and on a cache hit, and token decoding with the raw secret against
+the prebuilt signing key.
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+from sqlalchemy import delete
+
+from database import AsyncSessionLocal, SessionLocal, create_db_and_tables
+from models.User import User
+from utils.auth import (
+    JWT_ALGORITHM,
+    JWT_SECRET_KEY,
+    JWT_SIGNING_KEY,
+    create_access_token,
+    get_current_user,
+    token_cache,
+)
+
+EMAIL = "bench-auth@example.com"
+
+
+def seed():
+    create_db_and_tables()
+    db = SessionLocal()
+    try:
+        db.execute(delete(User).where(User.email == EMAIL))
+        db.add(User(name="bench-auth", email=EMAIL, hashed_password="x", country_id=1))
+        db.commit()
+    finally:
+        db.close()
+
+
+def decode_only(token: str, key, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        jwt.decode(token, key, algorithms=[JWT_ALGORITHM])
+    return time.perf_counter() - start
+
+
+def uncached(token: str, requests: int) -> float:
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            db.query(User).filter(User.email == payload["sub"]).first()
+        return time.perf_counter() - start
+    finally:
+        db.close()
+
+
+async def dependency(token: str, requests: int, cached: bool) -> float:
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    async with AsyncSessionLocal() as db:
+        await get_current_user(credentials, db)
+        start = time.perf_counter()
+        for _ in range(requests):
+            if not cached:
+                token_cache.clear()
+            await get_current_user(credentials, db)
+        return time.perf_counter() - start
+
+
+def report(name: str, elapsed: float, requests: int):
+    print(f"{name:<28}{elapsed / requests * 1e6:>10.1f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    seed()
+    token = create_access_token({"sub": EMAIL})
+
+    report("decode, raw secret", decode_only(token, JWT_SECRET_KEY, args.requests), args.requests)
+    report("decode, prebuilt key", decode_only(token, JWT_SIGNING_KEY, args.requests), args.requests)
+    report("decode + query (uncached)", uncached(token, args.requests), args.requests)
+    report("get_current_user (miss)", asyncio.run(dependency(token, args.requests, cached=False)), args.requests)
+    report("get_current_user (hit)", asyncio.run(dependency(token, args.requests, cached=True)), args.requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure how long importing the web tier takes and fail when it exceeds the budget.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_import_time [--runs 5 --budget-ms 1200]
+
+Each run imports main in a fresh interpreter with "python -X importtime" and
+the best run is reported with the slowest top-level imports. The check fails
+(exit status 1) when that run takes longer than --budget-ms, or when one of
+DEFERRED_MODULES was imported at startup; those SDKs are loaded on first use.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.load_test import REPO_ROOT
+
+# Budget for "import main", in milliseconds
+IMPORT_BUDGET_MS = 1200
+# Loaded on first use, never while the app starts
+DEFERRED_MODULES = ("openai", "stripe", "brevo_python", "boto3", "redis", "torch", "diffusers", "transformers", "django")
+
+
+def import_times(env: dict):
+    """
+    Import main once; returns {module: (cumulative microseconds, nesting depth)}.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=REPO_ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(cumulative), depth)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=12, help="slowest top-level imports to list")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'import.db')}")
+        env.setdefault("JWT_SECRET_KEY", "bench")
+        runs = [import_times(env) for _ in range(args.runs)]
+
+    best = min(runs, key=lambda modules: modules["main"][0])
+    total_ms = best["main"][0] / 1000
+    deferred = sorted(name for name in best if name.split(".")[0] in DEFERRED_MODULES)
+    top = sorted(((cumulative, name) for name, (cumulative, depth) in best.items() if 0 < depth <= 2), reverse=True)
+
+    print(f"import main: {total_ms:.0f} ms (best of {args.runs}), budget {args.budget_ms:.0f} ms")
+    for cumulative, name in top[:args.top]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"total_ms": total_ms, "budget_ms": args.budget_ms, "deferred_imported": deferred,
+                       "top": [{"module": name, "ms": cumulative / 1000} for cumulative, name in top[:args.top]]},
+                      f, indent=2)
+
+    failed = False
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import time is over budget by {total_ms - args.budget_ms:.0f} ms")
+        failed = True
+    if deferred:
+        print(f"FAIL: imported at startup, should be loaded on first use: {', '.join(sorted({n.split('.')[0] for n in deferred}))}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measure CPU throughput of the local diffusion backend with and without request batching.
+
+Run from the repository root (needs the local-inference extra):
+
+    python -m benchmarks.bench_local_inference [--concurrency 1,2,4 --images 8 --steps 10 --resolution 256x320]
+
+The model is loaded once, then --images generations for the first template are
+submitted from --concurrency threads, as generation workers would. Each level
+runs with batching off (LOCAL_INFERENCE_MAX_BATCH=1, one forward pass per image)
+and with batches of up to the concurrency level. A small --model such as
+"hf-internal-testing/tiny-stable-diffusion-pipe" checks the plumbing quickly;
+throughput numbers only mean something with the production checkpoint.
+"""
+import argparse
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_preprocess import make_photo
+from utils.image_processing import prepare_model_input
+from utils.local_inference import (
+    LOCAL_INFERENCE_MODEL,
+    LOCAL_INFERENCE_RESOLUTION,
+    LOCAL_INFERENCE_STEPS,
+    LocalDiffusionBackend,
+)
+from utils.templates import registry
+
+
+def run(backend: LocalDiffusionBackend, template, model_input: bytes, images: int, concurrency: int):
+    prompt = next(iter(template.prompts.values()))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: backend.generate(template, prompt, model_input), range(images)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=LOCAL_INFERENCE_MODEL)
+    parser.add_argument("--steps", type=int, default=LOCAL_INFERENCE_STEPS)
+    parser.add_argument("--resolution", default=LOCAL_INFERENCE_RESOLUTION)
+    parser.add_argument("--concurrency", default="1,2,4", help="comma-separated numbers of concurrent requests")
+    parser.add_argument("--images", type=int, default=8, help="generations per measurement")
+    parser.add_argument("--batch-wait-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    try:
+        import diffusers  # noqa: F401
+        import torch
+    except ImportError:
+        raise SystemExit("install the local-inference extra (torch, diffusers)")
+
+    registry.load()
+    template = registry.get(registry.names()[0])
+    model_input = prepare_model_input(io.BytesIO(make_photo(1024, 768)))
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    backends = {}
+    started = time.perf_counter()
+    shared = LocalDiffusionBackend(args.model, args.steps, args.resolution, max_batch=1)
+    shared.warm()
+    load_seconds = time.perf_counter() - started
+    for max_batch in sorted({1, *levels}):
+        backend = LocalDiffusionBackend(args.model, args.steps, args.resolution, max_batch=max_batch,
+                                        batch_wait_ms=args.batch_wait_ms)
+        # Share the loaded pipeline; each backend only differs in how it batches
+        backend._pipeline, backend._pipeline_pid = shared._pipeline, shared._pipeline_pid
+        backends[max_batch] = backend
+
+    width, height = shared.size
+    print(f"model {args.model}, {args.steps} steps, {width}x{height}, {torch.get_num_threads()} torch threads, "
+          f"loaded in {load_seconds:.1f} s")
+    # One untimed generation so lazy initialization is not measured
+    run(backends[1], template, model_input, 1, 1)
+    print(f"{'concurrency':>12}{'max batch':>11}{'images/min':>12}{'s/image':>10}")
+    for concurrency in levels:
+        for max_batch in sorted({1, concurrency}):
+            elapsed = run(backends[max_batch], template, model_input, args.images, concurrency)
+            print(f"{concurrency:>12}{max_batch:>11}{args.images / elapsed * 60:>12.2f}{elapsed / args.images:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
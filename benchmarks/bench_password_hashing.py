@@ -0,0 +1,51 @@
+"""
+Measure bcrypt login throughput against the number of hashing processes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_password_hashing [--rounds 12 --logins 64]
+
+For each worker count from 1 to the number of cores, a burst of password
+verifications is pushed through a process pool the same way the login
+endpoint does, and logins per second are reported.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.password_hashing import hash_password_sync, verify_password_sync
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost factor")
+    parser.add_argument("--logins", type=int, default=64, help="verifications per measurement")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    password = "correct horse battery staple"
+    hashed = hash_password_sync(password, args.rounds)
+
+    start = time.perf_counter()
+    verify_password_sync(password, hashed)
+    single = time.perf_counter() - start
+    print(f"cost {args.rounds}: one verification takes {single * 1000:.0f} ms on this machine")
+    print(f"{'workers':>8}{'logins/s':>12}{'speedup':>10}")
+
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Warm the worker processes before timing
+            list(executor.map(verify_password_sync, [password] * workers, [hashed] * workers))
+            start = time.perf_counter()
+            list(executor.map(verify_password_sync, [password] * args.logins, [hashed] * args.logins))
+            elapsed = time.perf_counter() - start
+
+        throughput = args.logins / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>8}{throughput:>12.1f}{throughput / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measure repeated create-payment-intent calls for one image against a local Stripe stub.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_payment_intent [--calls 20 --stripe-latency 0.3]
+
+Starts benchmarks.stub_services and compares creating a new PaymentIntent on
+every call (what the endpoint used to do) with get_or_create_payment_intent:
+the first call, repeats answered from the client secret cache, repeats that
+retrieve the recorded intent, and retries that lost the recorded intent and
+are resolved by the idempotency key. Also reports how many distinct intents
+each path left behind.
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+import stripe
+
+from benchmarks.load_test import REPO_ROOT, stop, wait_until_ready
+from utils import stripe_client
+from utils.stripe_client import get_or_create_payment_intent, intent_cache
+
+
+def create_every_call(calls: int, image_id: int):
+    intent_ids = set()
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        intent = stripe.PaymentIntent.create(amount=1900, currency="usd", payment_method_types=["card"],
+                                             metadata={"pet_image_id": str(image_id)})
+        latencies.append(time.perf_counter() - start)
+        intent_ids.add(intent.id)
+    return latencies, intent_ids
+
+
+async def reuse(calls: int, image_id: int, recorded: str, clear_cache: bool):
+    intent_ids = set()
+    latencies = []
+    for _ in range(calls):
+        if clear_cache:
+            intent_cache.clear()
+        start = time.perf_counter()
+        intent = await get_or_create_payment_intent(image_id, recorded)
+        latencies.append(time.perf_counter() - start)
+        intent_ids.add(intent.id)
+    return latencies, intent_ids
+
+
+def report(name: str, latencies, intent_ids):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2]
+    print(f"{name:<32}{p50 * 1000:>10.2f}{latencies[-1] * 1000:>10.2f}{len(intent_ids):>10}")
+
+
+async def run_reuse(calls: int, image_id: int):
+    first, first_ids = await reuse(1, image_id, None, clear_cache=True)
+    report("get_or_create, first call", first, first_ids)
+    recorded = next(iter(first_ids))
+    report("get_or_create, cached", *await reuse(calls, image_id, recorded, clear_cache=False))
+    report("get_or_create, retrieve", *await reuse(calls, image_id, recorded, clear_cache=True))
+    latencies, retried_ids = await reuse(calls, image_id, None, clear_cache=True)
+    report("get_or_create, idempotent retry", latencies, retried_ids | first_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--stripe-latency", type=float, default=0.3)
+    parser.add_argument("--stub-port", type=int, default=8102)
+    args = parser.parse_args()
+
+    api_base = f"http://127.0.0.1:{args.stub_port}"
+    stripe.api_key = stripe_client.STRIPE_PRIVATE_KEY = "sk_test_stub"
+    stripe.api_base = stripe_client.STRIPE_API_BASE = api_base
+
+    stubs = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.stub_services", "--port", str(args.stub_port),
+        "--stripe-latency", str(args.stripe_latency),
+    ], cwd=REPO_ROOT, start_new_session=True)
+    try:
+        wait_until_ready(f"{api_base}/docs", stubs, 30)
+        print(f"{args.calls} calls per path, stub Stripe latency {args.stripe_latency} s")
+        print(f"{'path':<32}{'p50 (ms)':>10}{'max (ms)':>10}{'intents':>10}")
+        report("create every call", *create_every_call(args.calls, image_id=1))
+        asyncio.run(run_reuse(args.calls, image_id=2))
+    finally:
+        stop(stubs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Seed a large pet_images table and check the plans of its lookup queries.
+
+Run from the repository root against a scratch database (SQLite by default,
+or a local MySQL through DATABASE_URL):
+
+    DATABASE_URL=sqlite:///./bench_queries.db python -m benchmarks.bench_pet_image_queries --rows 2000000
+
+The schema comes from the migrations. Rows are inserted in batches, then every
+lookup path used by the API and the retention job is explained and timed.
+"""
+import argparse
+import random
+import time
+from datetime import timedelta
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import text
+
+from database import engine, utcnow
+
+BATCH_SIZE = 20_000
+
+QUERIES = {
+    "by id": "SELECT * FROM pet_images WHERE id = :id",
+    "by stripe_payment_id": "SELECT * FROM pet_images WHERE stripe_payment_id = :stripe_payment_id",
+    "by content_hash": "SELECT * FROM pet_images WHERE content_hash = :content_hash",
+    "by user_id": "SELECT * FROM pet_images WHERE user_id = :user_id",
+    "unpaid past retention": "SELECT id FROM pet_images WHERE is_payed = 0 AND updated_at < :cutoff",
+    "created in a day": "SELECT COUNT(*) FROM pet_images WHERE created_at >= :start AND created_at < :end",
+}
+
+
+def seed(rows: int):
+    now = utcnow()
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO users (id, name, email) VALUES (1, 'bench', 'bench@example.com')"))
+
+    inserted = 0
+    while inserted < rows:
+        batch = []
+        for i in range(inserted, min(inserted + BATCH_SIZE, rows)):
+            created = now - timedelta(minutes=random.randint(0, 60 * 24 * 365))
+            paid = random.random() < 0.2
+            batch.append({
+                "image_url": f"uploaded_images/{i}.png",
+                "is_payed": paid,
+                "stripe_payment_id": f"pi_{i}" if paid or random.random() < 0.3 else None,
+                "content_hash": f"{i:064x}",
+                "perceptual_hash": f"{i:016x}",
+                "user_id": 1 if i % 1000 == 0 else None,
+                "created_at": created,
+                "updated_at": created,
+            })
+        with engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO pet_images (image_url, is_payed, stripe_payment_id, content_hash, perceptual_hash,"
+                " user_id, created_at, updated_at) VALUES (:image_url, :is_payed, :stripe_payment_id,"
+                " :content_hash, :perceptual_hash, :user_id, :created_at, :updated_at)"
+            ), batch)
+        inserted += len(batch)
+        print(f"seeded {inserted}/{rows}", end="\r", flush=True)
+    print()
+
+
+def explain(connection, sql: str, params: dict):
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    return [" | ".join(str(value) for value in row) for row in connection.execute(text(prefix + sql), params)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse an already seeded database")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        command.upgrade(Config("alembic.ini"), "head")
+        seed(args.rows)
+
+    now = utcnow()
+    params = {
+        "id": args.rows // 2,
+        "stripe_payment_id": f"pi_{args.rows // 3}",
+        "content_hash": f"{args.rows // 4:064x}",
+        "user_id": 1,
+        "cutoff": now - timedelta(days=300),
+        "start": now - timedelta(days=2),
+        "end": now - timedelta(days=1),
+    }
+
+    with engine.connect() as connection:
+        for name, sql in QUERIES.items():
+            plan = explain(connection, sql, params)
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                connection.execute(text(sql), params).fetchall()
+            elapsed = (time.perf_counter() - start) / args.repeat
+            print(f"{name:<24}{elapsed * 1000:>10.2f} ms")
+            for line in plan:
+                print(f"    {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare the image edit payload before and after input preprocessing.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_preprocess [--width 4032 --height 3024 --mbps 20]
+
+A synthetic phone-sized photo is encoded the way uploads used to be stored
+(full-resolution PNG) and the way they are sent now (canonicalized and
+downscaled). Transfer time is estimated from the given uplink bandwidth.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+from PIL import Image as PILImage, ImageDraw
+
+from utils.image_processing import MODEL_MAX_EDGE, normalize_image, prepare_model_input
+
+
+def make_photo(width: int, height: int) -> bytes:
+    # Gradient background with noise and a blob so PNG cannot compress it away
+    noise = PILImage.effect_noise((width, height), 40).convert("RGB")
+    gradient = PILImage.linear_gradient("L").resize((width, height)).convert("RGB")
+    img = PILImage.blend(gradient, noise, 0.5)
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((width // 3, height // 4, 2 * width // 3, 3 * height // 4), fill=(180, 120, 60))
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def time_call(func, *args, repeat: int = 3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def raw_png(path: str) -> bytes:
+    with PILImage.open(path) as img:
+        buffer = io.BytesIO()
+        img.convert("RGB").save(buffer, format="PNG")
+        return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--mbps", type=float, default=20.0, help="uplink bandwidth to the API in Mbit/s")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "photo.jpg")
+        with open(source, "wb") as f:
+            f.write(make_photo(args.width, args.height))
+
+        before, before_time = time_call(raw_png, source)
+
+        stored = os.path.join(tmp, "stored.png")
+        _, normalize_time = time_call(normalize_image, source, stored)
+        after, after_time = time_call(prepare_model_input, stored)
+
+    bytes_per_second = args.mbps * 1_000_000 / 8
+    rows = [
+        ("before", len(before), before_time, len(before) / bytes_per_second),
+        ("after", len(after), normalize_time + after_time, len(after) / bytes_per_second),
+    ]
+
+    print(f"source {args.width}x{args.height}, model max edge {MODEL_MAX_EDGE}, uplink {args.mbps} Mbit/s")
+    print(f"{'path':<8}{'payload (KB)':>14}{'encode (ms)':>14}{'transfer (ms)':>16}{'total (ms)':>13}")
+    for name, size, encode_time, transfer_time in rows:
+        print(f"{name:<8}{size / 1024:>14.0f}{encode_time * 1000:>14.1f}"
+              f"{transfer_time * 1000:>16.1f}{(encode_time + transfer_time) * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Count database reads and time profile and pet image metadata requests with the snapshot caches.
+
+Run from the repository root against a scratch database:
+
+    DATABASE_URL=sqlite:///./bench_profile.db python -m benchmarks.bench_profile_cache --requests 2000
+
+Requests go through the routers in-process. Each path is measured with the
+caches cleared before every request (every read hits the database), with the
+in-process tier, and with only the Redis tier (the local tier cleared, as for
+a request landing on another worker). The Redis tier is an in-memory fake
+(fakeredis) unless --redis-url points at a real server. Finally a credit change
+is committed through the ORM to check that the next read sees it.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import delete, event
+
+from database import SessionLocal, async_engine, create_db_and_tables
+from models.PetImage import PetImage
+from models.User import User
+from utils.auth import create_access_token
+from utils.encode import encrypt_int
+from utils.snapshot_cache import RedisTier, pet_images, user_profiles
+
+EMAIL = "bench-profile@example.com"
+CACHES = (user_profiles, pet_images)
+
+
+def seed():
+    create_db_and_tables()
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.email == EMAIL).first()
+        if user:
+            db.execute(delete(PetImage).where(PetImage.user_id == user.id))
+            db.delete(user)
+            db.commit()
+        user = User(name="bench-profile", email=EMAIL, hashed_password="x", country_id=1, is_verified=True)
+        db.add(user)
+        db.commit()
+        pet_image = PetImage(image_url="uploaded_images/bench.png", user_id=user.id)
+        db.add(pet_image)
+        db.commit()
+        return user.id, pet_image.id
+    finally:
+        db.close()
+
+
+def set_credits(user_id: int, credits: float):
+    db = SessionLocal()
+    try:
+        db.query(User).filter(User.id == user_id).first().credits = credits
+        db.commit()
+    finally:
+        db.close()
+
+
+def create_redis_tier(url: str):
+    if url:
+        return RedisTier.from_url(url)
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("install fakeredis or pass --redis-url")
+    server = fakeredis.FakeServer()
+    return RedisTier(fakeredis.FakeAsyncRedis(server=server), fakeredis.FakeRedis(server=server), ttl=300)
+
+
+def create_app() -> FastAPI:
+    from api.v1 import model, user
+
+    app = FastAPI()
+    app.include_router(user.router, prefix="/api/v1/users")
+    app.include_router(model.router, prefix="/api/v1/models")
+    return app
+
+
+async def measure(client, path: str, headers: dict, requests: int, mode: str, statements: list):
+    for cache in CACHES:
+        cache.clear()
+    await client.get(path, headers=headers)
+    statements.clear()
+    start = time.perf_counter()
+    for _ in range(requests):
+        if mode != "local":
+            # Uncached runs have no Redis tier, so this empties every tier
+            for cache in CACHES:
+                cache.clear()
+        response = await client.get(path, headers=headers)
+        response.raise_for_status()
+    elapsed = time.perf_counter() - start
+    return elapsed / requests, len(statements) / requests
+
+
+async def run(args, user_id: int, image_id: int):
+    statements = []
+    event.listen(async_engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': EMAIL})}"}
+    paths = {
+        "GET /users/me": "/api/v1/users/me",
+        "GET /models/pet-images/{id}": f"/api/v1/models/pet-images/{encrypt_int(image_id)}",
+    }
+    redis_tier = create_redis_tier(args.redis_url)
+
+    transport = httpx.ASGITransport(app=create_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        print(f"{'path':<30}{'mode':<10}{'us/request':>12}{'DB reads/request':>18}")
+        for name, path in paths.items():
+            for mode, tier in (("uncached", None), ("local", None), ("redis", redis_tier)):
+                for cache in CACHES:
+                    cache.redis_tier = tier
+                per_request, reads = await measure(client, path, headers, args.requests, mode, statements)
+                print(f"{name:<30}{mode:<10}{per_request * 1e6:>12.1f}{reads:>18.2f}")
+
+        for cache in CACHES:
+            cache.redis_tier = redis_tier
+        await client.get(paths["GET /users/me"], headers=headers)
+        await asyncio.to_thread(set_credits, user_id, 42.0)
+        credits = (await client.get(paths["GET /users/me"], headers=headers)).json()["credits"]
+        print(f"credits after an ORM update: {credits} ({'invalidated' if credits == 42.0 else 'STALE'})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--redis-url", help="measure against a real Redis instead of fakeredis")
+    args = parser.parse_args()
+
+    user_id, image_id = seed()
+    asyncio.run(run(args, user_id, image_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Measure peak memory of decoding an upload before and after low-memory decoding.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_upload_memory [--sizes 4032x3024 8064x6048]
+
+Each size is a synthetic phone photo saved as a JPEG. Every run happens in a
+fresh process so the peak RSS of one run does not hide the next; the figure
+reported is the peak RSS above what the process held before decoding. "before"
+decodes the full image and converts it in memory, as uploads used to be
+handled. "after" is normalize_image, which decodes JPEGs at reduced scale.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image as PILImage, ImageOps
+
+from benchmarks.bench_preprocess import make_photo
+from utils.image_processing import MAX_IMAGE_PIXELS, MODEL_MAX_EDGE, normalize_image
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def full_decode(source: str, dest: str):
+    with PILImage.open(source) as pil_img:
+        converted = ImageOps.exif_transpose(pil_img).convert("RGB")
+        resized = converted.copy()
+        resized.thumbnail((MODEL_MAX_EDGE, MODEL_MAX_EDGE), PILImage.LANCZOS)
+        resized.save(dest, format="PNG")
+
+
+def peak_rss() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def current_rss() -> int:
+    # Current resident size where /proc is available; otherwise the peak so far
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss()
+
+
+def measure(func, source: str, dest: str, results):
+    baseline = current_rss()
+    start = time.perf_counter()
+    func(source, dest)
+    elapsed = time.perf_counter() - start
+    results.put((peak_rss() - baseline, elapsed))
+
+
+def write_photo(path: str, width: int, height: int, results):
+    with open(path, "wb") as f:
+        f.write(make_photo(width, height))
+    results.put(None)
+
+
+def run_isolated(target, *args):
+    # Children start with the parent's peak RSS, so nothing large may run in the parent
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def parse_size(value: str):
+    width, _, height = value.partition("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(4032, 3024), (8064, 6048)],
+                        help="photo sizes as WIDTHxHEIGHT (defaults: 12 MP and 48 MP phone photos)")
+    args = parser.parse_args()
+
+    print(f"model max edge {MODEL_MAX_EDGE}, pixel budget {MAX_IMAGE_PIXELS / 1_000_000:.0f} MP")
+    print(f"{'source':<12}{'file (MB)':>11}{'path':>8}{'peak (MB)':>12}{'time (ms)':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in args.sizes:
+            source = os.path.join(tmp, f"{width}x{height}.jpg")
+            run_isolated(write_photo, source, width, height)
+            file_size = os.path.getsize(source)
+
+            for name, func in (("before", full_decode), ("after", normalize_image)):
+                peak, elapsed = run_isolated(measure, func, source, os.path.join(tmp, "out.png"))
+                print(f"{width}x{height:<7}{file_size / 1_000_000:>11.1f}{name:>8}"
+                      f"{peak / 1_000_000:>12.0f}{elapsed * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Local stand-ins for the OpenAI images API, Stripe and Brevo, with configurable latency.
+
+Started by benchmarks.load_test; to run on its own:
+
+    python -m benchmarks.stub_services --port 8101 --openai-latency 8 --stripe-latency 0.3
+
+Point the app at it with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8101/v1 OPENAI_API_KEY=stub
+    STRIPE_API_BASE=http://127.0.0.1:8101 STRIPE_PRIVATE_KEY=sk_test_stub
+    BREVO_API_HOST=http://127.0.0.1:8101/v3 MAIL_TRANSPORT=brevo
+
+Latencies are means in seconds; each call sleeps for a value drawn uniformly
+from +/- --jitter around them. Every generated image is a distinct PNG (the
+pixels are shared, a text chunk carries a counter), so preview rendering is
+not short-circuited by the content-hash cache.
+
+--openai-error-rate makes that share of image calls fail with
+--openai-error-status (with a Retry-After header on 429s), to exercise the
+client's retries and circuit breaker.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import itertools
+import random
+import struct
+import time
+import uuid
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from PIL import Image as PILImage
+
+
+def noise_png(edge: int) -> bytes:
+    buffer = io.BytesIO()
+    PILImage.effect_noise((edge, edge), 64).convert("RGB").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def with_text_chunk(png: bytes, text: str) -> bytes:
+    """
+    Insert a tEXt chunk after IHDR, changing the file bytes without re-encoding the pixels.
+    """
+    data = b"Comment\x00" + text.encode("latin-1")
+    chunk = struct.pack(">I", len(data)) + b"tEXt" + data + struct.pack(">I", zlib.crc32(b"tEXt" + data))
+    # 8-byte signature followed by the 25-byte IHDR chunk
+    return png[:33] + chunk + png[33:]
+
+
+def create_app(openai_latency: float, stripe_latency: float, brevo_latency: float, jitter: float, image_edge: int,
+               openai_error_rate: float = 0.0, openai_error_status: int = 429):
+    app = FastAPI()
+    base_image = noise_png(image_edge)
+    counter = itertools.count()
+    intents = {}
+    # Idempotency-Key -> intent id, as Stripe replays the first response for a reused key
+    idempotent_intents = {}
+
+    async def delay(mean: float):
+        if mean > 0:
+            await asyncio.sleep(max(0.0, random.uniform(mean * (1 - jitter), mean * (1 + jitter))))
+
+    @app.post("/v1/images/edits")
+    async def images_edit(request: Request):
+        await request.body()
+        await delay(openai_latency)
+        if random.random() < openai_error_rate:
+            headers = {"retry-after": "1"} if openai_error_status == 429 else {}
+            return JSONResponse(status_code=openai_error_status, headers=headers, content={
+                "error": {"message": "Injected by the stub", "type": "stub_error", "code": None},
+            })
+        image = with_text_chunk(base_image, f"stub-{next(counter)}")
+        return {"created": int(time.time()), "data": [{"b64_json": base64.b64encode(image).decode()}]}
+
+    @app.post("/v1/payment_intents")
+    async def create_payment_intent(request: Request):
+        form = await request.form()
+        await delay(stripe_latency)
+        key = request.headers.get("idempotency-key")
+        if key in idempotent_intents:
+            return JSONResponse(intents[idempotent_intents[key]], headers={"idempotent-replayed": "true"})
+        intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        if key:
+            idempotent_intents[key] = intent_id
+        intents[intent_id] = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(form.get("amount", 0)),
+            "currency": form.get("currency", "usd"),
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:16]}",
+            "status": "requires_payment_method",
+            "metadata": {key[len("metadata["):-1]: value for key, value in form.items() if key.startswith("metadata[")},
+        }
+        return intents[intent_id]
+
+    @app.get("/v1/payment_intents/{intent_id}")
+    async def retrieve_payment_intent(intent_id: str):
+        await delay(stripe_latency)
+        if intent_id not in intents:
+            return JSONResponse(status_code=404, content={"error": {"type": "invalid_request_error", "code": "resource_missing"}})
+        return intents[intent_id]
+
+    @app.post("/v3/smtp/email", status_code=201)
+    async def send_email(request: Request):
+        await request.body()
+        await delay(brevo_latency)
+        return {"messageId": f"<{uuid.uuid4().hex}@stub>"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--openai-latency", type=float, default=8.0)
+    parser.add_argument("--stripe-latency", type=float, default=0.3)
+    parser.add_argument("--brevo-latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.25, help="relative spread around each latency")
+    parser.add_argument("--image-edge", type=int, default=1024, help="side of the generated images")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="share of image calls that fail")
+    parser.add_argument("--openai-error-status", type=int, default=429)
+    args = parser.parse_args()
+
+    app = create_app(args.openai_latency, args.stripe_latency, args.brevo_latency, args.jitter, args.image_edge,
+                     args.openai_error_rate, args.openai_error_status)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
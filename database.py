@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from dotenv import load_dotenv
+from datetime import datetime, timezone
+import asyncio
 import os
+import time
+
+from utils.metrics import DB_POOL_CHECKOUT_SECONDS, DB_POOL_CHECKED_OUT, DB_POOL_CHECKOUT_TIMEOUTS
+from utils.tracing import instrument_engine
 
 load_dotenv()
 
@@ -11,15 +19,145 @@ DB_USER = os.environ.get("DB_USER")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
 DB_NAME = os.environ.get("DB_NAME")
 
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+# DATABASE_URL overrides the MySQL settings, e.g. "sqlite:///./test.db" for tests
+SQLALCHEMY_DATABASE_URL = os.environ.get("DATABASE_URL") or f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+
+# Connection pool tuning
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+# Recycle before MySQL's wait_timeout closes idle connections ("server has gone away")
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Connections each engine opens at startup, so the first requests do not pay for the handshakes
+DB_POOL_WARM = int(os.environ.get("DB_POOL_WARM", "2"))
+
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def _async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
+
+
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL") or _async_url(SQLALCHEMY_DATABASE_URL)
+
+
+def _timed_pool(pool_class, engine_name: str):
+    """Pool subclass that records how long checkouts wait for a connection."""
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                DB_POOL_CHECKOUT_TIMEOUTS.labels(engine_name).inc()
+                raise
+            finally:
+                DB_POOL_CHECKOUT_SECONDS.labels(engine_name).observe(time.perf_counter() - start)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    return TimedPool
+
+
+def _engine_options(url: str, pool_class, engine_name: str) -> dict:
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "poolclass": _timed_pool(pool_class, engine_name),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _track_connections(sync_engine, engine_name: str):
+    gauge = DB_POOL_CHECKED_OUT.labels(engine_name)
+    event.listen(sync_engine, "checkout", lambda *args: gauge.inc())
+    event.listen(sync_engine, "checkin", lambda *args: gauge.dec())
+
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_options(SQLALCHEMY_DATABASE_URL, QueuePool, "sync"))
+_track_connections(engine, "sync")
+instrument_engine(engine, "sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The async engine is optional; it needs aiomysql (or aiosqlite for SQLite)
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+    async_engine = create_async_engine(
+        ASYNC_DATABASE_URL, **_engine_options(ASYNC_DATABASE_URL, AsyncAdaptedQueuePool, "async")
+    )
+    _track_connections(async_engine.sync_engine, "async")
+    instrument_engine(async_engine.sync_engine, "async")
+    AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+except ImportError:
+    async_engine = None
+    AsyncSessionLocal = None
+
 Base = declarative_base()
 
+
+def utcnow():
+    """
+    Naive UTC timestamp, the convention for DateTime columns.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_db():
+    """
+    Yield a blocking session; use from sync endpoints, which run in the threadpool.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """
+    Yield an AsyncSession for async endpoints so queries do not block the event loop.
+    """
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database driver is not installed (aiomysql / aiosqlite)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _warm_sync_pool(connections: int):
+    opened = [engine.connect() for _ in range(connections)]
+    for connection in opened:
+        connection.close()
+
+
+async def warm_pools(connections: int = DB_POOL_WARM):
+    """
+    Open connections in both pools and return them, ready for the first requests.
+    """
+    connections = min(connections, DB_POOL_SIZE)
+    if connections <= 0:
+        return
+    await asyncio.to_thread(_warm_sync_pool, connections)
+    if async_engine is not None:
+        opened = await asyncio.gather(*(async_engine.connect().start() for _ in range(connections)))
+        for connection in opened:
+            await connection.close()
+
+
 def create_db_and_tables():
     """
-    Create the database and tables.
+    Create the database and tables directly from the models.
+
+    Deployments use migrations instead ("alembic upgrade head"); this is for
+    throwaway databases such as SQLite in tests and benchmarks.
     """
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
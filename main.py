@@ -1,49 +1,155 @@
 from fastapi import FastAPI, Request
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from starlette.middleware.cors import CORSMiddleware
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+import asyncio
+import logging
+import os
+import time
 import uvicorn
+from contextlib import asynccontextmanager
 
 from api.v1 import user
 from api.v1 import model
 from api.v1 import payment
-from database import create_db_and_tables
+from database import warm_pools
+from utils.image_generation import check_backends, warm_backends
+from utils.job_queue import GENERATION_POOL, job_queue
+from utils.logs import configure_logging
+from utils.image_processing import UPLOAD_TMP_DIR
+from utils.metrics import WORKER_STARTUP_SECONDS, render_metrics
+from utils import derivatives, password_hashing
+from utils.mail_queue import mail_sender
+from utils.retention import prune_storage, RETENTION_INTERVAL_SECONDS
+from utils.templates import registry as template_registry
+from utils.tracing import RequestInstrumentationMiddleware
 
+# The schema is managed by migrations ("alembic upgrade head" at deploy time)
 
-# Create the database and tables
-create_db_and_tables()
+configure_logging()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
 
-# CORS Middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def initialize():
+    """
+    One-time setup: scratch directories and the template registry.
 
-# Include routers for user endpoints
-app.include_router(user.router, prefix="/api/v1/users", tags=["users"])
+    serve.py runs it once before forking the workers, which then share the loaded templates.
+    """
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    template_registry.load()
+    check_backends()
 
-# Include routers for model endpoints
-app.include_router(model.router, prefix="/api/v1/models", tags=["models"])
 
-# Include routers for payment endpoints
-app.include_router(payment.router, prefix="/api/v1/payments", tags=["payments"])
+async def run_warm_backends():
+    try:
+        await run_in_threadpool(warm_backends)
+    except Exception:
+        logger.exception("Generation backend warm-up failed")
 
-@app.get("/")
-async def root():
-    return {"message": "Welcome to the Fur and Furble API"}
 
-@app.exception_handler(Exception)
-async def global_exception_handler(request: Request, exc: Exception):
-    print(exc)
-    return JSONResponse(
-        status_code=500,
-        content={"message": "An unexpected error occurred. Please try again later."},
+async def run_retention():
+    while True:
+        try:
+            await run_in_threadpool(prune_storage)
+        except Exception:
+            logger.exception("Storage retention failed")
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+
+def create_app(primary: bool = True, initialized: bool = False, resume_job_ids=None, started_at: float = None) -> FastAPI:
+    """
+    Build the API application.
+
+    Only the primary worker resumes interrupted generation jobs and runs storage
+    retention. initialized skips initialize() when the launcher already ran it, and
+    resume_job_ids are the jobs it reset, or released from the worker this one
+    replaces; started_at (time.perf_counter()) is where the reported startup time
+    is counted from.
+    """
+    started_at = time.perf_counter() if started_at is None else started_at
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if not initialized:
+            # Read and normalize every template once, before serving requests
+            await run_in_threadpool(initialize)
+        # Open database connections now rather than on the first requests
+        await warm_pools()
+        mail_sender.start()
+        warm_task = None
+        if GENERATION_POOL != "process":
+            # Load local models in the background; jobs that arrive first wait for the same load
+            warm_task = asyncio.create_task(run_warm_backends())
+        if primary or resume_job_ids:
+            # Pick up jobs interrupted by a previous shutdown, or by the worker this one replaces
+            job_queue.resume_pending(resume_job_ids)
+        retention_task = None
+        if primary:
+            retention_task = asyncio.create_task(run_retention())
+
+        startup_seconds = time.perf_counter() - started_at
+        WORKER_STARTUP_SECONDS.set(startup_seconds)
+        logger.info("Worker ready", extra={"startup_s": round(startup_seconds, 3), "primary": primary})
+        yield
+
+        if retention_task is not None:
+            retention_task.cancel()
+        if warm_task is not None:
+            warm_task.cancel()
+        mail_sender.stop()
+        # Let running generation calls finish; whatever is cut off is resumed on the next start
+        await job_queue.drain()
+        password_hashing.shutdown()
+        derivatives.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+
+    # CORS Middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
     )
-    
+
+    # Added last so it wraps everything else: request ids, latency histograms and access logs
+    app.add_middleware(RequestInstrumentationMiddleware)
+
+    # Include routers for user endpoints
+    app.include_router(user.router, prefix="/api/v1/users", tags=["users"])
+
+    # Include routers for model endpoints
+    app.include_router(model.router, prefix="/api/v1/models", tags=["models"])
+
+    # Include routers for payment endpoints
+    app.include_router(payment.router, prefix="/api/v1/payments", tags=["payments"])
+
+    @app.get("/")
+    async def root():
+        return {"message": "Welcome to the Fur and Furble API"}
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        payload, content_type = render_metrics()
+        return Response(content=payload, media_type=content_type)
+
+    @app.exception_handler(Exception)
+    async def global_exception_handler(request: Request, exc: Exception):
+        logger.error("Unhandled error", exc_info=exc)
+        return JSONResponse(
+            status_code=500,
+            content={"message": "An unexpected error occurred. Please try again later."},
+        )
+
+    return app
+
+
+# Single-process app for "uvicorn main:app" and "python main.py"; serve.py runs several workers
+app = create_app()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
+    # Logging is configured above; the middleware replaces uvicorn's access log
+    uvicorn.run(app, host="127.0.0.1", port=8000, log_config=None, access_log=False)
@@ -0,0 +1,43 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+from database import Base, engine
+# Import every model so the metadata is complete for autogenerate
+from models import User, PetImage, GenerationJob, OutboundEmail, StripeEvent  # noqa: F401
+
+config = context.config
+
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Emit SQL to stdout instead of running it ("alembic upgrade head --sql")."""
+    context.configure(
+        url=str(engine.url.render_as_string(hide_password=False)),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with engine.connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,51 @@
+"""Baseline: users and pet_images as created by create_all
+
+Databases created before migrations existed already have this schema;
+mark them with "alembic stamp 0001" and then run "alembic upgrade head".
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(50)),
+        sa.Column("email", sa.String(100)),
+        sa.Column("hashed_password", sa.String(200)),
+        sa.Column("country_id", sa.Integer()),
+        sa.Column("user_image", sa.String(100)),
+        sa.Column("is_suspended", sa.Boolean()),
+        sa.Column("is_verified", sa.Boolean()),
+        sa.Column("credits", sa.Float()),
+    )
+    op.create_index("ix_users_id", "users", ["id"])
+    op.create_index("ix_users_name", "users", ["name"], unique=True)
+    op.create_index("ix_users_email", "users", ["email"], unique=True)
+    op.create_index("ix_users_country_id", "users", ["country_id"])
+
+    op.create_table(
+        "pet_images",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("image_url", sa.String(200), nullable=False),
+        sa.Column("generated_images_folder_path", sa.String(200), nullable=True),
+        sa.Column("is_payed", sa.Boolean()),
+        sa.Column("stripe_payment_id", sa.String(200), nullable=True, unique=True),
+    )
+    op.create_index("ix_pet_images_id", "pet_images", ["id"])
+
+
+def downgrade():
+    op.drop_table("pet_images")
+    op.drop_table("users")
@@ -0,0 +1,77 @@
+"""Generation jobs, outbound emails, Stripe events and image hashes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("pet_images") as batch:
+        batch.add_column(sa.Column("payment_status", sa.String(30), nullable=True))
+        batch.add_column(sa.Column("content_hash", sa.String(64), nullable=True))
+        batch.add_column(sa.Column("perceptual_hash", sa.String(16), nullable=True))
+    op.create_index("ix_pet_images_content_hash", "pet_images", ["content_hash"])
+    op.create_index("ix_pet_images_perceptual_hash", "pet_images", ["perceptual_hash"])
+
+    op.create_table(
+        "generation_jobs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pet_image_id", sa.Integer(), sa.ForeignKey("pet_images.id"), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("template", sa.String(50), nullable=False),
+        sa.Column("prompt_key", sa.String(100), nullable=False),
+        sa.Column("batch_id", sa.String(36), nullable=True),
+        sa.Column("variant", sa.Integer(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("cache_key", sa.String(64), nullable=True),
+        sa.Column("result_path", sa.String(200), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_generation_jobs_id", "generation_jobs", ["id"])
+    op.create_index("ix_generation_jobs_pet_image_id", "generation_jobs", ["pet_image_id"])
+    op.create_index("ix_generation_jobs_status", "generation_jobs", ["status"])
+    op.create_index("ix_generation_jobs_batch_id", "generation_jobs", ["batch_id"])
+    op.create_index("ix_generation_jobs_cache_key", "generation_jobs", ["cache_key"])
+
+    op.create_table(
+        "outbound_emails",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("recipient", sa.String(100), nullable=False),
+        sa.Column("recipient_name", sa.String(100), nullable=True),
+        sa.Column("subject", sa.String(200), nullable=False),
+        sa.Column("html_content", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+    )
+    op.create_index("ix_outbound_emails_id", "outbound_emails", ["id"])
+    op.create_index("ix_outbound_emails_status", "outbound_emails", ["status"])
+    op.create_index("ix_outbound_emails_next_attempt_at", "outbound_emails", ["next_attempt_at"])
+
+    op.create_table(
+        "stripe_events",
+        sa.Column("id", sa.String(255), primary_key=True),
+        sa.Column("type", sa.String(100), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("stripe_events")
+    op.drop_table("outbound_emails")
+    op.drop_table("generation_jobs")
+    op.drop_index("ix_pet_images_perceptual_hash", table_name="pet_images")
+    op.drop_index("ix_pet_images_content_hash", table_name="pet_images")
+    with op.batch_alter_table("pet_images") as batch:
+        batch.drop_column("perceptual_hash")
+        batch.drop_column("content_hash")
+        batch.drop_column("payment_status")
@@ -0,0 +1,47 @@
+"""pet_images timestamps, owner and lookup indexes
+
+Adds created_at / updated_at (backfilled with the migration time), a
+nullable user_id foreign key, and the composite index used by retention
+scans of unpaid images. is_payed becomes NOT NULL so equality lookups can
+use the index.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("UPDATE pet_images SET is_payed = 0 WHERE is_payed IS NULL")
+
+    with op.batch_alter_table("pet_images") as batch:
+        batch.alter_column("is_payed", existing_type=sa.Boolean(), nullable=False, server_default=sa.false())
+        batch.add_column(sa.Column("user_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("created_at", sa.DateTime(), nullable=False, server_default=sa.func.now()))
+        batch.add_column(sa.Column("updated_at", sa.DateTime(), nullable=False, server_default=sa.func.now()))
+        batch.create_foreign_key("fk_pet_images_user_id_users", "users", ["user_id"], ["id"])
+
+    op.create_index("ix_pet_images_user_id", "pet_images", ["user_id"])
+    op.create_index("ix_pet_images_created_at", "pet_images", ["created_at"])
+    op.create_index("ix_pet_images_is_payed_updated_at", "pet_images", ["is_payed", "updated_at"])
+
+
+def downgrade():
+    op.drop_index("ix_pet_images_is_payed_updated_at", table_name="pet_images")
+    op.drop_index("ix_pet_images_created_at", table_name="pet_images")
+    op.drop_index("ix_pet_images_user_id", table_name="pet_images")
+
+    with op.batch_alter_table("pet_images") as batch:
+        batch.drop_constraint("fk_pet_images_user_id_users", type_="foreignkey")
+        batch.drop_column("updated_at")
+        batch.drop_column("created_at")
+        batch.drop_column("user_id")
+        batch.alter_column("is_payed", existing_type=sa.Boolean(), nullable=True, server_default=None)
@@ -0,0 +1,24 @@
+"""generation_jobs.result_hash for preview derivatives
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("generation_jobs") as batch:
+        batch.add_column(sa.Column("result_hash", sa.String(64), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("generation_jobs") as batch:
+        batch.drop_column("result_hash")
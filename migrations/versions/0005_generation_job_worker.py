@@ -0,0 +1,26 @@
+"""generation_jobs.worker so a crashed worker's jobs can be requeued
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("generation_jobs") as batch:
+        batch.add_column(sa.Column("worker", sa.String(100), nullable=True))
+    op.create_index("ix_generation_jobs_worker", "generation_jobs", ["worker"])
+
+
+def downgrade():
+    op.drop_index("ix_generation_jobs_worker", table_name="generation_jobs")
+    with op.batch_alter_table("generation_jobs") as batch:
+        batch.drop_column("worker")
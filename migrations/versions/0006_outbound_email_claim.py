@@ -0,0 +1,24 @@
+"""outbound_emails.claimed_at so emails are claimed before they are sent
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("outbound_emails") as batch:
+        batch.add_column(sa.Column("claimed_at", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("outbound_emails") as batch:
+        batch.drop_column("claimed_at")
@@ -0,0 +1,34 @@
+# models/GenerationJob.py
+
+from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from database import Base
+
+# Job lifecycle states
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+PENDING_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class GenerationJob(Base):
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    pet_image_id = Column(Integer, ForeignKey("pet_images.id"), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default=JOB_QUEUED, index=True)
+    template = Column(String(50), nullable=False, default="magistrate")
+    prompt_key = Column(String(100), nullable=False, default="magistrate_prompt_cat")
+    # Jobs created by one batch request share a batch id
+    batch_id = Column(String(36), nullable=True, index=True)
+    variant = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Hash of (template, prompt, source image) used to reuse finished results
+    cache_key = Column(String(64), nullable=True, index=True)
+    result_path = Column(String(200), nullable=True)
+    # Content hash of the result; its thumbnails and previews are stored under it
+    result_hash = Column(String(64), nullable=True)
+    error = Column(Text, nullable=True)
+    # Process that queued or claimed the job ("host:pid"); serve.py requeues the jobs of a worker that dies
+    worker = Column(String(100), nullable=True, index=True)
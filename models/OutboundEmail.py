@@ -0,0 +1,28 @@
+# models/OutboundEmail.py
+
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from database import Base, utcnow
+
+# Delivery states
+EMAIL_PENDING = "pending"
+# Claimed by a sender and committed before the send, so a crash cannot resend a whole batch
+EMAIL_SENDING = "sending"
+EMAIL_SENT = "sent"
+EMAIL_FAILED = "failed"
+
+
+class OutboundEmail(Base):
+    __tablename__ = "outbound_emails"
+
+    id = Column(Integer, primary_key=True, index=True)
+    recipient = Column(String(100), nullable=False)
+    recipient_name = Column(String(100), nullable=True)
+    subject = Column(String(200), nullable=False)
+    html_content = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default=EMAIL_PENDING, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Naive UTC; the sender only picks up rows whose next attempt is due
+    next_attempt_at = Column(DateTime, nullable=False, default=utcnow, index=True)
+    last_error = Column(Text, nullable=True)
+    # Naive UTC; when a sender claimed the row
+    claimed_at = Column(DateTime, nullable=True)
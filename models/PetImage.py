@@ -1,15 +1,27 @@
-# models/user.py
+# models/PetImage.py
 
-from sqlalchemy import Column, Float, Integer, String, Boolean
+from sqlalchemy import Column, Float, Integer, String, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
-from database import Base
+from database import Base, utcnow
 
 class PetImage(Base):
     __tablename__ = "pet_images"
+    __table_args__ = (
+        # Retention scans: unpaid images not touched since a cutoff
+        Index("ix_pet_images_is_payed_updated_at", "is_payed", "updated_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     image_url = Column(String(200), nullable=False)
     generated_images_folder_path = Column(String(200), nullable=True)
-    is_payed = Column(Boolean, default=False)
+    is_payed = Column(Boolean, nullable=False, default=False)
     stripe_payment_id = Column(String(200), nullable=True, unique=True)
+    # Last PaymentIntent status seen from Stripe
+    payment_status = Column(String(30), nullable=True)
+    # SHA-256 of the normalized pixels and 64-bit difference hash (hex)
+    content_hash = Column(String(64), nullable=True, index=True)
+    perceptual_hash = Column(String(16), nullable=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    created_at = Column(DateTime, nullable=False, default=utcnow, index=True)
+    updated_at = Column(DateTime, nullable=False, default=utcnow, onupdate=utcnow)
     
\ No newline at end of file
@@ -0,0 +1,11 @@
+# models/StripeEvent.py
+
+from sqlalchemy import Column, String
+from database import Base
+
+class StripeEvent(Base):
+    """Stripe webhook events that have already been applied."""
+    __tablename__ = "stripe_events"
+
+    id = Column(String(255), primary_key=True)
+    type = Column(String(100), nullable=False)
@@ -0,0 +1,28 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+
+
+class GenerationJobResponseSchema(BaseModel):
+    """
+    Schema for the state of an image generation job.
+    """
+    job_id: str
+    encoded_image_id: str
+    status: str
+    template: str
+    prompt_key: str
+    variant: int = 0
+    attempts: int = 0
+    generated_image_path: Optional[str] = None
+    # Watermarked thumbnail and preview URLs keyed by "<kind>.<format>", e.g. "preview.webp"
+    preview_urls: Dict[str, str] = {}
+    error: Optional[str] = None
+
+
+class GenerationBatchResponseSchema(BaseModel):
+    """
+    Schema for the jobs of a multi-variant generation batch.
+    """
+    batch_id: str
+    encoded_image_id: str
+    jobs: List[GenerationJobResponseSchema]
@@ -1,4 +1,6 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 
 class PetImageResponseSchema(BaseModel):
     """
@@ -6,10 +8,43 @@ class PetImageResponseSchema(BaseModel):
     """
     image_url: str
     encoded_image_id: str
-    
+
+
+class PetImageMetadataSchema(BaseModel):
+    """
+    Schema for the stored state of an uploaded pet image.
+    """
+    encoded_image_id: str
+    image_url: str
+    is_payed: bool
+    payment_status: Optional[str] = None
+    has_generated_images: bool
+    created_at: Optional[datetime] = None
+
     
 class PetImageRequestSchema(BaseModel):
     """
     Schema for pet image request.
     """
-    image_id: str
\ No newline at end of file
+    image_id: str
+    template: str = "magistrate"
+    species: Literal["cat", "dog"] = "cat"
+
+
+class PetImageBatchRequestSchema(BaseModel):
+    """
+    Schema for generating several variants across templates in one request.
+    """
+    image_id: str
+    species: Literal["cat", "dog"] = "cat"
+    # Defaults to every template that supports the species
+    templates: Optional[List[str]] = None
+    variants: int = Field(default=1, ge=1, le=4)
+
+
+class TemplateSchema(BaseModel):
+    """
+    Schema for an available style template.
+    """
+    name: str
+    species: List[str]
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+Production launcher: one-time initialization, then several forked API workers on a shared socket.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The parent imports the application, checks that the schema is at the latest
+migration, resets interrupted generation jobs and binds the socket once. It also
+imports the SDKs the app loads lazily (unless WEB_PRELOAD=false), so workers
+inherit them and the loaded templates copy-on-write. Worker 0 resumes the
+interrupted jobs and runs storage retention. Workers that die are restarted, and
+the generation jobs they had queued or claimed are requeued on their replacement.
+
+Metrics run in prometheus_client's multiprocess mode, so /metrics reports all
+workers together. PROMETHEUS_MULTIPROC_DIR is a fresh temporary directory
+unless it is set; files left in it by a previous run are removed at start.
+
+On SIGTERM or SIGINT every worker stops accepting connections, finishes in-flight
+requests (up to GRACEFUL_SHUTDOWN_SECONDS) and drains running generation calls
+(up to GENERATION_DRAIN_SECONDS) before it exits; workers still running after
+both are killed.
+"""
+import argparse
+import glob
+import importlib
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+# Workers write their metrics to files in this directory and /metrics adds them all up.
+# prometheus_client checks the variable when it is imported, so it is set before the app is.
+_own_metrics_dir = not os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if _own_metrics_dir:
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="fur-metrics-")
+# Files of a previous run would be added to this one's
+for _stale in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+    os.remove(_stale)
+
+import uvicorn
+from alembic.config import Config as AlembicConfig
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+import main
+from database import engine
+from utils.job_queue import GENERATION_DRAIN_SECONDS, release_worker_jobs, reset_pending_jobs, worker_name
+from utils.metrics import mark_process_dead
+from utils.openai_client import share_rate_limit
+
+logger = logging.getLogger("serve")
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+WEB_HOST = os.getenv("WEB_HOST", "127.0.0.1")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+# How long a stopping worker waits for in-flight requests
+GRACEFUL_SHUTDOWN_SECONDS = float(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "30"))
+# SDKs the app imports on first use; importing them here shares them with every worker
+PRELOAD_MODULES = ("openai", "stripe", "brevo_python")
+WEB_PRELOAD = os.getenv("WEB_PRELOAD", "true").lower() in ("1", "true", "yes")
+# Pause before restarting a worker that died, so a crashing worker does not spin
+RESTART_DELAY_SECONDS = 1.0
+
+
+def check_schema():
+    """
+    Exit unless the database is at the latest migration.
+    """
+    script = ScriptDirectory.from_config(AlembicConfig(os.path.join(os.path.dirname(__file__), "alembic.ini")))
+    with engine.connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    heads = set(script.get_heads())
+    if current != heads:
+        logger.error("Database schema is not up to date; run \"alembic upgrade head\"",
+                     extra={"current": sorted(current), "head": sorted(heads)})
+        sys.exit(1)
+
+
+def run_worker(index: int, sock, resume_job_ids) -> bool:
+    """
+    Serve requests until told to stop; returns False when the worker failed to start.
+    """
+    started_at = time.perf_counter()
+    # The parent's handlers must not run here; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    app = main.create_app(primary=index == 0, initialized=True, resume_job_ids=resume_job_ids, started_at=started_at)
+    config = uvicorn.Config(
+        app,
+        log_config=None,
+        access_log=False,
+        timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_SECONDS,
+    )
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    return server.started
+
+
+def spawn(index: int, sock, resume_job_ids=None) -> int:
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            status = 0 if run_worker(index, sock, resume_job_ids) else 3
+        except Exception:
+            logger.exception("Worker crashed", extra={"worker": index})
+        finally:
+            logging.shutdown()
+            os._exit(status)
+    logger.info("Started worker", extra={"worker": index, "worker_pid": pid})
+    return pid
+
+
+def signal_workers(workers: dict, signum: int):
+    for pid in list(workers):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def supervise(workers: dict, sock):
+    """
+    Restart workers that exit until a shutdown signal arrives, then wait for them to stop.
+    """
+    stopping = []
+
+    def stop(signum, frame):
+        if stopping:
+            return
+        logger.info("Stopping workers", extra={"signal": signal.Signals(signum).name})
+        stopping.append(time.monotonic() + GRACEFUL_SHUTDOWN_SECONDS + GENERATION_DRAIN_SECONDS + 5)
+        signal_workers(workers, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while workers:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                logger.warning("Killing workers that did not stop in time", extra={"workers": len(workers)})
+                signal_workers(workers, signal.SIGKILL)
+                stopping[0] = float("inf")
+            time.sleep(0.1)
+            continue
+        index = workers.pop(pid, None)
+        mark_process_dead(pid)
+        if index is None or stopping:
+            continue
+        # Its jobs would otherwise stay queued or running with nothing to run them
+        try:
+            released_job_ids = release_worker_jobs(worker_name(pid))
+        except Exception:
+            logger.exception("Could not requeue the jobs of an exited worker", extra={"worker": index})
+            released_job_ids = []
+        finally:
+            # Connections must not be shared with the forked worker
+            engine.dispose()
+        logger.warning("Worker exited, restarting", extra={"worker": index, "status": os.waitstatus_to_exitcode(status),
+                                                           "released_jobs": len(released_job_ids)})
+        time.sleep(RESTART_DELAY_SECONDS)
+        # Only the released jobs: other workers are running theirs, so a restarted primary must not reset them
+        workers[spawn(index, sock, resume_job_ids=released_job_ids)] = index
+
+
+def main_loop():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--host", default=WEB_HOST)
+    parser.add_argument("--port", type=int, default=WEB_PORT)
+    parser.add_argument("--skip-schema-check", action="store_true")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    if not args.skip_schema_check:
+        check_schema()
+    main.initialize()
+    if WEB_PRELOAD:
+        for module in PRELOAD_MODULES:
+            importlib.import_module(module)
+    resume_job_ids = reset_pending_jobs()
+    # Without a shared bucket each worker may only use its share of GENERATION_RATE_PER_MINUTE
+    share_rate_limit(args.workers)
+    # Connections must not be shared with the forked workers
+    engine.dispose()
+    # The launcher serves no requests; its live gauges (all zero) would show up as another worker
+    mark_process_dead(os.getpid())
+    sock = uvicorn.Config(main.app, host=args.host, port=args.port).bind_socket()
+    logger.info("Initialized", extra={"init_s": round(time.perf_counter() - started_at, 3), "workers": args.workers,
+                                      "resumed_jobs": len(resume_job_ids)})
+
+    workers = {}
+    for index in range(args.workers):
+        workers[spawn(index, sock, resume_job_ids if index == 0 else None)] = index
+    supervise(workers, sock)
+    sock.close()
+    if _own_metrics_dir:
+        shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    logger.info("Stopped")
+
+
+if __name__ == "__main__":
+    main_loop()
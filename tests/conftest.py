@@ -0,0 +1,131 @@
+import os
+import tempfile
+
+# Settings are read when the app modules are imported, so they are fixed before any test imports them
+_scratch = tempfile.mkdtemp(prefix="fur-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ["STORAGE_LOCAL_ROOT"] = os.path.join(_scratch, "storage")
+os.environ["ARCHIVE_CACHE_DIR"] = os.path.join(_scratch, "archive_cache")
+os.environ["STRIPE_WEBHOOK_SECRET"] = "whsec_test_fur_and_furble"
+os.environ.setdefault("JWT_SECRET_KEY", "test")
+# Templates are generated by the stub backend the generation_backend fixture registers
+os.environ["GENERATION_BACKEND"] = "stub"
+os.environ.pop("SNAPSHOT_REDIS_URL", None)
+
+import io
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from database import SessionLocal, create_db_and_tables
+from models.GenerationJob import GenerationJob
+from models.OutboundEmail import OutboundEmail
+from models.PetImage import PetImage
+from models.StripeEvent import StripeEvent
+from models.User import User
+from utils.image_generation import GenerationBackend, register_backend
+from utils.snapshot_cache import pet_images, user_profiles
+from utils.storage import storage
+
+create_db_and_tables()
+
+
+def png_bytes(color: str = "orange", size=(32, 32)) -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, format="PNG")
+    return output.getvalue()
+
+
+class StubBackend(GenerationBackend):
+    """
+    Generation backend that counts its calls; clear release to hold calls until it is set.
+    """
+
+    name = "stub"
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+        self._lock = threading.Lock()
+
+    def generate(self, template, prompt: str, model_input: bytes) -> bytes:
+        with self._lock:
+            self.calls += 1
+        self.started.set()
+        self.release.wait(10)
+        return png_bytes("purple")
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        # Every test starts from empty tables and caches
+        cleanup = SessionLocal()
+        for model in (OutboundEmail, StripeEvent, GenerationJob, PetImage, User):
+            cleanup.query(model).delete()
+        cleanup.commit()
+        cleanup.close()
+        pet_images.clear()
+        user_profiles.clear()
+
+
+@pytest.fixture
+def generation_backend():
+    backend = StubBackend()
+    register_backend("stub", lambda: backend)
+    yield backend
+    # Calls still held by a failed test must not hang the worker pool
+    backend.release.set()
+
+
+@pytest.fixture
+def user(db):
+    user = User(name="owner", email="owner@example.com", hashed_password="x", country_id=1, is_verified=True)
+    db.add(user)
+    db.commit()
+    return user
+
+
+@pytest.fixture
+def uploaded_image(db, user):
+    """
+    A stored upload of user, ready to be generated from.
+    """
+    image = PetImage(image_url="uploaded_images/test/pet.png", user_id=user.id, content_hash="0" * 64)
+    storage.write_bytes(image.image_url, png_bytes())
+    db.add(image)
+    db.commit()
+    return image
+
+
+@pytest.fixture
+def models_client(user):
+    """
+    Client of the model routes, signed in as user.
+    """
+    from api.v1 import model
+    from utils.auth import CurrentUser, get_current_user
+
+    app = FastAPI()
+    app.include_router(model.router, prefix="/api/v1/models")
+    app.dependency_overrides[get_current_user] = lambda: CurrentUser(
+        id=user.id, email=user.email, name=user.name, is_verified=True)
+    return TestClient(app)
+
+
+@pytest.fixture
+def client():
+    from api.v1 import payment
+
+    app = FastAPI()
+    app.include_router(payment.router, prefix="/api/v1/payments")
+    return TestClient(app)
@@ -0,0 +1,72 @@
+import io
+import uuid
+import zipfile
+
+import pytest
+
+from utils.archive import archive_cache, folder_content_hash
+from utils.encode import encrypt_int
+from utils.storage import storage
+
+from conftest import png_bytes
+
+
+@pytest.fixture
+def paid_image(db, uploaded_image):
+    folder = f"generated_images/test/{uuid.uuid4().hex}"
+    for name, color in (("magistrate_cat_0.png", "purple"), ("magistrate_cat_1.png", "green")):
+        storage.write_bytes(f"{folder}/{name}", png_bytes(color))
+    uploaded_image.generated_images_folder_path = folder
+    uploaded_image.is_payed = True
+    db.commit()
+    return uploaded_image
+
+
+def download_url(image) -> str:
+    return f"/api/v1/models/download-image/{encrypt_int(image.id)}"
+
+
+def cached_archive(image):
+    return archive_cache.stat(folder_content_hash(image.generated_images_folder_path))
+
+
+def test_download_streams_the_archive_and_caches_it(models_client, paid_image):
+    assert cached_archive(paid_image) is None
+
+    response = models_client.get(download_url(paid_image))
+
+    assert response.status_code == 200
+    assert sorted(zipfile.ZipFile(io.BytesIO(response.content)).namelist()) == [
+        "magistrate_cat_0.png", "magistrate_cat_1.png"]
+    assert cached_archive(paid_image)[1] == len(response.content)
+
+
+def test_range_without_a_cached_archive_gets_the_whole_archive(models_client, paid_image):
+    response = models_client.get(download_url(paid_image), headers={"Range": "bytes=0-9"})
+
+    assert response.status_code == 200
+    assert "content-range" not in response.headers
+    assert zipfile.ZipFile(io.BytesIO(response.content)).namelist()
+
+
+def test_range_is_served_from_the_cached_archive(models_client, paid_image):
+    full = models_client.get(download_url(paid_image)).content
+
+    response = models_client.get(download_url(paid_image), headers={"Range": "bytes=10-19"})
+
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 10-19/{len(full)}"
+    assert response.content == full[10:20]
+
+
+def test_unsatisfiable_range(models_client, paid_image):
+    size = len(models_client.get(download_url(paid_image)).content)
+
+    response = models_client.get(download_url(paid_image), headers={"Range": f"bytes={size}-"})
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{size}"
+
+
+def test_unpaid_image_cannot_be_downloaded(models_client, uploaded_image):
+    assert models_client.get(download_url(uploaded_image)).status_code == 403
@@ -0,0 +1,47 @@
+import pytest
+
+from utils import encode
+from utils.encode import InvalidIdError, decrypt_string, encrypt_int
+
+
+@pytest.fixture
+def mac_on(monkeypatch):
+    monkeypatch.setattr(encode, "ID_CODEC_MAC", True)
+
+
+def legacy_id(i: int) -> str:
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(encode, "ID_CODEC_MAC", False)
+        return encrypt_int(i)
+
+
+@pytest.mark.parametrize("i", [0, 1, 255, 256, 123456789, 2 ** 64 - 1])
+def test_round_trip(mac_on, i):
+    assert decrypt_string(encrypt_int(i)) == i
+
+
+def test_short_ids_without_a_mac_are_rejected_by_default(mac_on):
+    assert not encode.ID_CODEC_ACCEPT_LEGACY
+
+    with pytest.raises(InvalidIdError):
+        decrypt_string(legacy_id(42))
+
+
+def test_ids_without_a_mac_are_accepted_during_the_migration_window(mac_on, monkeypatch):
+    monkeypatch.setattr(encode, "ID_CODEC_ACCEPT_LEGACY", True)
+
+    assert decrypt_string(legacy_id(42)) == 42
+
+
+@pytest.mark.parametrize("value", ["", "a+b=", "not base64!", "A" * 40])
+def test_malformed_ids_are_rejected(value):
+    with pytest.raises(InvalidIdError):
+        decrypt_string(value)
+
+
+def test_tampered_mac_is_rejected(mac_on):
+    encoded = encrypt_int(42)
+    tampered = encoded[:-2] + ("AA" if encoded[-2:] != "AA" else "BB")
+
+    with pytest.raises(InvalidIdError):
+        decrypt_string(tampered)
@@ -0,0 +1,153 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from database import engine
+from models.GenerationJob import GenerationJob, JOB_DONE, JOB_QUEUED, JOB_RUNNING
+from utils.encode import encrypt_int
+from utils.job_queue import release_worker_jobs, run_generation_job, worker_name
+from utils.storage import storage
+
+GENERATE_URL = "/api/v1/models/generate-image"
+
+
+def wait_for_job(client, job_id: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f"{GENERATE_URL}/{job_id}").json()
+        if job["status"] not in (JOB_QUEUED, JOB_RUNNING) or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def queued_job(db, image, species: str = "cat", **columns) -> GenerationJob:
+    job = GenerationJob(pet_image_id=image.id, template="magistrate", prompt_key=f"magistrate_prompt_{species}",
+                        **{"status": JOB_QUEUED, **columns})
+    image.generated_images_folder_path = "generated_images/test/folder"
+    db.add(job)
+    db.commit()
+    return job
+
+
+def test_generation_request_runs_a_job_and_stores_its_result(models_client, generation_backend, uploaded_image):
+    response = models_client.post(GENERATE_URL, json={"image_id": encrypt_int(uploaded_image.id)})
+
+    assert response.status_code == 202
+    job = wait_for_job(models_client, response.json()["job_id"])
+    assert job["status"] == JOB_DONE
+    assert job["attempts"] == 1
+    assert storage.exists(job["generated_image_path"])
+    assert generation_backend.calls == 1
+
+
+def test_identical_pending_request_reuses_the_job(models_client, generation_backend, uploaded_image):
+    generation_backend.release.clear()
+    request = {"image_id": encrypt_int(uploaded_image.id), "template": "magistrate", "species": "cat"}
+
+    first = models_client.post(GENERATE_URL, json=request).json()
+    assert generation_backend.started.wait(5)
+    second = models_client.post(GENERATE_URL, json=request).json()
+    generation_backend.release.set()
+
+    assert second["job_id"] == first["job_id"]
+    assert wait_for_job(models_client, first["job_id"])["status"] == JOB_DONE
+    assert generation_backend.calls == 1
+
+
+def test_image_has_generated_images_once_a_result_is_stored(models_client, generation_backend, uploaded_image):
+    image_id = encrypt_int(uploaded_image.id)
+    metadata_url = f"/api/v1/models/pet-images/{image_id}"
+    assert not models_client.get(metadata_url).json()["has_generated_images"]
+    generation_backend.release.clear()
+
+    job_id = models_client.post(GENERATE_URL, json={"image_id": image_id}).json()["job_id"]
+    assert generation_backend.started.wait(5)
+    queued = models_client.get(metadata_url).json()["has_generated_images"]
+    generation_backend.release.set()
+
+    assert not queued
+    assert wait_for_job(models_client, job_id)["status"] == JOB_DONE
+    assert models_client.get(metadata_url).json()["has_generated_images"]
+
+
+def test_concurrent_claims_run_a_job_once(db, generation_backend, uploaded_image):
+    job_id = queued_job(db, uploaded_image).id
+    generation_backend.release.clear()
+    claimants = 8
+    barrier = threading.Barrier(claimants)
+
+    def claim():
+        barrier.wait()
+        run_generation_job(job_id)
+
+    threads = [threading.Thread(target=claim) for _ in range(claimants)]
+    for thread in threads:
+        thread.start()
+    assert generation_backend.started.wait(5)
+    # Every claim but the winning one returns without generating
+    time.sleep(0.2)
+    generation_backend.release.set()
+    for thread in threads:
+        thread.join(10)
+
+    db.expire_all()
+    job = db.get(GenerationJob, job_id)
+    assert generation_backend.calls == 1
+    assert job.status == JOB_DONE
+    assert job.attempts == 1
+
+
+def test_running_job_is_not_claimed_again(db, generation_backend, uploaded_image):
+    job = queued_job(db, uploaded_image)
+    job.status = JOB_RUNNING
+    db.commit()
+
+    assert run_generation_job(job.id) is None
+
+    assert generation_backend.calls == 0
+    db.expire_all()
+    assert db.get(GenerationJob, job.id).status == JOB_RUNNING
+
+
+def test_jobs_of_a_killed_worker_are_released_and_run_again(db, generation_backend, uploaded_image):
+    running_id = queued_job(db, uploaded_image).id
+    waiting_id = queued_job(db, uploaded_image, "dog").id
+    elsewhere_id = queued_job(db, uploaded_image, "dog", variant=1, status=JOB_RUNNING, worker="elsewhere:1").id
+    generation_backend.release.clear()
+
+    pid = os.fork()
+    if pid == 0:
+        # The worker claims the job and is killed while the backend holds it
+        try:
+            engine.dispose(close=False)
+            run_generation_job(running_id)
+        finally:
+            os._exit(1)
+    try:
+        # Queued in the worker's pool but not claimed yet
+        db.get(GenerationJob, waiting_id).worker = worker_name(pid)
+        db.commit()
+        deadline = time.monotonic() + 10
+        while db.get(GenerationJob, running_id).status != JOB_RUNNING and time.monotonic() < deadline:
+            time.sleep(0.02)
+            db.expire_all()
+        assert db.get(GenerationJob, running_id).worker == worker_name(pid)
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    assert sorted(release_worker_jobs(worker_name(pid))) == [running_id, waiting_id]
+
+    db.expire_all()
+    assert [db.get(GenerationJob, job_id).status for job_id in (running_id, waiting_id, elsewhere_id)] == [
+        JOB_QUEUED, JOB_QUEUED, JOB_RUNNING]
+    generation_backend.release.set()
+    run_generation_job(running_id)
+    run_generation_job(waiting_id)
+    db.expire_all()
+    assert db.get(GenerationJob, running_id).status == JOB_DONE
+    assert db.get(GenerationJob, running_id).attempts == 2
+    assert db.get(GenerationJob, waiting_id).status == JOB_DONE
@@ -0,0 +1,144 @@
+import logging
+from datetime import timedelta
+
+import pytest
+
+from database import SessionLocal, utcnow
+from models.OutboundEmail import OutboundEmail, EMAIL_FAILED, EMAIL_PENDING, EMAIL_SENDING, EMAIL_SENT
+from utils import mail_queue, mailconfig
+from utils.mail_queue import build_email, send_pending_batch
+from utils.mailconfig import ConsoleTransport, send_email, set_transport
+
+
+class Crash(BaseException):
+    """
+    Stands in for the sender process dying mid-send.
+    """
+
+
+class StubTransport(ConsoleTransport):
+    """
+    Console transport that fails or crashes for chosen recipients.
+    """
+
+    errors = (ConnectionError,)
+
+    def __init__(self, fail=(), crash=()):
+        super().__init__()
+        self.fail = set(fail)
+        self.crash = set(crash)
+        self.statuses_seen = []
+
+    def send(self, recipient, subject, html_content, recipient_name):
+        # What another sender would see in the table while this send is in flight
+        with SessionLocal() as db:
+            self.statuses_seen.append(db.query(OutboundEmail.status).filter_by(recipient=recipient).scalar())
+        if recipient in self.crash:
+            raise Crash()
+        if recipient in self.fail:
+            raise ConnectionError("brevo unavailable")
+        super().send(recipient, subject, html_content, recipient_name)
+
+
+@pytest.fixture
+def transport():
+    previous = mailconfig._transport
+    transport = StubTransport()
+    set_transport(transport)
+    yield transport
+    set_transport(previous)
+
+
+def queue(db, *recipients):
+    for recipient in recipients:
+        db.add(build_email(recipient, f"Hello {recipient}", "<p>hi</p>"))
+    db.commit()
+
+
+def statuses(db):
+    db.expire_all()
+    return {email.recipient: email.status for email in db.query(OutboundEmail)}
+
+
+def sent_to(transport):
+    return [recipient for recipient, *_ in transport.sent]
+
+
+def test_due_emails_are_sent_once(db, transport):
+    queue(db, "a@example.com", "b@example.com")
+
+    assert send_pending_batch() == 2
+    assert send_pending_batch() == 0
+
+    assert sent_to(transport) == ["a@example.com", "b@example.com"]
+    assert statuses(db) == {"a@example.com": EMAIL_SENT, "b@example.com": EMAIL_SENT}
+
+
+def test_rows_are_claimed_and_committed_before_the_send(db, transport):
+    queue(db, "a@example.com", "b@example.com")
+
+    send_pending_batch()
+
+    assert transport.statuses_seen == [EMAIL_SENDING, EMAIL_SENDING]
+
+
+def test_failed_send_is_retried_later(db, transport):
+    transport.fail.add("b@example.com")
+    queue(db, "a@example.com", "b@example.com")
+
+    send_pending_batch()
+
+    email = db.query(OutboundEmail).filter_by(recipient="b@example.com").one()
+    assert (email.status, email.attempts, email.last_error) == (EMAIL_PENDING, 1, "brevo unavailable")
+    assert email.claimed_at is None
+    assert email.next_attempt_at > utcnow() - timedelta(seconds=1)
+    assert statuses(db)["a@example.com"] == EMAIL_SENT
+
+
+def test_email_fails_after_max_attempts(db, transport, monkeypatch):
+    monkeypatch.setattr(mail_queue, "MAIL_RETRY_BASE_SECONDS", 0)
+    monkeypatch.setattr(mail_queue, "MAIL_MAX_ATTEMPTS", 2)
+    transport.fail.add("a@example.com")
+    queue(db, "a@example.com")
+
+    send_pending_batch()
+    send_pending_batch()
+
+    assert statuses(db) == {"a@example.com": EMAIL_FAILED}
+    assert send_pending_batch() == 0
+
+
+def test_crash_mid_batch_does_not_resend_sent_emails(db, transport, monkeypatch):
+    transport.crash.add("b@example.com")
+    queue(db, "a@example.com", "b@example.com", "c@example.com")
+
+    with pytest.raises(Crash):
+        send_pending_batch()
+
+    assert statuses(db) == {"a@example.com": EMAIL_SENT, "b@example.com": EMAIL_SENDING,
+                            "c@example.com": EMAIL_SENDING}
+    # Claimed rows wait for their claim to time out instead of going to another sender at once
+    assert send_pending_batch() == 0
+
+    monkeypatch.setattr(mail_queue, "MAIL_CLAIM_TIMEOUT_SECONDS", 0)
+    transport.crash.clear()
+    assert send_pending_batch() == 2
+
+    assert sent_to(transport) == ["a@example.com", "b@example.com", "c@example.com"]
+    assert set(statuses(db).values()) == {EMAIL_SENT}
+
+
+def test_console_transport_keeps_sent_emails(transport):
+    send_email("a@example.com", "Welcome", "<p>hi</p>", "A")
+
+    assert transport.sent == [("a@example.com", "Welcome", "<p>hi</p>", "A")]
+
+
+def test_send_email_logs_transport_errors(transport, caplog):
+    transport.fail.add("a@example.com")
+
+    with caplog.at_level(logging.ERROR, logger="utils.mailconfig"):
+        send_email("a@example.com", "Welcome", "<p>hi</p>", "A")
+
+    assert transport.sent == []
+    assert "brevo unavailable" in caplog.text
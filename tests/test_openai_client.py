@@ -0,0 +1,230 @@
+import base64
+
+import pytest
+
+from models.GenerationJob import GenerationJob, JOB_FAILED, JOB_QUEUED
+from utils import openai_client
+from utils.openai_client import CircuitBreaker, CircuitOpenError, resilient_call
+from utils.rate_limit import TokenBucket
+
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeImagesServer:
+    """
+    Local stand-in for the images API: answers with the queued statuses, then 200s.
+    """
+
+    def __init__(self, *statuses: int, error_code: str = None):
+        self.statuses = list(statuses)
+        self.error_code = error_code
+        self.calls = 0
+
+    def __call__(self, request: "httpx.Request") -> "httpx.Response":
+        self.calls += 1
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status != 200:
+            return httpx.Response(status, json={"error": {"message": "fake failure", "code": self.error_code}})
+        image = base64.b64encode(b"png").decode("ascii")
+        return httpx.Response(200, json={"created": 0, "data": [{"b64_json": image}]})
+
+    def client(self) -> "openai.OpenAI":
+        return openai.OpenAI(api_key="test", base_url="http://images.test/v1", max_retries=0,
+                             http_client=httpx.Client(transport=httpx.MockTransport(self)))
+
+    def generate(self, client):
+        return resilient_call(client.images.generate, model="gpt-image-1", prompt="a cat")
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30, timer=clock)
+    monkeypatch.setattr(openai_client, "circuit_breaker", breaker)
+    # No waiting between attempts or for rate limit tokens
+    monkeypatch.setattr(openai_client, "OPENAI_RETRY_BASE_SECONDS", 0.001)
+    monkeypatch.setattr(openai_client, "OPENAI_RETRY_MAX_SECONDS", 0.001)
+    monkeypatch.setattr(openai_client, "rate_limiter", TokenBucket(0))
+    return breaker
+
+
+def test_breaker_opens_after_consecutive_failures(breaker):
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    breaker.before_call()
+    assert not breaker.is_open
+
+    breaker.record_failure()
+
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError) as refused:
+        breaker.before_call()
+    assert refused.value.retry_after == 30
+
+
+def test_success_resets_the_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert not breaker.is_open
+
+
+def test_half_open_breaker_lets_one_probe_through_and_closes_on_success(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+
+    breaker.before_call()
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+
+    assert not breaker.is_open
+    breaker.before_call()
+
+
+def test_failed_probe_opens_the_breaker_again(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 30
+    breaker.before_call()
+
+
+def test_probe_that_never_reports_back_expires(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+
+    clock.now += 30
+
+    breaker.before_call()
+
+
+def test_5xx_is_retried(breaker):
+    server = FakeImagesServer(500, 503)
+
+    result = server.generate(server.client())
+
+    assert base64.b64decode(result.data[0].b64_json) == b"png"
+    assert server.calls == 3
+    assert not breaker.is_open
+
+
+def test_retries_stop_after_max_retries(breaker, monkeypatch):
+    monkeypatch.setattr(openai_client, "OPENAI_MAX_RETRIES", 2)
+    server = FakeImagesServer(500, 500, 500, 500)
+
+    with pytest.raises(openai.InternalServerError):
+        server.generate(server.client())
+
+    assert server.calls == 3
+
+
+@pytest.mark.parametrize("status", [400, 401, 404, 422])
+def test_4xx_is_not_retried_and_does_not_trip_the_breaker(breaker, status):
+    server = FakeImagesServer(status, status, status, status)
+
+    for _ in range(4):
+        with pytest.raises(openai.APIStatusError):
+            server.generate(server.client())
+
+    assert server.calls == 4
+    assert not breaker.is_open
+
+
+def test_used_up_quota_is_not_retried(breaker):
+    server = FakeImagesServer(429, error_code="insufficient_quota")
+
+    with pytest.raises(openai.RateLimitError):
+        server.generate(server.client())
+
+    assert server.calls == 1
+
+
+def test_open_breaker_refuses_calls_without_reaching_the_server(breaker):
+    server = FakeImagesServer(*[500] * 3)
+    with pytest.raises(CircuitOpenError):
+        # Three failed attempts open the breaker before the call's last retry
+        server.generate(server.client())
+    assert server.calls == 3
+
+    with pytest.raises(CircuitOpenError):
+        server.generate(server.client())
+
+    assert server.calls == 3
+
+
+def server_error() -> Exception:
+    request = httpx.Request("POST", "http://images.test/v1/images/edits")
+    return openai.InternalServerError("fake failure", response=httpx.Response(500, request=request), body=None)
+
+
+@pytest.fixture
+def failing_backend(generation_backend, monkeypatch):
+    errors = []
+
+    def generate(template, prompt, model_input):
+        generation_backend.calls += 1
+        raise errors.pop(0)
+
+    monkeypatch.setattr(generation_backend, "generate", generate)
+    return errors
+
+
+def job_after_failure(db, uploaded_image):
+    from utils.job_queue import run_generation_job
+
+    uploaded_image.generated_images_folder_path = "generated_images/test/folder"
+    job = GenerationJob(pet_image_id=uploaded_image.id, status=JOB_QUEUED, template="magistrate",
+                        prompt_key="magistrate_prompt_cat")
+    db.add(job)
+    db.commit()
+    retry_delay = run_generation_job(job.id)
+    db.expire_all()
+    return db.get(GenerationJob, job.id), retry_delay
+
+
+def test_job_does_not_retry_an_error_the_call_already_retried(db, uploaded_image, failing_backend):
+    failing_backend.append(server_error())
+
+    job, retry_delay = job_after_failure(db, uploaded_image)
+
+    assert retry_delay is None
+    assert job.status == JOB_FAILED
+
+
+def test_job_retries_other_failures(db, uploaded_image, failing_backend):
+    failing_backend.append(OSError("storage unavailable"))
+
+    job, retry_delay = job_after_failure(db, uploaded_image)
+
+    assert retry_delay is not None
+    assert job.status == JOB_QUEUED
+    assert job.error == "storage unavailable"
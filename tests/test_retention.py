@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+import pytest
+
+from database import utcnow
+from models.GenerationJob import GenerationJob, JOB_DONE
+from models.PetImage import PetImage
+from utils import retention
+from utils.retention import prune_storage
+from utils.storage import storage
+
+from conftest import png_bytes
+
+
+class FakeStripe:
+    """
+    Stands in for Stripe's cancel call: intents map to the status a cancel leaves them in.
+    """
+
+    def __init__(self):
+        self.intents = {}
+        self.canceled = []
+
+    def cancel_payment_intent(self, intent_id: str) -> bool:
+        self.canceled.append(intent_id)
+        status = self.intents[intent_id]
+        if isinstance(status, Exception):
+            raise status
+        return status == "canceled"
+
+
+@pytest.fixture
+def stripe(monkeypatch):
+    stripe = FakeStripe()
+    monkeypatch.setattr(retention, "cancel_payment_intent", stripe.cancel_payment_intent)
+    return stripe
+
+
+def stored_image(db, user, name: str, age_days: float = 0, **columns) -> PetImage:
+    image = PetImage(image_url=f"uploaded_images/test/{name}.png", user_id=user.id,
+                     updated_at=utcnow() - timedelta(days=age_days), **columns)
+    storage.write_bytes(image.image_url, png_bytes())
+    db.add(image)
+    db.commit()
+    return image
+
+
+def remaining(db):
+    db.expire_all()
+    return sorted(image.image_url.rsplit("/", 1)[-1] for image in db.query(PetImage))
+
+
+def test_expired_unpaid_uploads_are_deleted(db, user, stripe, monkeypatch):
+    monkeypatch.setattr(retention, "ORPHAN_GRACE_SECONDS", -1)
+    stored_image(db, user, "old", age_days=31)
+    stored_image(db, user, "recent", age_days=1)
+    stored_image(db, user, "paid", age_days=31, is_payed=True, stripe_payment_id="pi_paid",
+                 payment_status="succeeded")
+
+    prune_storage()
+
+    assert remaining(db) == ["paid.png", "recent.png"]
+    assert not storage.exists("uploaded_images/test/old.png")
+    assert stripe.canceled == []
+
+
+def test_open_intent_is_canceled_before_the_upload_is_deleted(db, user, stripe):
+    stripe.intents["pi_open"] = "canceled"
+    stored_image(db, user, "open", age_days=31, stripe_payment_id="pi_open",
+                 payment_status="requires_payment_method")
+
+    prune_storage()
+
+    assert stripe.canceled == ["pi_open"]
+    assert remaining(db) == []
+
+
+@pytest.mark.parametrize("outcome", ["processing", "succeeded", ConnectionError("stripe unavailable")])
+def test_upload_is_kept_while_its_intent_cannot_be_canceled(db, user, stripe, outcome):
+    stripe.intents["pi_open"] = outcome
+    stored_image(db, user, "open", age_days=31, stripe_payment_id="pi_open", payment_status="processing")
+
+    prune_storage()
+
+    assert remaining(db) == ["open.png"]
+    assert storage.exists("uploaded_images/test/open.png")
+
+
+def test_closed_intent_is_not_canceled_again(db, user, stripe):
+    stored_image(db, user, "closed", age_days=31, stripe_payment_id="pi_closed", payment_status="canceled")
+
+    prune_storage()
+
+    assert stripe.canceled == []
+    assert remaining(db) == []
+
+
+def test_results_of_images_being_paid_for_are_not_evicted(db, user, stripe, monkeypatch):
+    monkeypatch.setattr(retention, "GENERATED_RETENTION_DAYS", 0)
+    for name, columns in (("unpaid", {}),
+                          ("checkout", {"stripe_payment_id": "pi_open", "payment_status": "requires_action"})):
+        image = stored_image(db, user, name, **columns)
+        result_path = f"generated_images/test/{name}/result.png"
+        storage.write_bytes(result_path, png_bytes("purple"))
+        db.add(GenerationJob(pet_image_id=image.id, status=JOB_DONE, template="magistrate",
+                             prompt_key="magistrate_prompt_cat", result_path=result_path))
+    db.commit()
+
+    prune_storage()
+
+    assert not storage.exists("generated_images/test/unpaid/result.png")
+    assert storage.exists("generated_images/test/checkout/result.png")
+    assert stripe.canceled == []
@@ -0,0 +1,218 @@
+import asyncio
+
+import pytest
+
+from database import AsyncSessionLocal
+from models.PetImage import PetImage
+from utils.cache import TTLCache
+from utils.snapshot_cache import RedisTier, SnapshotCache, get_pet_image, get_user_profile, pet_images, user_profiles
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def redis_tier(ttl: float = 300) -> RedisTier:
+    server = fakeredis.FakeServer()
+    return RedisTier(fakeredis.FakeAsyncRedis(server=server), fakeredis.FakeRedis(server=server), ttl)
+
+
+class Loader:
+    """
+    Snapshot loader that counts the database reads it stands in for.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, id):
+        self.calls += 1
+        return {"id": id, "name": f"row {id}"}
+
+
+@pytest.fixture
+def shared_tier(monkeypatch):
+    """
+    A fake Redis behind the app's caches, so ORM events invalidate both tiers.
+    """
+    tier = redis_tier()
+    monkeypatch.setattr(user_profiles, "redis_tier", tier)
+    monkeypatch.setattr(pet_images, "redis_tier", tier)
+    return tier
+
+
+def in_redis(tier: RedisTier, cache: SnapshotCache, id: int) -> bool:
+    return tier.sync_client.exists(cache._key(id)) == 1
+
+
+def test_miss_loads_once_then_other_workers_hit_redis():
+    async def scenario():
+        tier = redis_tier()
+        worker_a, worker_b = SnapshotCache("row", tier), SnapshotCache("row", tier)
+        loader = Loader()
+
+        assert await worker_a.get_or_load(7, loader) == {"id": 7, "name": "row 7"}
+        assert await worker_a.get_or_load(7, loader) == {"id": 7, "name": "row 7"}
+        # Another worker's local tier is empty; its read is answered by Redis and kept locally
+        assert worker_b.local.get(7) is None
+        assert await worker_b.get_or_load(7, loader) == {"id": 7, "name": "row 7"}
+        assert worker_b.local.get(7) == {"id": 7, "name": "row 7"}
+        return loader.calls
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_missing_rows_are_not_cached():
+    async def scenario():
+        cache = SnapshotCache("row", redis_tier())
+        calls = []
+
+        async def load(id):
+            calls.append(id)
+            return None
+
+        assert await cache.get_or_load(7, load) is None
+        assert await cache.get_or_load(7, load) is None
+        return calls
+
+    assert asyncio.run(scenario()) == [7, 7]
+
+
+def test_expired_local_entry_is_refilled_from_redis():
+    async def scenario():
+        clock = Clock()
+        cache = SnapshotCache("row", redis_tier())
+        cache.local = TTLCache(100, 30, timer=clock)
+        loader = Loader()
+        await cache.get_or_load(7, loader)
+
+        clock.now = 31
+        assert cache.local.get(7) is None
+        assert await cache.get_or_load(7, loader) == {"id": 7, "name": "row 7"}
+        return loader.calls
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_expired_redis_entry_is_loaded_again():
+    async def scenario():
+        tier = redis_tier(ttl=1)
+        loader = Loader()
+        await SnapshotCache("row", tier).get_or_load(7, loader)
+        assert 0 < await tier.client.ttl("snapshot:row:7") <= 1
+
+        await asyncio.sleep(1.1)
+        await SnapshotCache("row", tier).get_or_load(7, loader)
+        return loader.calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_redis_errors_are_misses():
+    class BrokenRedis:
+        async def get(self, key):
+            raise ConnectionError("redis is down")
+
+        async def set(self, key, value, ex=None):
+            raise ConnectionError("redis is down")
+
+    async def scenario():
+        cache = SnapshotCache("row", RedisTier(BrokenRedis(), None, ttl=300))
+        loader = Loader()
+        assert await cache.get_or_load(7, loader) == {"id": 7, "name": "row 7"}
+        return loader.calls
+
+    assert asyncio.run(scenario()) == 1
+
+
+def cache_user(user_id: int):
+    async def load():
+        async with AsyncSessionLocal() as session:
+            return await get_user_profile(session, user_id)
+
+    return asyncio.run(load())
+
+
+def cache_pet_image(image_id: int):
+    async def load():
+        async with AsyncSessionLocal() as session:
+            return await get_pet_image(session, image_id)
+
+    return asyncio.run(load())
+
+
+def test_user_update_invalidates_both_tiers(db, user, shared_tier):
+    assert cache_user(user.id)["credits"] != 12.5
+    assert in_redis(shared_tier, user_profiles, user.id)
+
+    user.credits = 12.5
+    db.commit()
+
+    assert user_profiles.local.get(user.id) is None
+    assert not in_redis(shared_tier, user_profiles, user.id)
+    assert cache_user(user.id)["credits"] == 12.5
+
+
+def test_user_delete_invalidates_both_tiers(db, user, shared_tier):
+    cache_user(user.id)
+
+    db.delete(user)
+    db.commit()
+
+    assert user_profiles.local.get(user.id) is None
+    assert not in_redis(shared_tier, user_profiles, user.id)
+    assert cache_user(user.id) is None
+
+
+def test_rolled_back_change_keeps_the_cached_snapshot(db, user, shared_tier):
+    cache_user(user.id)
+
+    user.credits = 99
+    db.flush()
+    db.rollback()
+
+    assert user_profiles.local.get(user.id) is not None
+    assert in_redis(shared_tier, user_profiles, user.id)
+
+
+def test_pet_image_update_invalidates_both_tiers(db, uploaded_image, shared_tier):
+    assert not cache_pet_image(uploaded_image.id)["is_payed"]
+
+    uploaded_image.is_payed = True
+    db.commit()
+
+    assert pet_images.local.get(uploaded_image.id) is None
+    assert not in_redis(shared_tier, pet_images, uploaded_image.id)
+    assert cache_pet_image(uploaded_image.id)["is_payed"]
+
+
+def test_pet_image_delete_invalidates_both_tiers(db, uploaded_image, shared_tier):
+    cache_pet_image(uploaded_image.id)
+
+    db.delete(uploaded_image)
+    db.commit()
+
+    assert pet_images.local.get(uploaded_image.id) is None
+    assert not in_redis(shared_tier, pet_images, uploaded_image.id)
+    assert cache_pet_image(uploaded_image.id) is None
+
+
+def test_async_session_commit_invalidates_redis(uploaded_image, shared_tier):
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            await get_pet_image(session, uploaded_image.id)
+            pet_image = await session.get(PetImage, uploaded_image.id)
+            pet_image.payment_status = "processing"
+            await session.commit()
+        # From the event loop the Redis delete is scheduled rather than awaited in the commit
+        await asyncio.gather(*shared_tier._pending)
+        return await shared_tier.client.exists(pet_images._key(uploaded_image.id))
+
+    assert asyncio.run(scenario()) == 0
+    assert pet_images.local.get(uploaded_image.id) is None
@@ -0,0 +1,150 @@
+import io
+import os
+
+import pytest
+
+from utils.storage import CachedStorage, LocalStorage, S3Storage
+
+moto = pytest.importorskip("moto")
+
+BUCKET = "pets-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """
+    S3Storage against moto's in-memory S3, the stand-in for MinIO and other S3-compatible services.
+    """
+    for name, value in (("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+                        ("AWS_DEFAULT_REGION", "us-east-1")):
+        monkeypatch.setenv(name, value)
+    with moto.mock_aws():
+        store = S3Storage(BUCKET, prefix="deployment", region_name="us-east-1")
+        store.client.create_bucket(Bucket=BUCKET)
+        yield store
+
+
+def read(store, key: str) -> bytes:
+    with store.open(key) as source:
+        return source.read()
+
+
+def test_put_and_get(s3, tmp_path):
+    s3.write_bytes("uploaded_images/ab/cd/pet.png", b"pet")
+    s3.write("generated_images/ab/cd/result.png", io.BytesIO(b"result"))
+    upload = tmp_path / "upload.png"
+    upload.write_bytes(b"upload")
+    s3.put_file("uploaded_images/ef/gh/other.png", str(upload))
+
+    assert read(s3, "uploaded_images/ab/cd/pet.png") == b"pet"
+    assert read(s3, "generated_images/ab/cd/result.png") == b"result"
+    assert read(s3, "uploaded_images/ef/gh/other.png") == b"upload"
+    assert not upload.exists()
+    info = s3.stat("uploaded_images/ab/cd/pet.png")
+    assert (info.key, info.size) == ("uploaded_images/ab/cd/pet.png", 3)
+    assert info.etag
+    # Keys live under the deployment's prefix
+    assert s3.client.head_object(Bucket=BUCKET, Key="deployment/uploaded_images/ab/cd/pet.png")
+
+
+def test_missing_objects(s3):
+    assert s3.stat("uploaded_images/missing.png") is None
+    assert not s3.exists("uploaded_images/missing.png")
+    with pytest.raises(FileNotFoundError):
+        s3.open("uploaded_images/missing.png")
+    with pytest.raises(FileNotFoundError):
+        s3.copy("uploaded_images/missing.png", "uploaded_images/copy.png")
+
+
+def test_list_returns_only_objects_under_the_prefix(s3):
+    for key in ("generated_images/folder/b.png", "generated_images/folder/a.png",
+                "generated_images/folder/nested/c.png", "generated_images/folder2/d.png"):
+        s3.write_bytes(key, key.encode("utf-8"))
+
+    assert [info.key for info in s3.list("generated_images/folder")] == [
+        "generated_images/folder/a.png", "generated_images/folder/b.png", "generated_images/folder/nested/c.png"]
+    assert s3.list("generated_images/empty") == []
+
+
+def test_copy_and_delete_prefix(s3):
+    s3.write_bytes("generated_images/folder/a.png", b"a")
+    s3.copy("generated_images/folder/a.png", "generated_images/folder/b.png")
+    s3.write_bytes("generated_images/folder2/c.png", b"c")
+
+    assert read(s3, "generated_images/folder/b.png") == b"a"
+
+    s3.delete_prefix("generated_images/folder")
+
+    assert s3.list("generated_images/folder") == []
+    assert read(s3, "generated_images/folder2/c.png") == b"c"
+    s3.delete("generated_images/folder2/c.png")
+    assert s3.stat("generated_images/folder2/c.png") is None
+
+
+def cached_files(cache: CachedStorage):
+    return sorted(info.key for info in cache.cache.list(""))
+
+
+def test_cache_serves_reads_locally(s3, tmp_path):
+    cache = CachedStorage(s3, str(tmp_path / "cache"))
+    s3.write_bytes("generated_images/folder/a.png", b"first")
+
+    assert read(cache, "generated_images/folder/a.png") == b"first"
+    [cached] = cached_files(cache)
+    assert cached.startswith("generated_images/folder/a.png@")
+
+    # A later read is answered from the cached copy
+    with open(cache.cache._path(cached), "wb") as f:
+        f.write(b"local")
+    assert read(cache, "generated_images/folder/a.png") == b"local"
+
+
+def test_cache_refetches_an_object_overwritten_by_another_replica(s3, tmp_path):
+    key = "generated_images/folder/a.png"
+    replica_a = CachedStorage(s3, str(tmp_path / "cache_a"))
+    replica_b = CachedStorage(s3, str(tmp_path / "cache_b"))
+    replica_a.write_bytes(key, b"first")
+    assert read(replica_b, key) == b"first"
+
+    # Same size and, on S3, usually the same second: only the ETag tells the versions apart
+    replica_a.write_bytes(key, b"again")
+
+    assert read(replica_b, key) == b"again"
+    assert len(cached_files(replica_b)) == 1
+
+
+def test_cache_forgets_deleted_objects(s3, tmp_path):
+    key = "generated_images/folder/a.png"
+    replica_a = CachedStorage(s3, str(tmp_path / "cache_a"))
+    replica_b = CachedStorage(s3, str(tmp_path / "cache_b"))
+    replica_a.write_bytes(key, b"first")
+    read(replica_b, key)
+
+    replica_a.delete(key)
+
+    with pytest.raises(FileNotFoundError):
+        replica_b.open(key)
+    assert cached_files(replica_a) == cached_files(replica_b) == []
+
+
+def test_cache_stays_within_its_size_bound(s3, tmp_path):
+    cache = CachedStorage(s3, str(tmp_path / "cache"), max_bytes=250)
+    for name in "abcd":
+        s3.write_bytes(f"generated_images/folder/{name}.png", name.encode("utf-8") * 100)
+        read(cache, f"generated_images/folder/{name}.png")
+
+    assert sum(info.size for info in cache.cache.list("")) <= 250
+    assert cached_files(cache)[-1].startswith("generated_images/folder/d.png@")
+
+
+def test_cache_over_local_storage_uses_size_and_mtime(tmp_path):
+    remote = LocalStorage(str(tmp_path / "remote"))
+    cache = CachedStorage(remote, str(tmp_path / "cache"))
+    remote.write_bytes("generated_images/folder/a.png", b"first")
+    assert read(cache, "generated_images/folder/a.png") == b"first"
+
+    remote.write_bytes("generated_images/folder/a.png", b"second!")
+
+    assert read(cache, "generated_images/folder/a.png") == b"second!"
+    assert os.listdir(tmp_path / "cache" / "generated_images" / "folder") == [
+        os.path.basename(cached_files(cache)[0])]
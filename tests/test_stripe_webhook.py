@@ -0,0 +1,158 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+
+import pytest
+
+from models.PetImage import PetImage
+from models.StripeEvent import StripeEvent
+from models.User import User
+from utils.snapshot_cache import pet_images
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "stripe_events")
+WEBHOOK_URL = "/api/v1/payments/webhook"
+INTENT_ID = "pi_3QfR2kTestIntent0001"
+
+
+def recorded_event(event_type: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, f"{event_type}.json"), "rb") as f:
+        return f.read()
+
+
+def sign(payload: bytes, secret: str = None, timestamp: int = None) -> str:
+    """
+    Stripe-Signature header for payload, as Stripe computes it.
+    """
+    secret = secret or os.environ["STRIPE_WEBHOOK_SECRET"]
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signed = f"{timestamp}.".encode("utf-8") + payload
+    signature = hmac.new(secret.encode("utf-8"), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def post_event(client, payload: bytes, signature: str = None):
+    headers = {"Content-Type": "application/json"}
+    if signature is not False:
+        headers["Stripe-Signature"] = signature or sign(payload)
+    return client.post(WEBHOOK_URL, content=payload, headers=headers)
+
+
+@pytest.fixture
+def pet_image(db):
+    user = User(name="payer", email="payer@example.com", hashed_password="x", country_id=1, is_verified=True)
+    db.add(user)
+    db.commit()
+    image = PetImage(image_url="uploaded_images/pet.png", user_id=user.id, stripe_payment_id=INTENT_ID,
+                     payment_status="requires_payment_method")
+    db.add(image)
+    db.commit()
+    return image
+
+
+def refreshed(db, image: PetImage) -> PetImage:
+    db.expire_all()
+    return db.get(PetImage, image.id)
+
+
+@pytest.mark.parametrize("signature", [
+    "t=1,v1=0000",
+    sign(b"{}"),
+    sign(recorded_event("payment_intent.succeeded"), secret="whsec_someone_else"),
+    sign(recorded_event("payment_intent.succeeded"), timestamp=int(time.time()) - 3600),
+    False,
+], ids=["malformed", "other-payload", "other-secret", "expired", "missing"])
+def test_rejects_invalid_signatures(client, db, pet_image, signature):
+    response = post_event(client, recorded_event("payment_intent.succeeded"), signature)
+
+    assert response.status_code == 400
+    assert not refreshed(db, pet_image).is_payed
+    assert db.query(StripeEvent).count() == 0
+
+
+def test_succeeded_event_marks_image_paid(client, db, pet_image):
+    response = post_event(client, recorded_event("payment_intent.succeeded"))
+
+    assert response.status_code == 200
+    assert response.json() == {"received": True}
+    image = refreshed(db, pet_image)
+    assert image.is_payed
+    assert image.payment_status == "succeeded"
+    assert [event.id for event in db.query(StripeEvent)] == ["evt_3QfR2kTestSucceeded0001"]
+
+
+def test_failed_event_records_status_without_paying(client, db, pet_image):
+    response = post_event(client, recorded_event("payment_intent.payment_failed"))
+
+    assert response.status_code == 200
+    image = refreshed(db, pet_image)
+    assert not image.is_payed
+    assert image.payment_status == "failed"
+
+
+def test_redelivered_event_is_dropped(client, db, pet_image):
+    payload = recorded_event("payment_intent.payment_failed")
+    assert post_event(client, payload).json() == {"received": True}
+    # A later change must not be undone by Stripe delivering the old event again
+    image = refreshed(db, pet_image)
+    image.payment_status = "processing"
+    db.commit()
+
+    response = post_event(client, payload)
+
+    assert response.status_code == 200
+    assert response.json() == {"received": True, "duplicate": True}
+    assert refreshed(db, pet_image).payment_status == "processing"
+    assert db.query(StripeEvent).count() == 1
+
+
+def test_paid_image_is_not_reverted_by_a_late_failure(client, db, pet_image):
+    post_event(client, recorded_event("payment_intent.succeeded"))
+
+    post_event(client, recorded_event("payment_intent.payment_failed"))
+
+    image = refreshed(db, pet_image)
+    assert image.is_payed
+    assert image.payment_status == "succeeded"
+
+
+def test_invalidates_cached_pet_image_snapshot(client, db, pet_image):
+    pet_images.local.set(pet_image.id, {"id": pet_image.id, "is_payed": False})
+
+    post_event(client, recorded_event("payment_intent.succeeded"))
+
+    assert pet_images.local.get(pet_image.id) is None
+
+
+def test_ignores_unhandled_event_types(client, db, pet_image):
+    payload = json.dumps({**json.loads(recorded_event("payment_intent.succeeded")),
+                          "id": "evt_3QfR2kTestOther00001", "type": "payment_intent.created"}).encode("utf-8")
+
+    response = post_event(client, payload)
+
+    assert response.status_code == 200
+    assert not refreshed(db, pet_image).is_payed
+    assert db.query(StripeEvent).count() == 0
+
+
+def confirm(client, image: PetImage, intent_id: str = INTENT_ID, user_id: int = None):
+    from utils.auth import CurrentUser, get_current_user
+
+    client.app.dependency_overrides[get_current_user] = lambda: CurrentUser(
+        id=user_id or image.user_id, email="payer@example.com", name="payer", is_verified=True)
+    return client.post("/api/v1/payments/confirm-payment/", json={"image_id": "x", "stripe_payment_id": intent_id})
+
+
+def test_confirm_reports_the_payment_the_webhook_recorded(client, db, pet_image):
+    assert confirm(client, pet_image).json()["payment_status"] == "requires_payment_method"
+
+    post_event(client, recorded_event("payment_intent.succeeded"))
+
+    assert confirm(client, pet_image).json() == {
+        "image_id": "x", "payment_status": "succeeded", "message": "Payment was successful."}
+
+
+def test_confirm_only_finds_the_callers_orders(client, db, pet_image):
+    assert confirm(client, pet_image, user_id=pet_image.user_id + 1).status_code == 404
+    assert confirm(client, pet_image, intent_id="pi_unknown").status_code == 404
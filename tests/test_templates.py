@@ -0,0 +1,49 @@
+import json
+import logging
+
+import pytest
+from PIL import Image
+
+from utils.templates import TemplateRegistry
+
+
+@pytest.fixture
+def templates_dir(tmp_path):
+    for name in ("knight", "pirate"):
+        Image.new("RGB", (48, 64), "navy").save(tmp_path / f"{name}_template.png")
+    return tmp_path
+
+
+def write_prompts(directory, name, prompts):
+    (directory / f"{name}_prompts.json").write_text(json.dumps(prompts), encoding="utf-8")
+
+
+def test_prompts_come_from_the_file_next_to_the_template(templates_dir):
+    write_prompts(templates_dir, "knight", {"cat": "Knight the cat.", "dog": "Knight the dog."})
+    write_prompts(templates_dir, "pirate", {"dog": "Pirate the dog."})
+
+    registry = TemplateRegistry(str(templates_dir), backends={})
+
+    assert registry.names() == ["knight", "pirate"]
+    assert registry.prompt_key("knight", "cat") == "knight_prompt_cat"
+    assert registry.get("knight").prompt("knight_prompt_dog") == "Knight the dog."
+    assert list(registry.get("pirate").prompt_keys) == ["dog"]
+    with pytest.raises(KeyError):
+        registry.prompt_key("pirate", "cat")
+
+
+def test_template_without_prompts_is_skipped_with_a_warning(templates_dir, caplog):
+    write_prompts(templates_dir, "knight", {"cat": "Knight the cat."})
+
+    with caplog.at_level(logging.WARNING, logger="utils.templates"):
+        registry = TemplateRegistry(str(templates_dir), backends={})
+
+        assert registry.names() == ["knight"]
+    assert [record.template for record in caplog.records] == ["pirate"]
+
+
+def test_malformed_prompts_file_fails_loading(templates_dir):
+    (templates_dir / "knight_prompts.json").write_text("{\"cat\": ", encoding="utf-8")
+
+    with pytest.raises(ValueError, match="knight_prompts.json"):
+        TemplateRegistry(str(templates_dir), backends={}).load()
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import posixpath
+import threading
+import uuid
+import zipfile
+from dotenv import load_dotenv
+
+from utils.storage import storage
+
+load_dotenv()
+
+ARCHIVE_CACHE_DIR = os.getenv("ARCHIVE_CACHE_DIR", "archive_cache")
+# Total size of finished archives kept on disk, 0 disables caching of streamed downloads
+ARCHIVE_CACHE_MAX_BYTES = int(os.getenv("ARCHIVE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+ARCHIVE_CHUNK_SIZE = 64 * 1024
+
+
+class _StreamBuffer:
+    """Write-only file object that collects zip output until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return the pending output as a list holding at most one chunk."""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return [data] if data else []
+
+
+def folder_content_hash(folder_path: str):
+    """
+    Hash a stored folder's file names, sizes, modification times and ETags; used as archive key and ETag.
+
+    Returns None when the folder holds no files.
+    """
+    files = storage.list(folder_path)
+    if not files:
+        return None
+    digest = hashlib.sha256()
+    for info in files:
+        # S3 times have one-second resolution; the object ETag tells quick overwrites apart
+        digest.update(f"{posixpath.basename(info.key)}:{info.size}:{info.mtime}:{info.etag or ''}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def iter_zip(folder_path: str, chunk_size: int = ARCHIVE_CHUNK_SIZE):
+    """
+    Yield a zip archive of a stored folder as it is built, storing files without compression.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for info in storage.list(folder_path):
+            name = posixpath.basename(info.key)
+            with storage.open(info.key) as source, archive.open(name, mode="w", force_zip64=False) as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
+
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = ARCHIVE_CHUNK_SIZE):
+    """
+    Yield bytes start..end (inclusive) of a file.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def parse_range(range_header: str, size: int):
+    """
+    Parse a single "bytes=" range into inclusive (start, end); returns None if unsatisfiable.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if not start_text:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class ArchiveCache:
+    """
+    Size-bounded LRU cache of finished zip archives keyed by folder content hash.
+    """
+
+    def __init__(self, directory: str = ARCHIVE_CACHE_DIR, max_bytes: int = ARCHIVE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.zip")
+
+    def get(self, key: str):
+        """
+        Return the cached archive path for a key, marking it recently used.
+        """
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def stat(self, key: str):
+        """
+        Return the path and size of the cached archive for a key, or None when it is not cached.
+        """
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            return path, os.path.getsize(path)
+        except OSError:
+            # Evicted in between
+            return None
+
+    def _write(self, folder_path: str, key: str):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f"{key}.{uuid.uuid4()}.tmp")
+        try:
+            with open(tmp_path, "wb") as out:
+                for chunk in iter_zip(folder_path):
+                    out.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, self._path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=key)
+
+    def build(self, folder_path: str, key: str) -> str:
+        """
+        Build (or reuse) the archive for a folder and return its path.
+        """
+        path = self.get(key)
+        if path:
+            return path
+        for _ in self._write(folder_path, key):
+            pass
+        return self._path(key)
+
+    def stream(self, folder_path: str, key: str):
+        """
+        Stream the archive for a folder, keeping a copy in the cache when it is enabled.
+        """
+        if self.max_bytes <= 0:
+            return iter_zip(folder_path)
+        return self._write(folder_path, key)
+
+    def evict(self, keep: str = None):
+        """
+        Remove least recently used archives until the cache fits in max_bytes.
+        """
+        with self._lock:
+            try:
+                entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".zip")]
+            except OSError:
+                return
+            stats = [(entry.stat(), entry.path) for entry in entries]
+            files = sorted((stat.st_mtime, stat.st_size, path) for stat, path in stats)
+            total = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                if total <= self.max_bytes:
+                    break
+                if keep and path == self._path(keep):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+
+archive_cache = ArchiveCache()
+
+
+def prebuild_archive(folder_path: str):
+    """
+    Build the download archive for a folder ahead of the first download.
+    """
+    if not folder_path or archive_cache.max_bytes <= 0:
+        return
+    key = folder_content_hash(folder_path)
+    if key:
+        archive_cache.build(folder_path, key)
@@ -1,25 +1,49 @@
-from fastapi import HTTPException, status, BackgroundTasks, Request
+from fastapi import Depends, HTTPException, status, BackgroundTasks, Request
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import EmailStr
-from jose import jwt
+from jose import jwk, jwt
 from dotenv import load_dotenv
+from collections import namedtuple
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
-import bcrypt
+import time
 from datetime import datetime, timedelta
 from typing import Optional
 import pytz
 
+from database import get_async_db
+from models.User import User as UserModel
+from utils.cache import TTLCache
 from utils.mailconfig import render_template, send_email
+from utils.mail_queue import build_email
+from utils.password_hashing import hash_password_sync, verify_password_sync
 
 load_dotenv()
 
 JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 JWT_ALGORITHM = "HS256"
+# Built once; passing the raw secret makes jose re-parse and rebuild the key on every call
+JWT_SIGNING_KEY = jwk.construct(JWT_SECRET_KEY, JWT_ALGORITHM)
+# Tokens with this purpose only verify an account, they do not authenticate requests
+VERIFICATION_PURPOSE = "verify"
+
+# Verified tokens are remembered for up to AUTH_CACHE_TTL_SECONDS (never past their expiry);
+# this also bounds how long another worker process may serve a stale user snapshot
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# The parts of a user that protected endpoints need, safe to keep in memory
+CurrentUser = namedtuple("CurrentUser", ["id", "email", "name", "is_verified"])
+
+token_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+bearer_scheme = HTTPBearer(auto_error=False)
 
 def verify_password(plain_password, hashed_password):
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+    return verify_password_sync(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    return hash_password_sync(password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -29,12 +53,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.now(utc_timezone) + timedelta(days=1)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, JWT_SIGNING_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 def decode_access_token(token: str):
     try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, JWT_SIGNING_KEY, algorithms=[JWT_ALGORITHM])
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has expired")
@@ -42,30 +66,101 @@ def decode_access_token(token: str):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
 
 def generate_verification_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
+    to_encode = {**data, "purpose": VERIFICATION_PURPOSE}
     utc_timezone = pytz.UTC
     if expires_delta:
         expire = datetime.now(utc_timezone) + expires_delta
     else:
         expire = datetime.now(utc_timezone) + timedelta(days=1)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, JWT_SIGNING_KEY, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str):
+    """
+    Return the email of a valid verification token, or None; access tokens are refused.
+    """
     try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
-        email = payload.get("sub")
-        return email
+        payload = jwt.decode(token, JWT_SIGNING_KEY, algorithms=[JWT_ALGORITHM])
+        if payload.get("purpose") != VERIFICATION_PURPOSE:
+            return None
+        return payload.get("sub")
     except jwt.ExpiredSignatureError:
         return None
-    except jwt.InvalidTokenError:
+    except jwt.JWTError:
         return None
 
-def send_verification_email(email: EmailStr, token: str, name: str):
+def _unauthorized(detail: str):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+async def get_current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> CurrentUser:
+    """
+    Authenticate the bearer token; repeat requests with a token are served from token_cache.
+    """
+    if credentials is None:
+        raise _unauthorized("Not authenticated")
+    token = credentials.credentials
+
+    current_user = token_cache.get(token)
+    if current_user is not None:
+        return current_user
+
+    try:
+        payload = jwt.decode(token, JWT_SIGNING_KEY, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise _unauthorized("Token has expired")
+    except jwt.JWTError:
+        raise _unauthorized("Could not validate credentials")
+    if payload.get("purpose") == VERIFICATION_PURPOSE or not payload.get("sub"):
+        raise _unauthorized("Could not validate credentials")
+
+    result = await db.execute(select(UserModel).filter(UserModel.email == payload["sub"]))
+    user = result.scalars().first()
+    if not user:
+        raise _unauthorized("Could not validate credentials")
+    if user.is_suspended:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Account suspended")
+
+    current_user = CurrentUser(id=user.id, email=user.email, name=user.name, is_verified=bool(user.is_verified))
+    token_cache.set(token, current_user, ttl=payload["exp"] - time.time())
+    return current_user
+
+def invalidate_user(user_id: int):
+    """
+    Drop cached tokens of a user; call after changing them with bulk UPDATE statements.
+    """
+    token_cache.discard_where(lambda current_user: current_user.id == user_id)
+
+@event.listens_for(UserModel, "after_update")
+def _invalidate_changed_user(mapper, connection, target):
+    # Suspension, verification and email changes made through the ORM take effect on the next request
+    state = inspect(target)
+    if any(state.attrs[name].history.has_changes() for name in ("is_suspended", "is_verified", "email", "name")):
+        invalidate_user(target.id)
+
+@event.listens_for(UserModel, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+VERIFICATION_SUBJECT = "Fur and Furble Account Verification"
+
+def _verification_html(token: str, name: str):
     domain =  os.environ.get("APP_HOST")
     verification_url = f"{domain}/api/v1/users/verify?token={token}"
-    subject = "Fur and Furble Account Verification"
-    html_content = render_template('verification_email.html', name=name, verification_url=verification_url)
-    
-    send_email(email, subject, html_content, name)
\ No newline at end of file
+    return render_template('verification_email.html', name=name, verification_url=verification_url)
+
+def send_verification_email(email: EmailStr, token: str, name: str):
+    send_email(email, VERIFICATION_SUBJECT, _verification_html(token, name), name)
+
+def build_verification_email(email: EmailStr, token: str, name: str):
+    """
+    Build a queued verification email; it is delivered by the background mail sender.
+    """
+    return build_email(email, VERIFICATION_SUBJECT, _verification_html(token, name), name)
\ No newline at end of file
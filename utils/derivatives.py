@@ -0,0 +1,143 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+from PIL import Image as PILImage, ImageDraw, ImageFont, features
+
+from utils.storage import shard_key, storage
+from utils.tracing import span
+
+load_dotenv()
+
+# Storage key prefix of derivatives, one folder per generated result content hash
+DERIVATIVES_DIR = "derivatives"
+THUMBNAIL_MAX_EDGE = int(os.getenv("THUMBNAIL_MAX_EDGE", "256"))
+PREVIEW_MAX_EDGE = int(os.getenv("PREVIEW_MAX_EDGE", "640"))
+PREVIEW_WATERMARK_TEXT = os.getenv("PREVIEW_WATERMARK_TEXT", "FUR AND FURBLE")
+# Encodings produced for every derivative; ones this Pillow build cannot write are skipped
+DERIVATIVE_FORMATS = [
+    name for name in os.getenv("DERIVATIVE_FORMATS", "webp,avif").split(",")
+    if name and features.check(name)
+]
+DERIVATIVE_QUALITY = {"webp": 80, "avif": 60}
+DERIVATIVE_MEDIA_TYPES = {"webp": "image/webp", "avif": "image/avif"}
+DERIVATIVE_KINDS = ("thumbnail", "preview")
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+# Where clients fetch derivatives from; point it at a CDN in front of the preview endpoint
+PREVIEW_BASE_URL = os.getenv("PREVIEW_BASE_URL", "/api/v1/models/previews").rstrip("/")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def derivative_names():
+    return [f"{kind}.{fmt}" for kind in DERIVATIVE_KINDS for fmt in DERIVATIVE_FORMATS]
+
+
+def derivative_key(result_hash: str, name: str) -> str:
+    return f"{shard_key(DERIVATIVES_DIR, result_hash)}/{name}"
+
+
+def derivative_urls(result_hash: str) -> dict:
+    """
+    Public URLs of a result's derivatives, keyed by "<kind>.<format>".
+    """
+    if not result_hash:
+        return {}
+    return {name: f"{PREVIEW_BASE_URL}/{result_hash}/{name}" for name in derivative_names()}
+
+
+def _watermark(img):
+    """
+    Tile semi-transparent text diagonally across an RGB image.
+    """
+    font = ImageFont.load_default(size=max(12, img.width // 14))
+    left, top, right, bottom = font.getbbox(PREVIEW_WATERMARK_TEXT)
+    step_x, step_y = (right - left) + img.width // 8, (bottom - top) * 4
+
+    # Draw on a larger canvas so the rotated tiles still cover the corners
+    side = int((img.width ** 2 + img.height ** 2) ** 0.5) + step_x
+    layer = PILImage.new("L", (side, side), 0)
+    draw = ImageDraw.Draw(layer)
+    for row, y in enumerate(range(0, side, step_y)):
+        for x in range(-(row % 2) * step_x // 2, side, step_x):
+            draw.text((x, y), PREVIEW_WATERMARK_TEXT, font=font, fill=90)
+    layer = layer.rotate(30, resample=PILImage.BICUBIC)
+    offset = ((side - img.width) // 2, (side - img.height) // 2)
+    mask = layer.crop((offset[0], offset[1], offset[0] + img.width, offset[1] + img.height))
+
+    return PILImage.composite(PILImage.new("RGB", img.size, (255, 255, 255)), img, mask)
+
+
+def _encode(img, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt.upper(), quality=DERIVATIVE_QUALITY.get(fmt, 75))
+    return buffer.getvalue()
+
+
+def render_derivatives(image_bytes: bytes) -> dict:
+    """
+    Encode the thumbnail and watermarked preview of a generated image; returns {name: bytes}.
+
+    Pure CPU work, run on the derivative process pool.
+    """
+    with PILImage.open(io.BytesIO(image_bytes)) as source:
+        source.draft("RGB", (PREVIEW_MAX_EDGE, PREVIEW_MAX_EDGE))
+        img = source.convert("RGB")
+
+    preview = img.copy()
+    preview.thumbnail((PREVIEW_MAX_EDGE, PREVIEW_MAX_EDGE), PILImage.LANCZOS)
+    images = {"preview": _watermark(preview)}
+
+    thumbnail = preview.copy()
+    thumbnail.thumbnail((THUMBNAIL_MAX_EDGE, THUMBNAIL_MAX_EDGE), PILImage.LANCZOS)
+    images["thumbnail"] = _watermark(thumbnail)
+
+    return {f"{kind}.{fmt}": _encode(images[kind], fmt) for kind in DERIVATIVE_KINDS for fmt in DERIVATIVE_FORMATS}
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=DERIVATIVE_WORKERS)
+    return _executor
+
+
+def build_derivatives(image_bytes: bytes) -> str:
+    """
+    Store the derivatives of a generated image under its content hash and return the hash.
+
+    Results with the same content share derivatives, so they are only rendered once.
+    """
+    result_hash = content_hash(image_bytes)
+    names = derivative_names()
+    # Derivatives are written in order, so the last one marks a complete set
+    if not names or storage.exists(derivative_key(result_hash, names[-1])):
+        return result_hash
+
+    with span("derivatives.render"):
+        if multiprocessing.parent_process() is None:
+            rendered = _get_executor().submit(render_derivatives, image_bytes).result()
+        else:
+            # Already in a worker process (GENERATION_POOL=process)
+            rendered = render_derivatives(image_bytes)
+    for name, data in rendered.items():
+        storage.write_bytes(derivative_key(result_hash, name), data)
+    return result_hash
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,6 +1,10 @@
 import os
-import base64
+import binascii
+import hashlib
+import hmac
+import logging
 from dotenv import load_dotenv
+from fastapi import HTTPException, status
 
 # Load .env into environment
 load_dotenv()
@@ -11,6 +15,39 @@ if secret_key_str is None:
     raise RuntimeError("SECRET_KEY not found in environment")
 _SECRET_KEY = secret_key_str.encode("utf-8")
 
+# Append a keyed MAC to encoded ids so forged ids are rejected before any query
+ID_CODEC_MAC = os.getenv("ID_CODEC_MAC", "false").lower() in ("1", "true", "yes")
+# Insecure, only for the migration window after turning the MAC on: ids without one (up to
+# LEGACY_MAX_BYTES) are still accepted, so guessed and forged short ids reach the database again
+ID_CODEC_ACCEPT_LEGACY = os.getenv("ID_CODEC_ACCEPT_LEGACY", "false").lower() in ("1", "true", "yes")
+if ID_CODEC_MAC and ID_CODEC_ACCEPT_LEGACY:
+    logging.getLogger(__name__).warning("ID_CODEC_ACCEPT_LEGACY is on: ids without a MAC are accepted")
+
+MAX_ID_BYTES = 8  # ids are 64-bit at most
+MAC_BYTES = 6
+LEGACY_MAX_BYTES = 6
+# Longest valid encoding: id bytes plus MAC, base64 with padding
+MAX_ENCODED_LENGTH = 4 * ((MAX_ID_BYTES + MAC_BYTES + 2) // 3)
+_TO_URLSAFE = bytes.maketrans(b"+/", b"-_")
+_FROM_URLSAFE = bytes.maketrans(b"-_", b"+/")
+
+# XOR-ing with the key cycled over n bytes equals XOR-ing the integer with this precomputed mask
+_KEY_MASKS = [0] + [
+    int.from_bytes(bytes(_SECRET_KEY[j % len(_SECRET_KEY)] for j in range(n)), "big")
+    for n in range(1, MAX_ID_BYTES + 1)
+]
+_MAC_BASE = hmac.new(hmac.new(_SECRET_KEY, b"opaque-id-mac", hashlib.sha256).digest(), digestmod=hashlib.sha256)
+
+
+class InvalidIdError(ValueError):
+    """Raised when an encoded id is malformed or its MAC does not match."""
+
+
+def _mac(data: bytes) -> bytes:
+    mac = _MAC_BASE.copy()
+    mac.update(data)
+    return mac.digest()[:MAC_BYTES]
+
 
 def encrypt_int(i: int) -> str:
     """
@@ -18,22 +55,49 @@ def encrypt_int(i: int) -> str:
     """
     if i < 0:
         raise ValueError("Only non-negative integers are supported")
-    # Convert integer to bytes (minimal length)
+    # Minimal byte length, then XOR with the key mask for that length
     byte_length = (i.bit_length() + 7) // 8 or 1
-    data = i.to_bytes(byte_length, "big")
-    # XOR with secret key
-    xored = bytes(data[j] ^ _SECRET_KEY[j % len(_SECRET_KEY)] for j in range(len(data)))
+    if byte_length > MAX_ID_BYTES:
+        raise ValueError("Only 64-bit integers are supported")
+    data = (i ^ _KEY_MASKS[byte_length]).to_bytes(byte_length, "big")
+    if ID_CODEC_MAC:
+        data += _mac(data)
     # URL-safe Base64 encode
-    return base64.urlsafe_b64encode(xored).decode("utf-8")
+    return binascii.b2a_base64(data, newline=False).translate(_TO_URLSAFE).decode("ascii")
 
 
 def decrypt_string(s: str) -> int:
     """
     Decrypts the string back into the original integer.
+
+    Raises InvalidIdError for anything that is not a well-formed id.
+    """
+    # Cheap checks first; "+" and "/" belong to the standard alphabet, not the URL-safe one
+    if not isinstance(s, str) or not 0 < len(s) <= MAX_ENCODED_LENGTH or "+" in s or "/" in s:
+        raise InvalidIdError("Malformed id")
+    try:
+        # Strict Base64-decode, tolerating stripped padding
+        raw = (s + "=" * (-len(s) % 4)).encode("ascii").translate(_FROM_URLSAFE)
+        data = binascii.a2b_base64(raw, strict_mode=True)
+    except (binascii.Error, UnicodeEncodeError):
+        raise InvalidIdError("Malformed id")
+
+    if ID_CODEC_MAC and not (ID_CODEC_ACCEPT_LEGACY and len(data) <= LEGACY_MAX_BYTES):
+        data, mac = data[:-MAC_BYTES], data[-MAC_BYTES:]
+        if not data or not hmac.compare_digest(mac, _mac(data)):
+            raise InvalidIdError("Invalid id signature")
+
+    if not 0 < len(data) <= MAX_ID_BYTES:
+        raise InvalidIdError("Malformed id")
+    # Reverse XOR with the key mask
+    return int.from_bytes(data, "big") ^ _KEY_MASKS[len(data)]
+
+
+def decode_id_or_400(s: str, name: str = "id") -> int:
+    """
+    Decode an id from a request, answering 400 for malformed or forged values.
     """
-    # Base64-decode
-    xored = base64.urlsafe_b64decode(s.encode("utf-8"))
-    # Reverse XOR with secret key
-    data = bytes(xored[j] ^ _SECRET_KEY[j % len(_SECRET_KEY)] for j in range(len(xored)))
-    # Convert bytes back to integer
-    return int.from_bytes(data, "big")
+    try:
+        return decrypt_string(s)
+    except InvalidIdError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid {name}")
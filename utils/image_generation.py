@@ -0,0 +1,214 @@
+import asyncio
+import base64
+import hashlib
+import io
+import threading
+
+from utils.openai_client import create_async_client, create_client, resilient_call, resilient_call_async
+from utils.image_processing import prepare_model_input
+from utils.storage import join_key, storage
+from utils.templates import registry
+from utils.tracing import span
+
+# Storage key prefix of generated results, one folder per pet image
+GENERATED_IMAGES_DIR = "generated_images"
+
+_client = None
+_async_client = None
+
+
+def get_client():
+    """
+    Return the shared images client, creating the OpenAI client on first use.
+    """
+    global _client
+    if _client is None:
+        _client = create_client()
+    return _client
+
+
+def set_client(client):
+    """
+    Replace the images client, e.g. with a local stub in tests.
+    """
+    global _client
+    _client = client
+
+
+def get_async_client():
+    """
+    Return the shared AsyncOpenAI client used by GENERATION_POOL=async.
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = create_async_client()
+    return _async_client
+
+
+def set_async_client(client):
+    global _async_client
+    _async_client = client
+
+
+def _load_model_input(source_image_key: str) -> bytes:
+    with storage.open(source_image_key) as source:
+        source_image = io.BytesIO(source.read())
+    return prepare_model_input(source_image)
+
+
+class GenerationBackend:
+    """
+    Turns a template, a prompt and a prepared pet image into generated PNG bytes.
+
+    Backends are registered by name with register_backend() and chosen per template
+    (GENERATION_BACKEND, TEMPLATE_BACKENDS).
+    """
+
+    name = None
+
+    def generate(self, template, prompt: str, model_input: bytes) -> bytes:
+        raise NotImplementedError
+
+    async def generate_async(self, template, prompt: str, model_input: bytes) -> bytes:
+        return await asyncio.to_thread(self.generate, template, prompt, model_input)
+
+    def cache_tag(self):
+        """
+        Part of generation_cache_key() for this backend's settings; None adds nothing.
+        """
+        return None
+
+    def warm(self):
+        """
+        Load whatever the first request would otherwise wait for.
+        """
+
+
+class OpenAIImagesBackend(GenerationBackend):
+    """
+    The OpenAI image edit API, called through resilient_call().
+    """
+
+    name = "openai"
+
+    def _edit_arguments(self, template, prompt: str, model_input: bytes) -> dict:
+        return {
+            "model": "gpt-image-1",
+            "image": [
+                ("template.png", template.image_bytes, "image/png"),
+                ("pet.png", model_input, "image/png"),
+            ],
+            "prompt": prompt,
+        }
+
+    def generate(self, template, prompt: str, model_input: bytes) -> bytes:
+        arguments = self._edit_arguments(template, prompt, model_input)
+        with span("openai.images.edit", template=template.name):
+            result = resilient_call(get_client().images.edit, **arguments)
+        return base64.b64decode(result.data[0].b64_json)
+
+    async def generate_async(self, template, prompt: str, model_input: bytes) -> bytes:
+        arguments = self._edit_arguments(template, prompt, model_input)
+        with span("openai.images.edit", template=template.name):
+            result = await resilient_call_async(get_async_client().images.edit, **arguments)
+        return base64.b64decode(result.data[0].b64_json)
+
+
+def _local_backend():
+    # Imported on first use; the module is only needed by templates that run locally
+    from utils.local_inference import LocalDiffusionBackend
+
+    return LocalDiffusionBackend()
+
+
+# Backend name -> factory; each backend is created once per process
+_backend_factories = {
+    "openai": OpenAIImagesBackend,
+    "local": _local_backend,
+}
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name: str, factory):
+    """
+    Make a backend available to templates under name; factory() is called on first use.
+    """
+    with _backends_lock:
+        _backend_factories[name] = factory
+        _backends.pop(name, None)
+
+
+def get_backend(name: str) -> GenerationBackend:
+    """
+    Return the shared backend registered under name, raising KeyError when there is none.
+    """
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = _backends[name] = _backend_factories[name]()
+    return backend
+
+
+def check_backends():
+    """
+    Raise ValueError when a template names a backend that is not registered.
+    """
+    for name in registry.names():
+        backend = registry.get(name).backend
+        if backend not in _backend_factories:
+            raise ValueError(f"Template {name!r} uses unknown generation backend {backend!r}")
+
+
+def warm_backends():
+    """
+    Warm every backend a template uses, e.g. load the local model before its first job.
+    """
+    for backend in sorted({registry.get(name).backend for name in registry.names()}):
+        get_backend(backend).warm()
+
+
+def generate_image_bytes(source_image_key: str, template_name: str, prompt_key: str) -> bytes:
+    """
+    Generate an image for a stored pet image with the template's backend and return the PNG bytes.
+    """
+    template = registry.get(template_name)
+    backend = get_backend(template.backend)
+    return backend.generate(template, template.prompt(prompt_key), _load_model_input(source_image_key))
+
+
+async def generate_image_bytes_async(source_image_key: str, template_name: str, prompt_key: str) -> bytes:
+    """
+    generate_image_bytes() for the event loop; reading and preprocessing the input run in a thread.
+    """
+    template = registry.get(template_name)
+    backend = get_backend(template.backend)
+    model_input = await asyncio.to_thread(_load_model_input, source_image_key)
+    return await backend.generate_async(template, template.prompt(prompt_key), model_input)
+
+
+def generation_cache_key(source_hash: str, template_name: str, prompt_key: str, variant: int = 0) -> str:
+    """
+    Key identifying a generation result by template content, prompt text, source image content and variant.
+    """
+    template = registry.get(template_name)
+    material = f"{template.content_hash}|{template.prompt(prompt_key)}|{source_hash}|{variant}"
+    backend_tag = get_backend(template.backend).cache_tag()
+    if backend_tag is not None:
+        material = f"{material}|{backend_tag}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def result_filename(template_name: str, prompt_key: str, variant: int = 0) -> str:
+    return f"{template_name}_{prompt_key.rsplit('_', 1)[-1]}_{variant}.png"
+
+
+def save_generated_image(image_bytes: bytes, folder_path: str, filename: str) -> str:
+    """
+    Store generated image bytes in a pet image's folder, replacing any earlier result; returns its key.
+    """
+    generated_image_path = join_key(folder_path, filename)
+    storage.write_bytes(generated_image_path, image_bytes)
+    return generated_image_path
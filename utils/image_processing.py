@@ -1,6 +1,265 @@
+import asyncio
 import base64
+import contextvars
+import functools
+import hashlib
+import io
+import math
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from PIL import Image as PILImage, ImageChops, ImageOps
+from starlette.concurrency import run_in_threadpool
+
+from utils.tracing import span
+
+load_dotenv()
+
+# Storage key prefix of normalized uploads
+UPLOAD_DIR = "uploaded_images"
+# Local scratch space for uploads being received and normalized
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.join(UPLOAD_DIR, "incoming"))
+
+# Size of each read from the multipart body when spooling an upload to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1 MB
+# Upper bound on concurrent decode / re-encode jobs
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Largest edge gpt-image-1 works with (1024x1536 / 1536x1024 outputs)
+MODEL_MAX_EDGE = int(os.getenv("MODEL_MAX_EDGE", "1536"))
+# Pixels decoded per upload; JPEGs count at the reduced scale they are decoded at
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(50_000_000)))
+# Crop uploads around the detected pet before storing them
+CROP_TO_SUBJECT = os.getenv("CROP_TO_SUBJECT", "false").lower() in ("1", "true", "yes")
+# Per-channel difference from the background that counts as subject
+SUBJECT_THRESHOLD = 40
+# Extra border kept around the detected subject, relative to its size
+SUBJECT_MARGIN = 0.15
+
+# Leading bytes of the accepted formats (WebP is checked separately: "RIFF" <size> "WEBP")
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+# Pillow formats uploads may decode as; MPO is the multi-picture JPEG many phones write
+DECODABLE_FORMATS = {"JPEG", "MPO", "PNG", "GIF", "BMP", "WEBP"}
+
+image_executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image")
+
+
+ImageHashes = namedtuple("ImageHashes", ["content_hash", "perceptual_hash"])
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds the allowed size while streaming."""
+
+
+class ImageTooLargeError(Exception):
+    """Raised when an image has more pixels than MAX_IMAGE_PIXELS allows."""
+
+
+class InvalidImageError(Exception):
+    """Raised when an upload cannot be decoded as one of the accepted formats."""
+
+
+def sniff_image_type(header: bytes):
+    """
+    Identify an image format from its first bytes; returns e.g. "jpeg", or None.
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    for signature, image_type in _SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    return None
+
+
+def open_within_budget(source, max_edge: int = MODEL_MAX_EDGE, reduce: bool = True):
+    """
+    Open an image and check it against the pixel budget before any pixels are decoded.
+
+    With reduce, JPEGs are set up to decode at the smallest DCT scale (1/2 to 1/8)
+    that still covers max_edge, so a 48 MP photo is never held at full size.
+    """
+    try:
+        pil_img = PILImage.open(source)
+    except PILImage.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    except OSError as e:
+        raise InvalidImageError(str(e)) from e
+
+    try:
+        if pil_img.format not in DECODABLE_FORMATS:
+            raise InvalidImageError(f"Unsupported image format {pil_img.format}")
+        if reduce and max(pil_img.size) > max_edge:
+            scale = max_edge / max(pil_img.size)
+            pil_img.draft(pil_img.mode, (math.ceil(pil_img.width * scale), math.ceil(pil_img.height * scale)))
+        if pil_img.width * pil_img.height > MAX_IMAGE_PIXELS:
+            raise ImageTooLargeError(f"{pil_img.width}x{pil_img.height} exceeds {MAX_IMAGE_PIXELS} pixels")
+    except Exception:
+        pil_img.close()
+        raise
+    return pil_img
+
 
 def encode_image(file_path):
     with open(file_path, "rb") as f:
         base64_image = base64.b64encode(f.read()).decode("utf-8")
-    return base64_image
\ No newline at end of file
+    return base64_image
+
+
+async def run_in_image_executor(func, *args, **kwargs):
+    """
+    Run CPU-heavy image work on the bounded image executor.
+    """
+    loop = asyncio.get_running_loop()
+    # Carry the request id into the worker thread for logging
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(image_executor, functools.partial(context.run, func, *args, **kwargs))
+
+
+async def save_upload_to_disk(upload, dest_path: str, max_size: int, chunk_size: int = UPLOAD_CHUNK_SIZE) -> bytes:
+    """
+    Stream an UploadFile to dest_path in chunks and return its first bytes for sniffing.
+    """
+    header = b""
+    total = 0
+    with open(dest_path, "wb") as out:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_size:
+                raise UploadTooLargeError()
+            if not header:
+                header = chunk[:1024]
+            await run_in_threadpool(out.write, chunk)
+    return header
+
+
+def compute_image_hashes(img) -> ImageHashes:
+    """
+    Compute an exact hash of the normalized pixels and a 64-bit difference hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{img.mode}:{img.width}x{img.height}:".encode("utf-8"))
+    digest.update(img.tobytes())
+
+    # dHash: compare horizontally adjacent pixels of a 9x8 grayscale thumbnail
+    small = img.convert("L").resize((9, 8), PILImage.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (1 if left > right else 0)
+
+    return ImageHashes(digest.hexdigest(), f"{bits:016x}")
+
+
+def downscale(img, max_edge: int = MODEL_MAX_EDGE):
+    """
+    Shrink an image in place so its longest edge is at most max_edge, keeping the aspect ratio.
+    """
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), PILImage.LANCZOS)
+    return img
+
+
+def crop_to_subject(img):
+    """
+    Center-crop a square around the region that differs from the border colour.
+    """
+    rgb = img.convert("RGB")
+    width, height = rgb.size
+
+    # Estimate the background from the median of the four corners
+    corners = [rgb.getpixel((0, 0)), rgb.getpixel((width - 1, 0)),
+               rgb.getpixel((0, height - 1)), rgb.getpixel((width - 1, height - 1))]
+    background = tuple(sorted(channel)[len(channel) // 2] for channel in zip(*corners))
+
+    diff = ImageChops.difference(rgb, PILImage.new("RGB", rgb.size, background)).convert("L")
+    bbox = diff.point(lambda value: 255 if value > SUBJECT_THRESHOLD else 0).getbbox()
+    if not bbox:
+        return img
+
+    left, top, right, bottom = bbox
+    side = int(max(right - left, bottom - top) * (1 + 2 * SUBJECT_MARGIN))
+    side = min(max(side, 1), width, height)
+    center_x = (left + right) // 2
+    center_y = (top + bottom) // 2
+    crop_left = min(max(center_x - side // 2, 0), width - side)
+    crop_top = min(max(center_y - side // 2, 0), height - side)
+    return img.crop((crop_left, crop_top, crop_left + side, crop_top + side))
+
+
+def canonicalize_image(pil_img, crop: bool = CROP_TO_SUBJECT):
+    """
+    Apply EXIF orientation, normalize the mode, optionally crop and downscale for the model.
+
+    Works in place where it can to avoid full-size copies, so the result may be pil_img
+    itself; use it before closing pil_img and do not use pil_img otherwise.
+    """
+    pil_img.load()
+    ImageOps.exif_transpose(pil_img, in_place=True)
+
+    # Convert to RGBA if it has transparency, else to RGB
+    if pil_img.mode in ("RGBA", "LA") or (pil_img.mode == "P" and "transparency" in pil_img.info):
+        mode = "RGBA"
+    else:
+        mode = "RGB"
+    converted = pil_img if pil_img.mode == mode else pil_img.convert(mode)
+
+    if crop:
+        converted = crop_to_subject(converted)
+
+    return downscale(converted)
+
+
+def encode_png(img) -> bytes:
+    buffer = io.BytesIO()
+    with span("pil.save", format="PNG"):
+        img.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def normalize_image(source_path: str, dest_path: str) -> ImageHashes:
+    """
+    Decode an uploaded image, re-encode it as a canonical PNG and return its hashes.
+
+    Raises ImageTooLargeError or InvalidImageError before decoding when the image is unacceptable.
+    """
+    # Cropping needs the detail of the full-resolution image
+    with open_within_budget(source_path, reduce=not CROP_TO_SUBJECT) as pil_img:
+        try:
+            converted = canonicalize_image(pil_img)
+        except OSError as e:
+            # Truncated or corrupt image data
+            raise InvalidImageError(str(e)) from e
+
+        with span("pil.save", format="PNG"):
+            converted.save(dest_path, format="PNG")
+        return compute_image_hashes(converted)
+
+
+def prepare_model_input(source) -> bytes:
+    """
+    Return PNG bytes for the image edit API, downscaling images stored before preprocessing.
+
+    source is a file path or a seekable binary file object.
+    """
+    with open_within_budget(source) as pil_img:
+        if pil_img.format == "PNG" and max(pil_img.size) <= MODEL_MAX_EDGE:
+            if isinstance(source, (str, os.PathLike)):
+                with open(source, "rb") as f:
+                    return f.read()
+            source.seek(0)
+            return source.read()
+        return encode_png(canonicalize_image(pil_img, crop=False))
@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait as wait_futures
+from dotenv import load_dotenv
+from sqlalchemy import update
+
+from database import SessionLocal, engine
+from models.GenerationJob import (
+    GenerationJob,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_DONE,
+    JOB_FAILED,
+    PENDING_JOB_STATUSES,
+)
+from models.PetImage import PetImage
+from utils.derivatives import build_derivatives
+from utils.image_generation import generate_image_bytes, generate_image_bytes_async, save_generated_image, result_filename
+from utils import openai_client
+from utils.openai_client import CircuitOpenError, is_permanent, is_retryable, share_rate_limit
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Number of image edit calls allowed to run at the same time
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "4"))
+# "thread", "process" or "async" (AsyncOpenAI on the event loop, blocking steps in threads)
+GENERATION_POOL = os.getenv("GENERATION_POOL", "thread")
+# Failed jobs are retried on their own with exponential backoff; image API errors are not,
+# resilient_call() has already retried them
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "3"))
+GENERATION_RETRY_BASE_SECONDS = float(os.getenv("GENERATION_RETRY_BASE_SECONDS", "5"))
+# How long shutdown waits for running jobs; unfinished ones are resumed on the next start
+GENERATION_DRAIN_SECONDS = float(os.getenv("GENERATION_DRAIN_SECONDS", "60"))
+
+# What a running job needs, read once so the upstream call holds no database session
+GenerationTask = namedtuple("GenerationTask", "job_id attempts source_key folder template prompt_key variant")
+
+# Pid of the API worker that owns this process's jobs; pool processes record their parent's
+_owner_pid = None
+
+
+def worker_name(pid: int = None) -> str:
+    """
+    Name recorded on the jobs a worker process queued or claimed; pid defaults to this process's worker.
+    """
+    return f"{socket.gethostname()}:{pid or _owner_pid or os.getpid()}"
+
+
+def _init_worker_process(pool_size: int):
+    global _owner_pid
+    # Connections inherited from the parent process must not be shared
+    engine.dispose(close=False)
+    # The API worker is what serve.py watches, so jobs are recorded as its own
+    _owner_pid = os.getppid()
+    # Every pool process makes image edit calls, so each gets its share of the rate
+    share_rate_limit(openai_client.rate_limit_processes * pool_size)
+
+
+def _build_previews(image_bytes: bytes):
+    # Previews are best effort; a result without them can still be paid for and downloaded
+    try:
+        return build_derivatives(image_bytes)
+    except Exception:
+        logger.exception("Preview rendering failed")
+        return None
+
+
+def _start_job(job_id: int):
+    """
+    Claim a queued job and return its task, or None when there is nothing to run.
+
+    The claim is one conditional UPDATE, so of several workers or replicas handed the
+    same job id exactly one runs it; a running job is only requeued by reset_pending_jobs()
+    or, once its worker is gone, by release_worker_jobs().
+    """
+    db = SessionLocal()
+    try:
+        claimed = db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == job_id, GenerationJob.status == JOB_QUEUED)
+            .values(status=JOB_RUNNING, attempts=GenerationJob.attempts + 1, worker=worker_name())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        if claimed.rowcount == 0:
+            return None
+
+        job = db.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+        pet_image = db.query(PetImage).filter(PetImage.id == job.pet_image_id).first()
+        return GenerationTask(
+            job_id=job.id,
+            attempts=job.attempts,
+            source_key=pet_image.image_url if pet_image else None,
+            folder=pet_image.generated_images_folder_path if pet_image else None,
+            template=job.template,
+            prompt_key=job.prompt_key,
+            variant=job.variant,
+        )
+    finally:
+        db.close()
+
+
+def _store_result(task: GenerationTask, image_bytes: bytes):
+    result_path = save_generated_image(
+        image_bytes, task.folder, result_filename(task.template, task.prompt_key, task.variant)
+    )
+    return result_path, _build_previews(image_bytes)
+
+
+def _finish_job(task: GenerationTask, result=None, error: Exception = None):
+    """
+    Record a job's outcome; returns the delay in seconds before it should be retried, or None.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(GenerationJob).filter(GenerationJob.id == task.job_id).first()
+        if not job:
+            return None
+
+        retry_delay = None
+        if error is None:
+            job.result_path, job.result_hash = result
+            job.status = JOB_DONE
+            job.error = None
+        elif isinstance(error, CircuitOpenError):
+            # Refused without reaching the image API, so the attempt does not count
+            job.error = str(error)
+            job.status = JOB_QUEUED
+            job.attempts = task.attempts - 1
+            retry_delay = error.retry_after
+        else:
+            job.error = str(error)
+            # Retrying what the call already retried would multiply the upstream calls per job
+            if task.attempts < GENERATION_MAX_ATTEMPTS and not is_permanent(error) and not is_retryable(error):
+                job.status = JOB_QUEUED
+                retry_delay = GENERATION_RETRY_BASE_SECONDS * 2 ** (task.attempts - 1)
+            else:
+                job.status = JOB_FAILED
+
+        db.commit()
+        return retry_delay
+    finally:
+        db.close()
+
+
+def run_generation_job(job_id: int):
+    """
+    Run a single generation job and record its outcome in the database.
+
+    Returns the delay in seconds before the job should be retried, or None.
+    """
+    task = _start_job(job_id)
+    if task is None:
+        return None
+    try:
+        if not task.folder:
+            raise RuntimeError("Image not found")
+        image_bytes = generate_image_bytes(task.source_key, task.template, task.prompt_key)
+        result = _store_result(task, image_bytes)
+    except Exception as e:
+        return _finish_job(task, error=e)
+    return _finish_job(task, result=result)
+
+
+async def run_generation_job_async(job_id: int):
+    """
+    run_generation_job() with the image API call awaited on the event loop.
+    """
+    task = await asyncio.to_thread(_start_job, job_id)
+    if task is None:
+        return None
+    try:
+        if not task.folder:
+            raise RuntimeError("Image not found")
+        image_bytes = await generate_image_bytes_async(task.source_key, task.template, task.prompt_key)
+        result = await asyncio.to_thread(_store_result, task, image_bytes)
+    except Exception as e:
+        return await asyncio.to_thread(_finish_job, task, None, e)
+    return await asyncio.to_thread(_finish_job, task, result)
+
+
+def reset_pending_jobs():
+    """
+    Mark jobs left queued or running by a previous process as queued and return their ids.
+    """
+    db = SessionLocal()
+    try:
+        pending = db.query(GenerationJob).filter(GenerationJob.status.in_(PENDING_JOB_STATUSES)).all()
+        for job in pending:
+            job.status = JOB_QUEUED
+        db.commit()
+        return [job.id for job in pending]
+    finally:
+        db.close()
+
+
+def release_worker_jobs(worker: str):
+    """
+    Requeue the jobs a worker that is gone had queued or claimed, and return their ids.
+
+    Its running jobs were cut off and its queued ones only existed in its pool, so
+    nothing else would run them; they stay queued until another worker resumes them.
+    """
+    db = SessionLocal()
+    try:
+        job_ids = [job_id for job_id, in db.query(GenerationJob.id).filter(
+            GenerationJob.worker == worker,
+            GenerationJob.status.in_(PENDING_JOB_STATUSES),
+        )]
+        if job_ids:
+            db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id.in_(job_ids), GenerationJob.status.in_(PENDING_JOB_STATUSES))
+                .values(status=JOB_QUEUED, worker=None)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        return job_ids
+    finally:
+        db.close()
+
+
+def _adopt_jobs(job_ids):
+    # Resumed jobs become this worker's, so they are released again if it dies too
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id.in_(job_ids), GenerationJob.status == JOB_QUEUED)
+            .values(worker=worker_name())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+class GenerationJobQueue:
+    """
+    Bounded worker pool that runs generation jobs off the event loop.
+
+    With pool="async" jobs are tasks on the event loop instead, at most max_workers at a time.
+    """
+
+    def __init__(self, max_workers: int, pool: str = "thread"):
+        self._executor = None
+        self._semaphore = None
+        self._closed = False
+        self._futures = set()
+        if pool == "async":
+            self._semaphore = asyncio.Semaphore(max_workers)
+            self._loop = None
+            self._tasks = set()
+        elif pool == "process":
+            self._executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker_process,
+                                                 initargs=(max_workers,))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+
+    def submit(self, job_id: int):
+        if self._closed:
+            # The job stays queued in the database and is resumed on the next start
+            return None
+        if self._semaphore is not None:
+            return self._submit_async(job_id)
+        future = self._executor.submit(run_generation_job, job_id)
+        self._futures.add(future)
+        future.add_done_callback(lambda done: self._schedule_retry(job_id, done))
+        return future
+
+    def _schedule_retry(self, job_id: int, future):
+        self._futures.discard(future)
+        if future.cancelled() or future.exception() is not None:
+            return
+        retry_delay = future.result()
+        if retry_delay is not None:
+            timer = threading.Timer(retry_delay, self.submit, args=(job_id,))
+            timer.daemon = True
+            timer.start()
+
+    def _submit_async(self, job_id: int):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if self._loop is None:
+            self._loop = running_loop
+        if running_loop is None or running_loop is not self._loop:
+            # Called from another thread: hand the job to the serving loop
+            return asyncio.run_coroutine_threadsafe(self._run_async(job_id), self._loop)
+        task = self._loop.create_task(self._run_async(job_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run_async(self, job_id: int):
+        try:
+            async with self._semaphore:
+                retry_delay = await run_generation_job_async(job_id)
+        except Exception:
+            logger.exception("Generation job failed", extra={"job_id": job_id})
+            return
+        if retry_delay is not None:
+            self._loop.call_later(retry_delay, self.submit, job_id)
+
+    def resume_pending(self, job_ids=None):
+        """
+        Requeue jobs left queued or running by a previous process.
+
+        job_ids are jobs already reset with reset_pending_jobs() or release_worker_jobs(),
+        e.g. by the launcher before it started or restarted this worker.
+        """
+        if job_ids is None:
+            job_ids = reset_pending_jobs()
+        if job_ids:
+            _adopt_jobs(job_ids)
+        for job_id in job_ids:
+            self.submit(job_id)
+
+    async def drain(self, timeout: float = GENERATION_DRAIN_SECONDS):
+        """
+        Stop taking jobs, wait up to timeout seconds for running ones, then shut the pool down.
+        """
+        self._closed = True
+        if self._executor is not None:
+            pending = list(self._futures)
+            if pending:
+                logger.info("Draining generation jobs", extra={"jobs": len(pending)})
+                await asyncio.to_thread(wait_futures, pending, timeout)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            return
+        pending = list(self._tasks)
+        if pending:
+            logger.info("Draining generation jobs", extra={"jobs": len(pending)})
+            await asyncio.wait(pending, timeout=timeout)
+        self.shutdown()
+
+    def shutdown(self, wait: bool = True):
+        self._closed = True
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            return
+        # Interrupted jobs stay running in the database and are resumed on the next start
+        for task in list(self._tasks):
+            task.cancel()
+
+
+job_queue = GenerationJobQueue(GENERATION_WORKERS, GENERATION_POOL)
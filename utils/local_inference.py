@@ -0,0 +1,237 @@
+import asyncio
+import io
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from utils.image_generation import GenerationBackend
+from utils.image_processing import encode_png
+from utils.metrics import LOCAL_INFERENCE_BATCH_SIZE
+from utils.tracing import span
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Diffusers inpainting checkpoint (hub id or local directory); also used for masked img2img
+LOCAL_INFERENCE_MODEL = os.getenv("LOCAL_INFERENCE_MODEL", "stable-diffusion-v1-5/stable-diffusion-inpainting")
+# Denoising steps per image; CPU time grows linearly with it
+LOCAL_INFERENCE_STEPS = int(os.getenv("LOCAL_INFERENCE_STEPS", "20"))
+# Output size as WIDTHxHEIGHT, rounded down to multiples of 8; the default keeps the templates' 3:4
+LOCAL_INFERENCE_RESOLUTION = os.getenv("LOCAL_INFERENCE_RESOLUTION", "480x640")
+# How far the input is noised before denoising: lower keeps more of the pet photo
+LOCAL_INFERENCE_STRENGTH = float(os.getenv("LOCAL_INFERENCE_STRENGTH", "0.75"))
+LOCAL_INFERENCE_GUIDANCE_SCALE = float(os.getenv("LOCAL_INFERENCE_GUIDANCE_SCALE", "7.5"))
+# Concurrent requests run as one forward pass, up to this many, waiting this long for company
+LOCAL_INFERENCE_MAX_BATCH = int(os.getenv("LOCAL_INFERENCE_MAX_BATCH", "4"))
+LOCAL_INFERENCE_BATCH_WAIT_MS = float(os.getenv("LOCAL_INFERENCE_BATCH_WAIT_MS", "50"))
+# torch intra-op threads; 0 keeps torch's default (one per core)
+LOCAL_INFERENCE_THREADS = int(os.getenv("LOCAL_INFERENCE_THREADS", "0"))
+
+
+def parse_resolution(value: str):
+    """
+    Parse "WIDTHxHEIGHT" into a (width, height) the model accepts, i.e. multiples of 8.
+    """
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Invalid resolution {value!r}, expected WIDTHxHEIGHT")
+    width, height = width - width % 8, height - height % 8
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid resolution {value!r}")
+    return width, height
+
+
+class InferenceBatcher:
+    """
+    Run concurrent requests through run_batch together, on one inference thread per process.
+
+    submit() returns a Future for the item's result. The thread takes the first queued
+    item, waits up to max_wait seconds for more (at most max_batch in total) and calls
+    run_batch(items), which must return one result per item in order.
+    """
+
+    def __init__(self, run_batch: Callable[[list], list], max_batch: int, max_wait: float):
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def submit(self, item) -> Future:
+        future = Future()
+        self._ensure_thread().put((item, future))
+        return future
+
+    def _ensure_thread(self) -> queue.Queue:
+        with self._lock:
+            # A forked process inherits the queue but not the thread serving it
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._serve, args=(self._queue,),
+                                                name="local-inference", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+            return self._queue
+
+    def _collect(self, pending: queue.Queue) -> list:
+        batch = [pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self, pending: queue.Queue):
+        while True:
+            batch = [(item, future) for item, future in self._collect(pending) if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            LOCAL_INFERENCE_BATCH_SIZE.observe(len(batch))
+            try:
+                with span("local.inference.batch", size=len(batch)):
+                    results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def _fit(image: Image.Image, size) -> Image.Image:
+    return ImageOps.fit(image.convert("RGB"), size, Image.Resampling.LANCZOS)
+
+
+def compose_input(model_input: bytes, template_bytes: bytes, mask_bytes: Optional[bytes], size):
+    """
+    Return the (image, mask) pair to denoise at size; white mask pixels are repainted.
+
+    With a template mask, the pet is fitted into the mask's bounding box on the template
+    and only that region is repainted. Without one the whole pet photo is restyled,
+    which makes the inpainting model an img2img model.
+    """
+    with Image.open(io.BytesIO(model_input)) as pet:
+        pet.load()
+        if mask_bytes is None:
+            return _fit(pet, size), Image.new("L", size, 255)
+
+        with Image.open(io.BytesIO(template_bytes)) as template, Image.open(io.BytesIO(mask_bytes)) as mask:
+            image = _fit(template, size)
+            mask = ImageOps.fit(mask.convert("L"), size, Image.Resampling.NEAREST)
+        box = mask.getbbox()
+        if box is None:
+            return image, mask
+        left, top, right, bottom = box
+        image.paste(_fit(pet, (right - left, bottom - top)), (left, top), mask.crop(box))
+        return image, mask
+
+
+class LocalDiffusionBackend(GenerationBackend):
+    """
+    Image generation with a diffusers inpainting pipeline on the local CPU.
+
+    The pipeline is loaded on the first request (or by warm()) and kept for the life of
+    the process; after a fork it is loaded again. Requests that arrive together are
+    denoised as one batch, so generation threads or tasks share each forward pass.
+    """
+
+    name = "local"
+
+    def __init__(self, model: str = LOCAL_INFERENCE_MODEL, steps: int = LOCAL_INFERENCE_STEPS,
+                 resolution: str = LOCAL_INFERENCE_RESOLUTION, strength: float = LOCAL_INFERENCE_STRENGTH,
+                 guidance_scale: float = LOCAL_INFERENCE_GUIDANCE_SCALE, max_batch: int = LOCAL_INFERENCE_MAX_BATCH,
+                 batch_wait_ms: float = LOCAL_INFERENCE_BATCH_WAIT_MS):
+        self.model = model
+        self.steps = steps
+        self.size = parse_resolution(resolution)
+        self.strength = strength
+        self.guidance_scale = guidance_scale
+        self.batcher = InferenceBatcher(self._run_batch, max_batch, batch_wait_ms / 1000)
+        self._pipeline = None
+        self._pipeline_pid = None
+        self._lock = threading.Lock()
+
+    def cache_tag(self) -> str:
+        """
+        Settings that change the output, so cached results are not shared across them.
+        """
+        width, height = self.size
+        return f"local|{self.model}|{self.steps}|{width}x{height}|{self.strength}|{self.guidance_scale}"
+
+    def _load_pipeline(self):
+        # torch and diffusers are imported here so processes that never run the backend skip them
+        try:
+            import torch
+            from diffusers import AutoPipelineForInpainting
+        except ImportError:
+            raise RuntimeError("The local generation backend needs the local-inference extra (torch, diffusers)")
+
+        if LOCAL_INFERENCE_THREADS > 0:
+            torch.set_num_threads(LOCAL_INFERENCE_THREADS)
+        with span("local.inference.load", model=self.model):
+            pipeline = AutoPipelineForInpainting.from_pretrained(self.model, torch_dtype=torch.float32)
+        pipeline.to("cpu")
+        pipeline.set_progress_bar_config(disable=True)
+        logger.info("Loaded local inference model", extra={"model": self.model})
+        return pipeline
+
+    def pipeline(self):
+        with self._lock:
+            if self._pipeline is None or self._pipeline_pid != os.getpid():
+                self._pipeline = self._load_pipeline()
+                self._pipeline_pid = os.getpid()
+            return self._pipeline
+
+    def warm(self):
+        """
+        Load the model now rather than on the first request.
+        """
+        self.pipeline()
+
+    def _run_batch(self, items: List[tuple]) -> List[Image.Image]:
+        import torch
+
+        pipeline = self.pipeline()
+        prompts, images, masks = zip(*items)
+        width, height = self.size
+        with torch.inference_mode():
+            output = pipeline(
+                prompt=list(prompts),
+                image=list(images),
+                mask_image=list(masks),
+                width=width,
+                height=height,
+                num_inference_steps=self.steps,
+                strength=self.strength,
+                guidance_scale=self.guidance_scale,
+            )
+        return output.images
+
+    def _submit(self, template, prompt: str, model_input: bytes) -> Future:
+        image, mask = compose_input(model_input, template.image_bytes, template.mask_bytes, self.size)
+        return self.batcher.submit((prompt, image, mask))
+
+    def generate(self, template, prompt: str, model_input: bytes) -> bytes:
+        with span("local.inference", template=template.name):
+            result = self._submit(template, prompt, model_input).result()
+        return encode_png(result)
+
+    async def generate_async(self, template, prompt: str, model_input: bytes) -> bytes:
+        future = await asyncio.to_thread(self._submit, template, prompt, model_input)
+        with span("local.inference", template=template.name):
+            result = await asyncio.wrap_future(future)
+        return await asyncio.to_thread(encode_png, result)
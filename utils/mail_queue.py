@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import random
+from datetime import timedelta
+from dotenv import load_dotenv
+from sqlalchemy import and_, or_
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal, utcnow
+from models.OutboundEmail import OutboundEmail, EMAIL_PENDING, EMAIL_SENDING, EMAIL_SENT, EMAIL_FAILED
+from utils.mailconfig import get_transport
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "30"))
+# How often the sender checks for due emails when it is not woken up
+MAIL_POLL_SECONDS = float(os.getenv("MAIL_POLL_SECONDS", "10"))
+# Claimed emails still unsent after this long belong to a sender that died and are sent again
+MAIL_CLAIM_TIMEOUT_SECONDS = float(os.getenv("MAIL_CLAIM_TIMEOUT_SECONDS", "600"))
+
+
+def build_email(recipient: str, subject: str, html_content: str, recipient_name: str = None) -> OutboundEmail:
+    """
+    Create a pending email row; the caller adds it to its session and commits.
+    """
+    return OutboundEmail(
+        recipient=recipient,
+        recipient_name=recipient_name,
+        subject=subject,
+        html_content=html_content,
+        status=EMAIL_PENDING,
+        attempts=0,
+        next_attempt_at=utcnow(),
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Exponential backoff with full jitter for the given number of failed attempts.
+    """
+    return random.uniform(0, MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def claim_due_emails():
+    """
+    Mark up to MAIL_BATCH_SIZE due emails as sending and commit, so no other sender picks them up.
+
+    Emails a dead sender left claimed for MAIL_CLAIM_TIMEOUT_SECONDS are claimed again.
+    Returns the claim timestamp and the claimed emails.
+    """
+    now = utcnow()
+    # Whole seconds, so the claim compares equal after a round trip through MySQL's DATETIME
+    claimed_at = now.replace(microsecond=0)
+    db = SessionLocal()
+    try:
+        stale = now - timedelta(seconds=MAIL_CLAIM_TIMEOUT_SECONDS)
+        # Row locks are only held while claiming, never across a send
+        emails = db.query(OutboundEmail).filter(or_(
+            and_(OutboundEmail.status == EMAIL_PENDING, OutboundEmail.next_attempt_at <= now),
+            and_(OutboundEmail.status == EMAIL_SENDING, OutboundEmail.claimed_at <= stale),
+        )).order_by(OutboundEmail.next_attempt_at).limit(MAIL_BATCH_SIZE).with_for_update(skip_locked=True).all()
+        for email in emails:
+            email.status = EMAIL_SENDING
+            email.claimed_at = claimed_at
+        db.commit()
+        return claimed_at, [(email.id, email.recipient, email.subject, email.html_content, email.recipient_name)
+                            for email in emails]
+    finally:
+        db.close()
+
+
+def record_send(email_id: int, claimed_at, error: Exception = None):
+    """
+    Store the outcome of one send on its claimed row.
+    """
+    db = SessionLocal()
+    try:
+        email = db.query(OutboundEmail).filter(
+            OutboundEmail.id == email_id,
+            OutboundEmail.status == EMAIL_SENDING,
+            OutboundEmail.claimed_at == claimed_at
+        ).first()
+        if email is None:
+            # Claimed again by another sender after the claim timed out
+            return
+        email.claimed_at = None
+        if error is None:
+            email.status = EMAIL_SENT
+            email.last_error = None
+        else:
+            email.attempts += 1
+            email.last_error = str(error)
+            if email.attempts >= MAIL_MAX_ATTEMPTS:
+                email.status = EMAIL_FAILED
+            else:
+                email.status = EMAIL_PENDING
+                email.next_attempt_at = utcnow() + timedelta(seconds=retry_delay(email.attempts))
+        db.commit()
+    finally:
+        db.close()
+
+
+def send_pending_batch() -> int:
+    """
+    Send up to MAIL_BATCH_SIZE due emails and return how many were attempted.
+
+    Each outcome is committed right after its send: a crash mid-batch resends at most the
+    email that was in flight, once its claim times out.
+    """
+    claimed_at, emails = claim_due_emails()
+
+    transport = get_transport()
+    for email_id, recipient, subject, html_content, recipient_name in emails:
+        try:
+            transport.send(recipient, subject, html_content, recipient_name)
+        except Exception as e:
+            record_send(email_id, claimed_at, e)
+        else:
+            record_send(email_id, claimed_at)
+    return len(emails)
+
+
+class MailSender:
+    """
+    Background task that drains the outbound email table.
+    """
+
+    def __init__(self):
+        self._wakeup = None
+        self._task = None
+
+    def notify(self):
+        """
+        Wake the sender after new emails were committed.
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await run_in_threadpool(send_pending_batch)
+            except Exception:
+                logger.exception("Email delivery failed")
+                sent = 0
+
+            # Keep draining while full batches come back
+            if sent >= MAIL_BATCH_SIZE:
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=MAIL_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+mail_sender = MailSender()
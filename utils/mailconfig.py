@@ -1,33 +1,91 @@
 from jinja2 import Environment, FileSystemLoader
+import logging
 import os
 from dotenv import load_dotenv
-import brevo_python
-from brevo_python.rest import ApiException
 
 load_dotenv()
 
-# Ensure that all necessary environment variables are set
-configuration = brevo_python.Configuration()
-configuration.api_key['api-key'] = os.getenv('BREVO_API_KEY')
+logger = logging.getLogger(__name__)
 
+SENDER = {"name": "FUR & FURBLE", "email": "support@furandfable.com"}
+REPLY_TO = {"name": "FUR & FURBLE", "email": "support@furandfable.com"}
 
-api_instance = brevo_python.TransactionalEmailsApi(brevo_python.ApiClient(configuration))
+# "brevo" sends through the Brevo API, "console" only logs (local development and tests)
+MAIL_TRANSPORT = os.getenv("MAIL_TRANSPORT", "brevo")
+# Overrides the Brevo API URL, e.g. with a local stub in load tests
+BREVO_API_HOST = os.getenv("BREVO_API_HOST")
 
-def send_email(recipient, subject, html_content, recipient_name):
-    subject = "from the Python SDK!"
-    sender = {"name":"FUR & FURBLE","email":"support@furandfable.com"}
-    replyTo = {"name":"FUR & FURBLE","email":"support@furandfable.com"}
+# Templates are compiled once and kept in the environment's cache
+_template_env = Environment(loader=FileSystemLoader('templates'), auto_reload=False)
+
+
+class BrevoTransport:
+    """
+    Send transactional emails through the Brevo API.
+    """
+
+    def __init__(self):
+        # The SDK is imported with the first email to keep it out of process startup
+        import brevo_python
+        from brevo_python.rest import ApiException
+
+        self._brevo = brevo_python
+        # Failures send_email() logs instead of raising
+        self.errors = (ApiException,)
+        # Ensure that all necessary environment variables are set
+        configuration = brevo_python.Configuration()
+        configuration.api_key['api-key'] = os.getenv('BREVO_API_KEY')
+        if BREVO_API_HOST:
+            configuration.host = BREVO_API_HOST
+        self.api_instance = brevo_python.TransactionalEmailsApi(brevo_python.ApiClient(configuration))
+
+    def send(self, recipient, subject, html_content, recipient_name):
+        to = [{"email": recipient, "name": recipient_name}]
+        send_smtp_email = self._brevo.SendSmtpEmail(to=to, reply_to=REPLY_TO, html_content=html_content, sender=SENDER, subject=subject, headers=None)
+        # Send a transactional email; ApiException propagates so the caller can retry
+        self.api_instance.send_transac_email(send_smtp_email)
+
+
+class ConsoleTransport:
+    """
+    Log emails instead of sending them and keep them for inspection.
+    """
+
+    errors = ()
+
+    def __init__(self):
+        self.sent = []
 
-    to = [{"email": recipient,"name": recipient_name}]
-    send_smtp_email = brevo_python.SendSmtpEmail(to=to, reply_to=replyTo, html_content=html_content, sender=sender, subject=subject, headers=None)
-    
+    def send(self, recipient, subject, html_content, recipient_name):
+        self.sent.append((recipient, subject, html_content, recipient_name))
+        logger.info("Email to %s: %s", recipient, subject)
+
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = ConsoleTransport() if MAIL_TRANSPORT == "console" else BrevoTransport()
+    return _transport
+
+
+def set_transport(transport):
+    """
+    Replace the mail transport, e.g. with a local stub in tests.
+    """
+    global _transport
+    _transport = transport
+
+
+def send_email(recipient, subject, html_content, recipient_name):
+    transport = get_transport()
     try:
-        # Send a transactional email
-        api_response = api_instance.send_transac_email(send_smtp_email)
-    except ApiException as e:
-        print("Error sending email:", e)
+        transport.send(recipient, subject, html_content, recipient_name)
+    except getattr(transport, "errors", ()) as e:
+        logger.error("Error sending email: %s", e)
 
 def render_template(template_name, **kwargs):
-    env = Environment(loader=FileSystemLoader('templates'))
-    template = env.get_template(template_name)
-    return template.render(**kwargs)
\ No newline at end of file
+    template = _template_env.get_template(template_name)
+    return template.render(**kwargs)
@@ -0,0 +1,112 @@
+import os
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+
+# Gauges say how to combine the values of several processes when serve.py runs workers
+# in prometheus_client's multiprocess mode (PROMETHEUS_MULTIPROC_DIR); they are ignored otherwise
+
+# Database connection pool
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_connections_in_use",
+    "Connections currently checked out of the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Pool checkouts that gave up waiting for a connection",
+    ["engine"],
+)
+
+# HTTP requests, labelled by route template rather than raw path to bound cardinality
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving a request to sending the last byte of its response",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "Requests currently being handled",
+    ["method"],
+    multiprocess_mode="livesum",
+)
+
+# Spans around hot-path calls (model API, image encoding, hashing, payments)
+OPERATION_SECONDS = Histogram(
+    "operation_duration_seconds",
+    "Duration of instrumented operations",
+    ["operation", "outcome"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+# Statements sent to the database
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Time spent executing SQL statements",
+    ["engine", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+# Image API calls made through utils.openai_client
+OPENAI_REQUESTS = Counter(
+    "openai_requests_total",
+    "Image API attempts by outcome (ok, retried, failed, rejected while the circuit is open)",
+    ["outcome"],
+)
+OPENAI_CIRCUIT_OPEN = Gauge(
+    "openai_circuit_open",
+    "1 while the image API circuit breaker is open (in any worker)",
+    multiprocess_mode="livemax",
+)
+
+# Requests denoised together by the local generation backend
+LOCAL_INFERENCE_BATCH_SIZE = Histogram(
+    "local_inference_batch_size",
+    "Images per forward pass of the local diffusion model",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16),
+)
+
+# Read-through snapshot caches (user profiles, pet image metadata)
+SNAPSHOT_CACHE_REQUESTS = Counter(
+    "snapshot_cache_requests_total",
+    "Snapshot lookups by cache and result (local_hit, redis_hit, miss)",
+    ["cache", "result"],
+)
+
+# Time from the start of a worker process to serving its first request
+WORKER_STARTUP_SECONDS = Gauge(
+    "worker_startup_seconds",
+    "Seconds this worker took to start, including imports it did not inherit and pool warm-up",
+    # One series per live worker, labelled with its pid
+    multiprocess_mode="liveall",
+)
+
+
+def render_metrics():
+    """
+    Return the Prometheus exposition payload and its content type.
+
+    In multiprocess mode the payload combines every worker's values, whichever worker
+    answers the scrape.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """
+    Drop the live gauges of a worker that exited; its counters and histograms are kept.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+from dotenv import load_dotenv
+
+from utils.metrics import OPENAI_CIRCUIT_OPEN, OPENAI_REQUESTS
+from utils.rate_limit import SharedTokenBucket, TokenBucket
+
+if TYPE_CHECKING:
+    import httpx
+    import openai
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Deadline of a single attempt, and of a call including its retries
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "10"))
+OPENAI_CALL_DEADLINE_SECONDS = float(os.getenv("OPENAI_CALL_DEADLINE_SECONDS", "300"))
+# Retries of timeouts, connection errors, 429s and 5xx within one call (full jitter backoff)
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+OPENAI_RETRY_BASE_SECONDS = float(os.getenv("OPENAI_RETRY_BASE_SECONDS", "1"))
+OPENAI_RETRY_MAX_SECONDS = float(os.getenv("OPENAI_RETRY_MAX_SECONDS", "30"))
+# Consecutive failed attempts that open the circuit, and how long it stays open; 0 disables it
+OPENAI_BREAKER_FAILURES = int(os.getenv("OPENAI_BREAKER_FAILURES", "5"))
+OPENAI_BREAKER_RESET_SECONDS = float(os.getenv("OPENAI_BREAKER_RESET_SECONDS", "30"))
+# Image edits started per minute across all processes; match the account's API tier, 0 disables it
+GENERATION_RATE_PER_MINUTE = float(os.getenv("GENERATION_RATE_PER_MINUTE", "20"))
+GENERATION_RATE_BURST = int(os.getenv("GENERATION_RATE_BURST", "5"))
+# Redis holding the shared bucket; unset splits the rate evenly among GENERATION_RATE_PROCESSES
+GENERATION_RATE_REDIS_URL = os.getenv("GENERATION_RATE_REDIS_URL")
+# Processes making image edit calls; serve.py and GENERATION_POOL=process keep it current
+GENERATION_RATE_PROCESSES = int(os.getenv("GENERATION_RATE_PROCESSES", "1"))
+
+
+class CircuitOpenError(Exception):
+    """
+    The image API is failing; calls are refused until retry_after seconds have passed.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Image API unavailable, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Fail fast after repeated upstream failures; after reset_seconds one probe call is let through.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float, timer=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._timer = timer
+        self._failures = 0
+        self._opened_at = None
+        # Start of the probe in flight; a probe that never reports back expires after reset_seconds
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError while the circuit is open or another call is probing it.
+        """
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = self._timer()
+            remaining = self._opened_at + self.reset_seconds - now
+            probing = self._probe_started is not None and now - self._probe_started < self.reset_seconds
+            if remaining > 0 or probing:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Image API circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started = None
+            OPENAI_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            probing = self._probe_started is not None
+            if self.failure_threshold > 0 and (probing or self._failures >= self.failure_threshold):
+                if self._opened_at is None:
+                    logger.warning("Image API circuit opened", extra={"failures": self._failures})
+                self._opened_at = self._timer()
+                self._probe_started = None
+                OPENAI_CIRCUIT_OPEN.set(1)
+
+
+def create_rate_limiter(processes: int = GENERATION_RATE_PROCESSES) -> TokenBucket:
+    """
+    Bucket limiting image edits to GENERATION_RATE_PER_MINUTE over all processes.
+
+    With GENERATION_RATE_REDIS_URL the bucket is shared through Redis, otherwise each
+    of processes gets an equal share of the rate and the burst.
+    """
+    processes = max(processes, 1)
+    local_share = TokenBucket(GENERATION_RATE_PER_MINUTE / processes, GENERATION_RATE_BURST // processes)
+    if GENERATION_RATE_REDIS_URL:
+        return SharedTokenBucket.from_url(GENERATION_RATE_REDIS_URL, "rate_limit:openai.images.edit",
+                                          GENERATION_RATE_PER_MINUTE, GENERATION_RATE_BURST, fallback=local_share)
+    return local_share
+
+
+def share_rate_limit(processes: int):
+    """
+    Split the rate among processes that each make image edit calls, e.g. before forking them.
+
+    The count is also exported as GENERATION_RATE_PROCESSES for processes started fresh.
+    """
+    global rate_limiter, rate_limit_processes
+    rate_limit_processes = max(processes, 1)
+    os.environ["GENERATION_RATE_PROCESSES"] = str(rate_limit_processes)
+    rate_limiter = create_rate_limiter(rate_limit_processes)
+
+
+rate_limit_processes = max(GENERATION_RATE_PROCESSES, 1)
+rate_limiter = create_rate_limiter(rate_limit_processes)
+circuit_breaker = CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET_SECONDS)
+
+
+def _timeout() -> "httpx.Timeout":
+    # httpx and the OpenAI SDK are imported on first use to keep them out of process startup
+    import httpx
+
+    return httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+
+def create_client() -> "openai.OpenAI":
+    """
+    OpenAI client for resilient_call(); retries are ours, OPENAI_BASE_URL selects the server.
+    """
+    import openai
+
+    return openai.OpenAI(max_retries=0, timeout=_timeout())
+
+
+def create_async_client() -> "openai.AsyncOpenAI":
+    import openai
+
+    return openai.AsyncOpenAI(max_retries=0, timeout=_timeout())
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    True for errors a later attempt can get past: timeouts, connection errors, 408/409/429 and 5xx.
+    """
+    import openai
+
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        # A used-up quota is not a rate limit; waiting will not help
+        if error.status_code == 429 and getattr(error, "code", None) == "insufficient_quota":
+            return False
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    True when the image API rejected the request itself (e.g. 400 or a content policy refusal).
+    """
+    import openai
+
+    return isinstance(error, openai.APIStatusError) and not is_retryable(error)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if "retry-after-ms" in response.headers:
+            return float(response.headers["retry-after-ms"]) / 1000
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+def retry_delay(error: Exception, attempt: int, deadline: float) -> Optional[float]:
+    """
+    Seconds to wait before retrying after a failed attempt, or None to give up.
+    """
+    if not is_retryable(error) or attempt >= OPENAI_MAX_RETRIES:
+        return None
+    delay = random.uniform(0, min(OPENAI_RETRY_MAX_SECONDS, OPENAI_RETRY_BASE_SECONDS * 2 ** attempt))
+    delay = max(delay, _retry_after(error) or 0)
+    if time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+def _record(error: Optional[Exception], retrying: bool):
+    if error is None:
+        circuit_breaker.record_success()
+        OPENAI_REQUESTS.labels("ok").inc()
+    elif is_retryable(error):
+        circuit_breaker.record_failure()
+        OPENAI_REQUESTS.labels("retried" if retrying else "failed").inc()
+    else:
+        # The upstream answered; a rejected request says nothing about its health
+        circuit_breaker.record_success()
+        OPENAI_REQUESTS.labels("failed").inc()
+
+
+def _before_attempt(deadline: float) -> "httpx.Timeout":
+    import httpx
+
+    try:
+        circuit_breaker.before_call()
+    except CircuitOpenError:
+        OPENAI_REQUESTS.labels("rejected").inc()
+        raise
+    remaining = max(deadline - time.monotonic(), 1.0)
+    return httpx.Timeout(min(OPENAI_TIMEOUT_SECONDS, remaining), connect=OPENAI_CONNECT_TIMEOUT_SECONDS)
+
+
+def resilient_call(func, **kwargs):
+    """
+    Call an OpenAI client method with the rate limit, circuit breaker, deadlines and retries applied.
+    """
+    deadline = time.monotonic() + OPENAI_CALL_DEADLINE_SECONDS
+    attempt = 0
+    while True:
+        timeout = _before_attempt(deadline)
+        rate_limiter.acquire()
+        try:
+            result = func(timeout=timeout, **kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt, deadline)
+            _record(e, retrying=delay is not None)
+            if delay is None:
+                raise
+            logger.warning("Image API call failed, retrying", extra={"error": repr(e), "delay_s": round(delay, 2)})
+            time.sleep(delay)
+            attempt += 1
+            continue
+        _record(None, retrying=False)
+        return result
+
+
+async def resilient_call_async(func, **kwargs):
+    """
+    resilient_call() for AsyncOpenAI methods.
+    """
+    deadline = time.monotonic() + OPENAI_CALL_DEADLINE_SECONDS
+    attempt = 0
+    while True:
+        timeout = _before_attempt(deadline)
+        await rate_limiter.acquire_async()
+        try:
+            result = await func(timeout=timeout, **kwargs)
+        except Exception as e:
+            delay = retry_delay(e, attempt, deadline)
+            _record(e, retrying=delay is not None)
+            if delay is None:
+                raise
+            logger.warning("Image API call failed, retrying", extra={"error": repr(e), "delay_s": round(delay, 2)})
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        _record(None, retrying=False)
+        return result
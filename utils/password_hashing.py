@@ -0,0 +1,77 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from dotenv import load_dotenv
+
+from utils.tracing import span
+
+load_dotenv()
+
+# bcrypt cost factor; existing hashes with a different cost are rehashed on login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Processes reserved for hashing, so a login burst cannot use up the request threadpool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def hash_password_sync(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def verify_password_sync(password: str, hashed_password: str) -> bool:
+    if not hashed_password:
+        return False
+    return bcrypt.checkpw(password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+def hash_cost(hashed_password: str) -> int:
+    """
+    Read the cost factor from a "$2b$<cost>$..." bcrypt hash.
+    """
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hash_cost(hashed_password) != BCRYPT_ROUNDS
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _executor
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password with the configured cost on the hashing process pool.
+    """
+    loop = asyncio.get_running_loop()
+    with span("bcrypt.hash"):
+        return await loop.run_in_executor(_get_executor(), hash_password_sync, password, BCRYPT_ROUNDS)
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """
+    Check a password against a bcrypt hash on the hashing process pool.
+    """
+    loop = asyncio.get_running_loop()
+    with span("bcrypt.verify"):
+        return await loop.run_in_executor(_get_executor(), verify_password_sync, password, hashed_password)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -1,5 +1,4 @@
+# Prompts of templates that have no "<name>_prompts.json" next to their image, as
+# "<name>_prompt_<species>": "<prompt>". New templates ship a prompts file instead.
 PROMPTS_DICT = {
-    
-    "magistrate_prompt_cat": "Swap the cat face into the magestrate image, ensure that the the hat covers the ears of the cat, ensure that the paws are covered by the cloth.",
-    "magistrate_prompt_dog": "Swap the dog face into the magestrate image, incase the ears of the dog are long, ensure the hat only covers the top of the head, ensure that the paws are covered by the cloth.",
-}
\ No newline at end of file
+}
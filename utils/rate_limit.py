@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket; acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """
+        Take a token if one is available; otherwise return the seconds to wait for one.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Like acquire(), but waits without blocking the event loop.
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+# Refill and take one token atomically; returns the seconds to wait as a string (Lua
+# numbers would be truncated to integers). Time comes from the Redis server, so
+# processes with skewed clocks share one timeline.
+_TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket kept in Redis, so every process drawing on it shares one rate.
+
+    When Redis cannot be reached, tokens come from the local fallback bucket instead
+    (typically this process's share of the rate) until it answers again.
+    """
+
+    def __init__(self, client, key: str, rate_per_minute: float, burst: int = 1, fallback: TokenBucket = None):
+        super().__init__(rate_per_minute, burst)
+        self.client = client
+        self.key = key
+        self.fallback = fallback or TokenBucket(rate_per_minute, burst)
+        self._script = client.register_script(_TAKE_TOKEN_SCRIPT)
+
+    @classmethod
+    def from_url(cls, url: str, key: str, rate_per_minute: float, burst: int = 1, fallback: TokenBucket = None,
+                 timeout: float = 0.25):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("redis is required for a shared rate limit")
+        client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        return cls(client, key, rate_per_minute, burst, fallback)
+
+    def try_acquire(self) -> float:
+        try:
+            return float(self._script(keys=[self.key], args=[self.rate, self.capacity]))
+        except Exception:
+            logger.warning("Shared rate limit unavailable, using the local share", exc_info=True)
+            return self.fallback.try_acquire()
+
+    async def acquire_async(self):
+        if self.rate <= 0:
+            return
+        while True:
+            # The Redis round trip is blocking, so it runs in a thread
+            wait = await asyncio.to_thread(self.try_acquire)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class KeyedConcurrencyLimiter:
+    """
+    Cap the number of in-flight operations per key (e.g. per client IP).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._active = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, key: str):
+        """
+        Yield True while holding a slot for key, or False when the key is at its limit.
+        """
+        with self._lock:
+            acquired = self.limit <= 0 or self._active[key] < self.limit
+            if acquired:
+                self._active[key] += 1
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                with self._lock:
+                    self._active[key] -= 1
+                    if self._active[key] <= 0:
+                        del self._active[key]
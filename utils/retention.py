@@ -0,0 +1,159 @@
+import logging
+import os
+import time
+from datetime import timedelta
+from dotenv import load_dotenv
+from sqlalchemy import and_, or_
+
+from database import SessionLocal, utcnow
+from models.GenerationJob import GenerationJob
+from models.PetImage import PetImage
+from utils.derivatives import DERIVATIVES_DIR
+from utils.image_processing import UPLOAD_DIR
+from utils.storage import storage
+from utils.stripe_client import CLOSED_INTENT_STATUSES, cancel_payment_intent
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Unpaid uploads and generated results older than this are removed
+UPLOAD_RETENTION_DAYS = float(os.getenv("UPLOAD_RETENTION_DAYS", "30"))
+GENERATED_RETENTION_DAYS = float(os.getenv("GENERATED_RETENTION_DAYS", "30"))
+# Size cap for generated results of unpaid images, 0 disables it
+GENERATED_MAX_BYTES = int(os.getenv("GENERATED_MAX_BYTES", "0"))
+# Files not referenced by any row are only removed after this grace period
+ORPHAN_GRACE_SECONDS = 60 * 60
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+def touch_cache_entry(path: str):
+    """
+    Mark a cached result as recently used so size-based eviction keeps it.
+
+    Only the local backend records this; S3 objects age from when they were written.
+    """
+    storage.touch(path)
+
+
+# An unpaid image whose PaymentIntent can still be paid
+HAS_OPEN_INTENT = and_(
+    PetImage.stripe_payment_id.isnot(None),
+    or_(PetImage.payment_status.is_(None), PetImage.payment_status.notin_(CLOSED_INTENT_STATUSES))
+)
+
+
+def _cancel_open_intents(db, cutoff) -> set:
+    """
+    Cancel the open PaymentIntents of expired uploads and return the ids of the images now safe to delete.
+    """
+    rows = db.query(PetImage.id, PetImage.stripe_payment_id).filter(
+        PetImage.is_payed == False,
+        PetImage.updated_at < cutoff,
+        HAS_OPEN_INTENT
+    ).all()
+    # No transaction stays open across the Stripe calls
+    db.commit()
+
+    canceled = set()
+    for image_id, intent_id in rows:
+        try:
+            if cancel_payment_intent(intent_id):
+                canceled.add(image_id)
+        except Exception:
+            logger.exception("Could not cancel the payment intent of an expired upload",
+                             extra={"pet_image_id": image_id})
+    return canceled
+
+
+def _prune_uploads(db, now: float):
+    cutoff = utcnow() - timedelta(days=UPLOAD_RETENTION_DAYS)
+    # An image is only deleted once its intent can no longer be paid, else a payment could land on a deleted image
+    canceled = _cancel_open_intents(db, cutoff)
+    expired = db.query(PetImage).filter(
+        # Equality (not IS) so MySQL can use ix_pet_images_is_payed_updated_at
+        PetImage.is_payed == False,
+        PetImage.updated_at < cutoff,
+        or_(~HAS_OPEN_INTENT, PetImage.id.in_(canceled))
+    ).all()
+
+    folders = []
+    for pet_image in expired:
+        db.query(GenerationJob).filter(GenerationJob.pet_image_id == pet_image.id).delete(synchronize_session=False)
+        if pet_image.generated_images_folder_path:
+            folders.append(pet_image.generated_images_folder_path)
+        db.delete(pet_image)
+    db.commit()
+
+    for folder in folders:
+        storage.delete_prefix(folder)
+
+    referenced = {image_url for (image_url,) in db.query(PetImage.image_url).distinct()}
+
+    # Remove objects no remaining row points at, including expired uploads
+    for info in storage.list(UPLOAD_DIR):
+        if info.key not in referenced and now - info.mtime > ORPHAN_GRACE_SECONDS:
+            storage.delete(info.key)
+
+
+def _evict_result(db, result_path: str):
+    db.query(GenerationJob).filter(GenerationJob.result_path == result_path).update(
+        {GenerationJob.result_path: None, GenerationJob.cache_key: None, GenerationJob.result_hash: None},
+        synchronize_session=False
+    )
+    storage.delete(result_path)
+
+
+def _prune_generated(db, now: float):
+    rows = db.query(GenerationJob.result_path, or_(PetImage.is_payed == True, HAS_OPEN_INTENT)).join(
+        PetImage, PetImage.id == GenerationJob.pet_image_id
+    ).filter(GenerationJob.result_path.isnot(None)).all()
+
+    # A result is only evictable when no paid image, or image being paid for, uses it
+    kept_paths = {path for path, kept in rows if kept}
+    candidates = []
+    for path in {path for path, _ in rows} - kept_paths:
+        info = storage.stat(path)
+        if info is None or now - info.mtime > GENERATED_RETENTION_DAYS * DAY_SECONDS:
+            _evict_result(db, path)
+        else:
+            candidates.append((info.mtime, info.size, path))
+
+    # Least recently used results go first once over the size cap
+    if GENERATED_MAX_BYTES > 0:
+        total = sum(size for _, size, _ in candidates)
+        for _, size, path in sorted(candidates):
+            if total <= GENERATED_MAX_BYTES:
+                break
+            _evict_result(db, path)
+            total -= size
+
+    db.commit()
+
+
+def _prune_derivatives(db, now: float):
+    referenced = {
+        result_hash for (result_hash,) in
+        db.query(GenerationJob.result_hash).filter(GenerationJob.result_hash.isnot(None)).distinct()
+    }
+    # Keys look like derivatives/ab/cd/<result hash>/<name>
+    for info in storage.list(DERIVATIVES_DIR):
+        result_hash = info.key.split("/")[-2]
+        if result_hash not in referenced and now - info.mtime > ORPHAN_GRACE_SECONDS:
+            storage.delete(info.key)
+
+
+def prune_storage():
+    """
+    Apply the retention and eviction policy to stored uploads and generated images.
+    """
+    now = time.time()
+    db = SessionLocal()
+    try:
+        _prune_uploads(db, now)
+        _prune_generated(db, now)
+        _prune_derivatives(db, now)
+    finally:
+        db.close()
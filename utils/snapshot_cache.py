@@ -0,0 +1,232 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.PetImage import PetImage as PetImageModel
+from models.User import User as UserModel
+from utils.cache import TTLCache
+from utils.metrics import SNAPSHOT_CACHE_REQUESTS
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Shared tier; unset keeps snapshots in process memory only
+SNAPSHOT_REDIS_URL = os.getenv("SNAPSHOT_REDIS_URL")
+# Lifetime in Redis; invalidation on writes keeps entries current within it
+SNAPSHOT_CACHE_TTL_SECONDS = float(os.getenv("SNAPSHOT_CACHE_TTL_SECONDS", "300"))
+# Lifetime in process memory; also bounds how long another worker may serve a snapshot
+# after a write, since invalidation only reaches the local tier of the writing process
+SNAPSHOT_LOCAL_TTL_SECONDS = float(os.getenv("SNAPSHOT_LOCAL_TTL_SECONDS", "30"))
+SNAPSHOT_LOCAL_MAX_ENTRIES = int(os.getenv("SNAPSHOT_LOCAL_MAX_ENTRIES", "10000"))
+SNAPSHOT_REDIS_TIMEOUT_SECONDS = float(os.getenv("SNAPSHOT_REDIS_TIMEOUT_SECONDS", "0.25"))
+
+
+class RedisTier:
+    """
+    Shared snapshot tier in Redis; errors are logged and treated as misses.
+
+    Reads and writes use an asyncio client, invalidation from synchronous code
+    (ORM events in worker threads or processes) a blocking one.
+    """
+
+    def __init__(self, client, sync_client, ttl: float):
+        self.client = client
+        self.sync_client = sync_client
+        self.ttl = ttl
+        # Deletes scheduled from the event loop; kept so they are not garbage collected mid-flight
+        self._pending = set()
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float = SNAPSHOT_CACHE_TTL_SECONDS):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("redis is required for SNAPSHOT_REDIS_URL")
+        options = {"socket_timeout": SNAPSHOT_REDIS_TIMEOUT_SECONDS, "socket_connect_timeout": SNAPSHOT_REDIS_TIMEOUT_SECONDS}
+        return cls(redis.asyncio.Redis.from_url(url, **options), redis.Redis.from_url(url, **options), ttl)
+
+    async def get(self, key: str) -> Optional[dict]:
+        try:
+            raw = await self.client.get(key)
+        except Exception:
+            logger.warning("Snapshot cache read failed", exc_info=True)
+            return None
+        return None if raw is None else json.loads(raw)
+
+    async def set(self, key: str, value: dict):
+        try:
+            await self.client.set(key, json.dumps(value), ex=max(1, int(self.ttl)))
+        except Exception:
+            logger.warning("Snapshot cache write failed", exc_info=True)
+
+    def delete(self, keys):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None:
+            try:
+                self.sync_client.delete(*keys)
+            except Exception:
+                logger.warning("Snapshot cache invalidation failed", exc_info=True)
+            return
+        task = loop.create_task(self._delete_async(keys))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _delete_async(self, keys):
+        try:
+            await self.client.delete(*keys)
+        except Exception:
+            logger.warning("Snapshot cache invalidation failed", exc_info=True)
+
+
+class SnapshotCache:
+    """
+    Read-through cache of JSON-serializable snapshots keyed by id: process memory, then Redis.
+    """
+
+    def __init__(self, namespace: str, redis_tier: Optional[RedisTier] = None,
+                 local_ttl: float = SNAPSHOT_LOCAL_TTL_SECONDS, local_max_entries: int = SNAPSHOT_LOCAL_MAX_ENTRIES):
+        self.namespace = namespace
+        self.redis_tier = redis_tier
+        self.local = TTLCache(local_max_entries, local_ttl)
+
+    def _key(self, id: int) -> str:
+        return f"snapshot:{self.namespace}:{id}"
+
+    async def get(self, id: int) -> Optional[dict]:
+        snapshot = self.local.get(id)
+        if snapshot is not None:
+            SNAPSHOT_CACHE_REQUESTS.labels(self.namespace, "local_hit").inc()
+            return snapshot
+        if self.redis_tier is not None:
+            snapshot = await self.redis_tier.get(self._key(id))
+            if snapshot is not None:
+                SNAPSHOT_CACHE_REQUESTS.labels(self.namespace, "redis_hit").inc()
+                self.local.set(id, snapshot)
+                return snapshot
+        SNAPSHOT_CACHE_REQUESTS.labels(self.namespace, "miss").inc()
+        return None
+
+    async def set(self, id: int, snapshot: dict):
+        self.local.set(id, snapshot)
+        if self.redis_tier is not None:
+            await self.redis_tier.set(self._key(id), snapshot)
+
+    async def get_or_load(self, id: int, loader: Callable[[int], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        """
+        Return the snapshot for id, calling loader on a miss; None results are not cached.
+        """
+        snapshot = await self.get(id)
+        if snapshot is None:
+            snapshot = await loader(id)
+            if snapshot is not None:
+                await self.set(id, snapshot)
+        return snapshot
+
+    def invalidate(self, *ids: int):
+        for id in ids:
+            self.local.pop(id)
+        if ids and self.redis_tier is not None:
+            self.redis_tier.delete([self._key(id) for id in ids])
+
+    def clear(self):
+        """
+        Drop the local tier; Redis entries expire on their own.
+        """
+        self.local.clear()
+
+
+redis_tier = RedisTier.from_url(SNAPSHOT_REDIS_URL) if SNAPSHOT_REDIS_URL else None
+
+# Caches whose rows are invalidated when the ORM changes them, by mapped class
+_tracked = {}
+
+
+def track_model(cache: SnapshotCache, model):
+    """
+    Invalidate cache entries for rows of model changed or deleted through the ORM, once committed.
+    """
+    _tracked[model] = cache
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed(session, flush_context):
+    changed = session.info.setdefault("snapshot_invalidations", set())
+    for obj in (*session.dirty, *session.deleted):
+        if type(obj) in _tracked and obj.id is not None:
+            changed.add((type(obj), obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    # Invalidating after the commit keeps a concurrent reader from caching the old row again
+    for model, id in session.info.pop("snapshot_invalidations", ()):
+        _tracked[model].invalidate(id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_rolled_back(session):
+    session.info.pop("snapshot_invalidations", None)
+
+
+def user_profile_snapshot(user) -> dict:
+    """
+    The public profile of a user row, as returned by UserResponseSchema.
+    """
+    return {
+        "id": user.id,
+        "email": user.email,
+        "name": user.name,
+        "is_suspended": bool(user.is_suspended),
+        "image": user.user_image,
+        "credits": user.credits,
+        "country_id": user.country_id,
+        "is_verified": bool(user.is_verified),
+    }
+
+
+def pet_image_snapshot(pet_image) -> dict:
+    return {
+        "id": pet_image.id,
+        "user_id": pet_image.user_id,
+        "image_url": pet_image.image_url,
+        "generated_images_folder_path": pet_image.generated_images_folder_path,
+        "is_payed": bool(pet_image.is_payed),
+        "payment_status": pet_image.payment_status,
+        "created_at": pet_image.created_at.isoformat() if pet_image.created_at else None,
+    }
+
+
+user_profiles = SnapshotCache("user_profile", redis_tier)
+pet_images = SnapshotCache("pet_image", redis_tier)
+track_model(user_profiles, UserModel)
+track_model(pet_images, PetImageModel)
+
+
+async def get_user_profile(db: AsyncSession, user_id: int) -> Optional[dict]:
+    async def load(id):
+        result = await db.execute(select(UserModel).where(UserModel.id == id))
+        user = result.scalars().first()
+        return user_profile_snapshot(user) if user else None
+
+    return await user_profiles.get_or_load(user_id, load)
+
+
+async def get_pet_image(db: AsyncSession, image_id: int) -> Optional[dict]:
+    async def load(id):
+        result = await db.execute(select(PetImageModel).where(PetImageModel.id == id))
+        pet_image = result.scalars().first()
+        return pet_image_snapshot(pet_image) if pet_image else None
+
+    return await pet_images.get_or_load(image_id, load)
@@ -0,0 +1,473 @@
+import hashlib
+import os
+import posixpath
+import shutil
+import threading
+import uuid
+from collections import namedtuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "local" or "s3"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# Keys are paths relative to this directory for the local backend
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", ".")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET")
+# Prepended to every key, so several deployments can share one bucket
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "")
+# Set for S3-compatible services (MinIO, Ceph, R2, ...); switches to path-style addressing
+STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL")
+STORAGE_S3_REGION = os.getenv("STORAGE_S3_REGION")
+STORAGE_S3_MAX_CONNECTIONS = int(os.getenv("STORAGE_S3_MAX_CONNECTIONS", "20"))
+# Local read-through cache in front of the S3 backend, 0 disables it
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", "storage_cache")
+STORAGE_CACHE_MAX_BYTES = int(os.getenv("STORAGE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+STORAGE_CHUNK_SIZE = 1024 * 1024
+# Cached copies are named "<key>@<version digest>"
+CACHE_VERSION_SEPARATOR = "@"
+
+# etag identifies the object's content where the backend reports one (S3), else None
+ObjectInfo = namedtuple("ObjectInfo", ["key", "size", "mtime", "etag"], defaults=(None,))
+
+
+def shard_key(prefix: str, name: str) -> str:
+    """
+    Key for name under prefix, spread over two directory levels taken from the name.
+    """
+    return f"{prefix}/{name[:2]}/{name[2:4]}/{name}"
+
+
+def join_key(*parts: str) -> str:
+    return posixpath.join(*parts)
+
+
+class Storage:
+    """
+    Interface of the object stores for uploaded and generated images.
+
+    Keys are "/"-separated. Missing objects raise FileNotFoundError from open().
+    """
+
+    def open(self, key: str):
+        """Open an object for streaming reads; returns a binary file object."""
+        raise NotImplementedError
+
+    def write(self, key: str, source):
+        """Stream a readable binary file object into key, replacing any existing object."""
+        raise NotImplementedError
+
+    def write_bytes(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def put_file(self, key: str, path: str):
+        """Move a local file into the store; the local file is gone afterwards."""
+        raise NotImplementedError
+
+    def stat(self, key: str):
+        """Return the ObjectInfo for key, or None if it does not exist."""
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        return self.stat(key) is not None
+
+    def list(self, prefix: str):
+        """Return ObjectInfo for every object below prefix (recursively), sorted by key."""
+        raise NotImplementedError
+
+    def copy(self, source_key: str, dest_key: str):
+        """Copy an object; raises FileNotFoundError if source_key does not exist."""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        """Delete an object; deleting a missing object is not an error."""
+        raise NotImplementedError
+
+    def delete_prefix(self, prefix: str):
+        for info in self.list(prefix):
+            self.delete(info.key)
+
+    def touch(self, key: str):
+        """Mark an object as recently used, where the backend can record it."""
+
+
+class LocalStorage(Storage):
+    """
+    Objects as files below a root directory; key "a/b/c.png" is the file root/a/b/c.png.
+    """
+
+    def __init__(self, root: str = STORAGE_LOCAL_ROOT):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def _key(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def open(self, key: str):
+        return open(self._path(key), "rb")
+
+    def _replace_from(self, key: str, fill):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as out:
+                fill(out)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def write(self, key: str, source):
+        self._replace_from(key, lambda out: shutil.copyfileobj(source, out, STORAGE_CHUNK_SIZE))
+
+    def write_bytes(self, key: str, data: bytes):
+        self._replace_from(key, lambda out: out.write(data))
+
+    def put_file(self, key: str, path: str):
+        dest = self._path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.move(path, dest)
+
+    def stat(self, key: str):
+        try:
+            st = os.stat(self._path(key))
+        except OSError:
+            return None
+        return ObjectInfo(key, st.st_size, st.st_mtime)
+
+    def list(self, prefix: str):
+        infos = []
+        for dirpath, _, filenames in os.walk(self._path(prefix)):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                infos.append(ObjectInfo(self._key(path), st.st_size, st.st_mtime))
+        return sorted(infos)
+
+    def copy(self, source_key: str, dest_key: str):
+        with self.open(source_key) as source:
+            self.write(dest_key, source)
+
+    def _remove_empty_parents(self, key: str):
+        # Drop shard and result folders once their last file is gone, keeping the top-level directory
+        folder = os.path.dirname(self._path(key))
+        for _ in range(len(key.split("/")) - 2):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            return
+        self._remove_empty_parents(key)
+
+    def delete_prefix(self, prefix: str):
+        shutil.rmtree(self._path(prefix), ignore_errors=True)
+        self._remove_empty_parents(prefix)
+
+    def touch(self, key: str):
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+
+class S3Storage(Storage):
+    """
+    Objects in an S3 bucket, or any S3-compatible service through endpoint_url.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, region_name: str = None,
+                 max_connections: int = STORAGE_S3_MAX_CONNECTIONS):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise RuntimeError("boto3 is required for the S3 storage backend")
+        if not bucket:
+            raise RuntimeError("STORAGE_S3_BUCKET is not set")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._boto3 = boto3
+        self._client_kwargs = {
+            "endpoint_url": endpoint_url,
+            "region_name": region_name,
+            "config": Config(
+                max_pool_connections=max_connections,
+                retries={"max_attempts": 5, "mode": "standard"},
+                s3={"addressing_style": "path"} if endpoint_url else {},
+            ),
+        }
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # One client per process: connection pools must not cross a fork into the worker pool
+        pid = os.getpid()
+        client = self._clients.get(pid)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(pid)
+                if client is None:
+                    client = self._boto3.session.Session().client("s3", **self._client_kwargs)
+                    self._clients = {pid: client}
+        return client
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _key(self, object_key: str) -> str:
+        return object_key[len(self.prefix) + 1:] if self.prefix else object_key
+
+    def _is_missing(self, error) -> bool:
+        return error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def open(self, key: str):
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        return response["Body"]
+
+    def write(self, key: str, source):
+        # Managed transfer: large objects go up as a multipart upload without being buffered whole
+        self.client.upload_fileobj(source, self.bucket, self._object_key(key))
+
+    def write_bytes(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data)
+
+    def put_file(self, key: str, path: str):
+        self.client.upload_file(path, self.bucket, self._object_key(key))
+        os.remove(path)
+
+    def stat(self, key: str):
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return ObjectInfo(key, response["ContentLength"], response["LastModified"].timestamp(), response.get("ETag"))
+
+    def list(self, prefix: str):
+        paginator = self.client.get_paginator("list_objects_v2")
+        infos = []
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._object_key(prefix.rstrip("/")) + "/"):
+            for item in page.get("Contents", []):
+                infos.append(ObjectInfo(self._key(item["Key"]), item["Size"], item["LastModified"].timestamp(),
+                                        item.get("ETag")))
+        return sorted(infos)
+
+    def copy(self, source_key: str, dest_key: str):
+        from botocore.exceptions import ClientError
+        # Server-side copy, the bytes do not pass through this process
+        try:
+            self.client.copy_object(
+                Bucket=self.bucket,
+                Key=self._object_key(dest_key),
+                CopySource={"Bucket": self.bucket, "Key": self._object_key(source_key)},
+            )
+        except ClientError as e:
+            if self._is_missing(e):
+                raise FileNotFoundError(source_key)
+            raise
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def delete_prefix(self, prefix: str):
+        keys = [{"Key": self._object_key(info.key)} for info in self.list(prefix)]
+        for start in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys[start:start + 1000], "Quiet": True})
+
+
+class CachedStorage(Storage):
+    """
+    Local, size-bounded LRU read-through cache in front of a remote store.
+
+    Reads are served from the cache directory, fetching misses from the remote
+    store; writes go to the remote store and into the cache. Metadata (stat,
+    list) always comes from the remote store. Objects can be overwritten (a
+    result generated again, possibly by another replica), so every read checks
+    the remote version first: cached copies are stored under the key plus that
+    version (ETag, or size and mtime) and a changed object is fetched again.
+    """
+
+    def __init__(self, remote: Storage, directory: str = STORAGE_CACHE_DIR, max_bytes: int = STORAGE_CACHE_MAX_BYTES):
+        self.remote = remote
+        self.cache = LocalStorage(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def _cache_key(info: ObjectInfo) -> str:
+        version = info.etag or f"{info.size}-{info.mtime}"
+        return f"{info.key}{CACHE_VERSION_SEPARATOR}{hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]}"
+
+    def _cached_versions(self, key: str):
+        folder, name = posixpath.split(key)
+        prefix = f"{name}{CACHE_VERSION_SEPARATOR}"
+        try:
+            filenames = os.listdir(self.cache._path(folder))
+        except OSError:
+            return []
+        return [join_key(folder, filename) for filename in filenames
+                if filename.startswith(prefix) and not filename.endswith(".tmp")]
+
+    def _forget(self, key: str, keep: str = None):
+        """
+        Drop cached versions of key other than keep.
+        """
+        freed = 0
+        for cache_key in self._cached_versions(key):
+            if cache_key == keep:
+                continue
+            info = self.cache.stat(cache_key)
+            self.cache.delete(cache_key)
+            freed += info.size if info else 0
+        if freed:
+            with self._lock:
+                if self._size is not None:
+                    self._size -= freed
+
+    def _added(self, cache_key: str):
+        info = self.cache.stat(cache_key)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(info.size for info in self.cache.list(""))
+            elif info:
+                self._size += info.size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict(keep=cache_key)
+
+    def _store(self, key: str, fill):
+        """
+        Cache the current remote version of key with fill(cache_key), dropping older versions.
+        """
+        info = self.remote.stat(key)
+        if info is None:
+            return
+        cache_key = self._cache_key(info)
+        fill(cache_key)
+        self._forget(key, keep=cache_key)
+        self._added(cache_key)
+
+    def evict(self, keep: str = None):
+        """
+        Remove least recently used cached objects until the cache fits in max_bytes.
+        """
+        with self._lock:
+            files = sorted((info.mtime, info.size, info.key) for info in self.cache.list(""))
+            total = sum(size for _, size, _ in files)
+            for _, size, key in files:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                self.cache.delete(key)
+                total -= size
+            self._size = total
+
+    def open(self, key: str):
+        info = self.remote.stat(key)
+        if info is None:
+            self._forget(key)
+            raise FileNotFoundError(key)
+        cache_key = self._cache_key(info)
+        try:
+            source = self.cache.open(cache_key)
+        except FileNotFoundError:
+            pass
+        else:
+            self.cache.touch(cache_key)
+            return source
+        with self.remote.open(key) as remote_source:
+            self.cache.write(cache_key, remote_source)
+        self._forget(key, keep=cache_key)
+        self._added(cache_key)
+        return self.cache.open(cache_key)
+
+    def write(self, key: str, source):
+        # Spool into the cache first, then upload from there
+        # Named like a partial file, so eviction and size accounting skip it
+        spool_key = f"{key}{CACHE_VERSION_SEPARATOR}{uuid.uuid4().hex}.tmp"
+        self.cache.write(spool_key, source)
+        try:
+            with self.cache.open(spool_key) as cached:
+                self.remote.write(key, cached)
+            self._store(key, lambda cache_key: os.replace(self.cache._path(spool_key), self.cache._path(cache_key)))
+        finally:
+            self.cache.delete(spool_key)
+
+    def write_bytes(self, key: str, data: bytes):
+        self.remote.write_bytes(key, data)
+        self._store(key, lambda cache_key: self.cache.write_bytes(cache_key, data))
+
+    def put_file(self, key: str, path: str):
+        with open(path, "rb") as source:
+            self.remote.write(key, source)
+        self._store(key, lambda cache_key: self.cache.put_file(cache_key, path))
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stat(self, key: str):
+        return self.remote.stat(key)
+
+    def list(self, prefix: str):
+        return self.remote.list(prefix)
+
+    def copy(self, source_key: str, dest_key: str):
+        self.remote.copy(source_key, dest_key)
+
+    def delete(self, key: str):
+        self.remote.delete(key)
+        self._forget(key)
+
+    def delete_prefix(self, prefix: str):
+        self.remote.delete_prefix(prefix)
+        self.cache.delete_prefix(prefix)
+        with self._lock:
+            self._size = None
+
+    def touch(self, key: str):
+        info = self.remote.stat(key)
+        if info is not None:
+            self.cache.touch(self._cache_key(info))
+        self.remote.touch(key)
+
+
+def create_storage() -> Storage:
+    """
+    Build the configured store: local files, or S3 behind the local read-through cache.
+    """
+    if STORAGE_BACKEND == "s3":
+        remote = S3Storage(STORAGE_S3_BUCKET, STORAGE_S3_PREFIX, STORAGE_S3_ENDPOINT_URL, STORAGE_S3_REGION)
+        if STORAGE_CACHE_MAX_BYTES > 0:
+            return CachedStorage(remote, STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES)
+        return remote
+    if STORAGE_BACKEND != "local":
+        raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+    return LocalStorage(STORAGE_LOCAL_ROOT)
+
+
+storage = create_storage()
@@ -0,0 +1,127 @@
+import functools
+import os
+from collections import namedtuple
+from typing import TYPE_CHECKING, Optional
+
+from dotenv import load_dotenv
+
+from utils.cache import TTLCache
+from utils.tracing import span
+
+if TYPE_CHECKING:
+    import stripe
+
+load_dotenv()
+
+STRIPE_PRIVATE_KEY = os.getenv("STRIPE_PRIVATE_KEY")
+# Points the client at a local Stripe stub in load tests
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "30"))
+# Network errors, 409s and 5xx are retried by the SDK with the same idempotency key
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+# Client secrets of open intents are answered from memory for this long, so repeated
+# create-payment-intent calls skip the Stripe round trip
+STRIPE_INTENT_CACHE_TTL_SECONDS = float(os.getenv("STRIPE_INTENT_CACHE_TTL_SECONDS", "300"))
+STRIPE_INTENT_CACHE_MAX_ENTRIES = int(os.getenv("STRIPE_INTENT_CACHE_MAX_ENTRIES", "10000"))
+
+# Price of one image download
+IMAGE_PRICE_CENTS = 1900
+IMAGE_PRICE_CURRENCY = "usd"
+
+# An intent in one of these states can no longer be paid; any other is handed out again
+CLOSED_INTENT_STATUSES = {"canceled"}
+
+PaymentIntentSecret = namedtuple("PaymentIntentSecret", ["id", "client_secret", "status"])
+
+# Keyed by intent id; entries only ever describe open intents
+intent_cache = TTLCache(STRIPE_INTENT_CACHE_MAX_ENTRIES, STRIPE_INTENT_CACHE_TTL_SECONDS)
+
+
+@functools.lru_cache(maxsize=None)
+def get_stripe_client() -> "stripe.StripeClient":
+    """
+    Stripe client shared by the process; one pooled httpx connection serves sync and async calls.
+    """
+    # The SDK is imported on first use to keep it out of process startup
+    import stripe
+
+    base_addresses = {"api": STRIPE_API_BASE} if STRIPE_API_BASE else None
+    return stripe.StripeClient(
+        STRIPE_PRIVATE_KEY,
+        base_addresses=base_addresses,
+        max_network_retries=STRIPE_MAX_RETRIES,
+        http_client=stripe.HTTPXClient(timeout=STRIPE_TIMEOUT_SECONDS, allow_sync_methods=True),
+    )
+
+
+def idempotency_key(image_id: int, replaces: Optional[str] = None) -> str:
+    """
+    Idempotency key for the intent of an image; replacing a closed intent gives a new key.
+    """
+    key = f"pet-image-{image_id}-payment-intent"
+    return f"{key}-after-{replaces}" if replaces else key
+
+
+def _remember(intent) -> PaymentIntentSecret:
+    secret = PaymentIntentSecret(intent.id, intent.client_secret, intent.status)
+    if secret.status not in CLOSED_INTENT_STATUSES:
+        intent_cache.set(secret.id, secret)
+    return secret
+
+
+async def get_or_create_payment_intent(image_id: int, current_intent_id: Optional[str] = None) -> PaymentIntentSecret:
+    """
+    Return the open PaymentIntent of an image, creating one only when it has none.
+
+    current_intent_id is the intent already recorded for the image. It is reused from
+    the cache or Stripe unless it was canceled; concurrent or retried creations for the
+    same image resolve to one intent through the idempotency key.
+    """
+    client = get_stripe_client()
+    if current_intent_id:
+        cached = intent_cache.get(current_intent_id)
+        if cached is not None:
+            return cached
+        with span("stripe.payment_intent.retrieve"):
+            intent = await client.v1.payment_intents.retrieve_async(current_intent_id)
+        if intent.status not in CLOSED_INTENT_STATUSES:
+            return _remember(intent)
+
+    with span("stripe.payment_intent.create"):
+        intent = await client.v1.payment_intents.create_async(
+            {
+                "amount": IMAGE_PRICE_CENTS,
+                "currency": IMAGE_PRICE_CURRENCY,
+                "payment_method_types": ["card"],
+                "metadata": {"pet_image_id": str(image_id)},
+            },
+            {"idempotency_key": idempotency_key(image_id, replaces=current_intent_id)},
+        )
+    return _remember(intent)
+
+
+def cancel_payment_intent(intent_id: str) -> bool:
+    """
+    Cancel an open intent so it can no longer be paid, and return whether it is closed.
+
+    Stripe refuses to cancel intents that succeeded or are processing; those return False.
+    """
+    import stripe
+
+    client = get_stripe_client()
+    try:
+        with span("stripe.payment_intent.cancel"):
+            intent = client.v1.payment_intents.cancel(intent_id)
+    except stripe.InvalidRequestError:
+        # Already closed, or in a state that cannot be canceled
+        with span("stripe.payment_intent.retrieve"):
+            intent = client.v1.payment_intents.retrieve(intent_id)
+    forget_payment_intent(intent_id)
+    return intent.status in CLOSED_INTENT_STATUSES
+
+
+def forget_payment_intent(intent_id: str):
+    """
+    Drop a cached intent once it has been paid or closed.
+    """
+    intent_cache.pop(intent_id)
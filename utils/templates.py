@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from dotenv import load_dotenv
+
+from utils.image_processing import prepare_model_input
+from utils.prompts import PROMPTS_DICT
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = "image_templates"
+TEMPLATE_SUFFIX = "_template.png"
+# Optional "<name>_mask.png" next to a template: white where the pet goes, for local inpainting
+MASK_SUFFIX = "_mask.png"
+# "<name>_prompts.json" next to a template: {"<species>": "<prompt>", ...}
+PROMPTS_SUFFIX = "_prompts.json"
+SPECIES = ("cat", "dog")
+
+DEFAULT_TEMPLATE = "magistrate"
+DEFAULT_SPECIES = "cat"
+
+# Generation backend of every template ("openai" or "local"), and per-template overrides
+# as "name=backend,name=backend"
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "openai")
+TEMPLATE_BACKENDS = os.getenv("TEMPLATE_BACKENDS", "")
+
+
+def parse_template_backends(value: str) -> dict:
+    backends = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, sep, backend = entry.partition("=")
+        if not sep or not name.strip() or not backend.strip():
+            raise ValueError(f"Invalid TEMPLATE_BACKENDS entry {entry!r}, expected name=backend")
+        backends[name.strip()] = backend.strip()
+    return backends
+
+
+class Template:
+    """
+    A style template held in memory, normalized and PNG-encoded for the API.
+    """
+
+    def __init__(self, name: str, path: str, image_bytes: bytes, prompts: dict,
+                 backend: str = GENERATION_BACKEND, mask_bytes: bytes = None):
+        self.name = name
+        self.path = path
+        self.image_bytes = image_bytes
+        # A mask changes what is generated, so it is part of the content
+        self.content_hash = hashlib.sha256(image_bytes + (mask_bytes or b"")).hexdigest()
+        # species -> prompt text, and species -> the key generation jobs store for it
+        self.prompts = prompts
+        self.prompt_keys = {species: f"{name}_prompt_{species}" for species in prompts}
+        self._prompts_by_key = {self.prompt_keys[species]: prompt for species, prompt in prompts.items()}
+        # Name of the generation backend in utils.image_generation
+        self.backend = backend
+        self.mask_bytes = mask_bytes
+
+    def prompt(self, prompt_key: str) -> str:
+        """
+        Return the text of one of prompt_keys, raising KeyError when it is not this template's.
+        """
+        return self._prompts_by_key[prompt_key]
+
+
+class TemplateRegistry:
+    """
+    Templates found in TEMPLATES_DIR, keyed by name, with prompts per species.
+
+    A file named "<name>_template.png" becomes template "<name>", offered for the
+    species in "<name>_prompts.json" next to it; "<name>_prompt_<species>" entries
+    in PROMPTS_DICT fill in species the file does not have. Templates are generated
+    with default_backend unless backends names another one for them.
+    """
+
+    def __init__(self, directory: str = TEMPLATES_DIR, default_backend: str = GENERATION_BACKEND, backends: dict = None):
+        self.directory = directory
+        self.default_backend = default_backend
+        self.backends = parse_template_backends(TEMPLATE_BACKENDS) if backends is None else backends
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        templates = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(TEMPLATE_SUFFIX):
+                continue
+            name = filename[:-len(TEMPLATE_SUFFIX)]
+            prompts = self._load_prompts(name)
+            if not prompts:
+                logger.warning("Skipping template without prompts", extra={
+                    "template": name, "prompts_file": f"{name}{PROMPTS_SUFFIX}"})
+                continue
+            path = os.path.join(self.directory, filename)
+            mask_path = os.path.join(self.directory, f"{name}{MASK_SUFFIX}")
+            mask_bytes = None
+            if os.path.exists(mask_path):
+                with open(mask_path, "rb") as f:
+                    mask_bytes = f.read()
+            backend = self.backends.get(name, self.default_backend)
+            templates[name] = Template(name, path, prepare_model_input(path), prompts, backend, mask_bytes)
+
+        self._templates = templates
+        return templates
+
+    def _load_prompts(self, name: str) -> dict:
+        """
+        Return species -> prompt text for a template, raising ValueError for a malformed prompts file.
+        """
+        prompts = {}
+        prompts_path = os.path.join(self.directory, f"{name}{PROMPTS_SUFFIX}")
+        if os.path.exists(prompts_path):
+            try:
+                with open(prompts_path, encoding="utf-8") as f:
+                    prompts = json.load(f)
+            except ValueError as e:
+                raise ValueError(f"Invalid prompts file {prompts_path}: {e}")
+            if not isinstance(prompts, dict) or not all(isinstance(text, str) and text.strip() for text in prompts.values()):
+                raise ValueError(f"Invalid prompts file {prompts_path}, expected an object of species to prompt text")
+            unknown = sorted(set(prompts) - set(SPECIES))
+            if unknown:
+                logger.warning("Ignoring prompts for unsupported species", extra={"template": name, "species": unknown})
+
+        return {
+            species: prompts.get(species) or PROMPTS_DICT[f"{name}_prompt_{species}"]
+            for species in SPECIES
+            if species in prompts or f"{name}_prompt_{species}" in PROMPTS_DICT
+        }
+
+    def _loaded(self) -> dict:
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    self.load()
+        return self._templates
+
+    def names(self):
+        return list(self._loaded())
+
+    def get(self, name: str) -> Template:
+        """
+        Return a template by name, raising KeyError when it is unknown.
+        """
+        return self._loaded()[name]
+
+    def prompt_key(self, name: str, species: str) -> str:
+        """
+        Return the prompt key for a template and species, raising KeyError when unsupported.
+        """
+        return self.get(name).prompt_keys[species]
+
+
+registry = TemplateRegistry()
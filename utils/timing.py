@@ -0,0 +1,25 @@
+import time
+from contextlib import contextmanager
+
+
+class StageTimer:
+    """
+    Collect wall-clock durations of named request stages.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - start) * 1000
+
+    def server_timing_header(self) -> str:
+        """
+        Format the recorded stages as a Server-Timing header value (milliseconds).
+        """
+        return ", ".join(f"{name};dur={duration:.1f}" for name, duration in self.stages.items())
@@ -0,0 +1,145 @@
+import functools
+import inspect
+import logging
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from utils.logs import request_id_var
+from utils.metrics import DB_QUERY_SECONDS, HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_PROGRESS, OPERATION_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Incoming X-Request-ID values are kept when they look like ids, otherwise replaced
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._-]{1,64}")
+_STATEMENT_TYPES = {"SELECT", "INSERT", "UPDATE", "DELETE", "BEGIN", "COMMIT", "ROLLBACK"}
+
+
+@contextmanager
+def span(operation: str, **fields):
+    """
+    Time a block as operation_duration_seconds{operation, outcome} and log it at debug level.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        duration = time.perf_counter() - start
+        OPERATION_SECONDS.labels(operation, outcome).observe(duration)
+        logger.debug("span", extra={"span": operation, "outcome": outcome, "duration_ms": round(duration * 1000, 2), **fields})
+
+
+def traced(operation: str):
+    """
+    Decorator form of span() for plain and async functions.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(operation):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(sync_engine, engine_name: str):
+    """
+    Record every statement an engine executes in db_query_duration_seconds.
+    """
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        DB_QUERY_SECONDS.labels(engine_name, keyword if keyword in _STATEMENT_TYPES else "OTHER").observe(
+            time.perf_counter() - start
+        )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # The matching after_cursor_execute never fires for a failed statement
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+class RequestInstrumentationMiddleware:
+    """
+    ASGI middleware: request ids, per-route latency histograms and one JSON access log line per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _route_path(scope) -> str:
+        """
+        Path template of the matched route, e.g. "/api/v1/models/generate-image/{job_id}".
+
+        Routes of included routers only know their own part of the path, so the
+        router prefix is taken from the request path.
+        """
+        template = getattr(scope.get("route"), "path_format", None)
+        if template is None:
+            return "unmatched"
+        return scope["path"].rsplit("/", template.count("/"))[0] + template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if _REQUEST_ID_RE.fullmatch(candidate):
+                    request_id = candidate
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        method = scope["method"]
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method)
+        in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            in_progress.dec()
+            duration = time.perf_counter() - start
+            # Label by template rather than raw path so ids do not explode the series count
+            route_path = self._route_path(scope)
+            HTTP_REQUEST_SECONDS.labels(method, route_path, str(status_code)).observe(duration)
+            logger.info("request", extra={
+                "method": method,
+                "path": scope.get("path"),
+                "route": route_path,
+                "status": status_code,
+                "duration_ms": round(duration * 1000, 2),
+            })
+            request_id_var.reset(token)